@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DefaultUserAdmin
 from django_summernote.admin import SummernoteModelAdmin
-from .models import UserProfile, TrainingPlan, Comment
+from .models import UserProfile, TrainingPlan, Comment, PlanGenerationBatch
 
 
 # --- Custom User Admin to include UserProfile inline ---
@@ -30,9 +30,9 @@ class TrainingPlanAdmin(SummernoteModelAdmin):
         "plan_summary",
         "progress_comment",
     )
-    list_display = ("plan_title", "user", "goal_type", "start_date")
+    list_display = ("plan_title", "user", "goal_type", "status", "start_date")
     search_fields = ("plan_title", "user__user__username")
-    list_filter = ("goal_type", "start_date")
+    list_filter = ("goal_type", "status", "start_date")
 
 
 @admin.register(Comment)
@@ -41,3 +41,9 @@ class CommentAdmin(SummernoteModelAdmin):
     list_display = ("author", "profile", "plan", "created_at", "approved")
     search_fields = ("author__username", "content")
     list_filter = ("approved", "created_at")
+
+
+@admin.register(PlanGenerationBatch)
+class PlanGenerationBatchAdmin(admin.ModelAdmin):
+    list_display = ("batch_id", "submitted_at", "completed_at")
+    list_filter = ("completed_at",)
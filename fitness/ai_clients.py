@@ -0,0 +1,76 @@
+"""Per-process registry of pooled Anthropic clients.
+
+Each Celery worker process builds one client (and so one httpx connection
+pool) when it starts, and reuses it for every plan it generates instead
+of paying a new TLS handshake per task.
+"""
+
+import os
+import logging
+import httpx
+from anthropic import (
+    Anthropic,
+    AsyncAnthropic,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+)
+from celery.signals import worker_process_init, worker_process_shutdown
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def _api_key():
+    return os.getenv("CLAUDE_API_KEY", settings.CLAUDE_API_KEY)
+
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=settings.ANTHROPIC_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.ANTHROPIC_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_anthropic_client():
+    """Return this process's shared synchronous client."""
+    if "sync" not in _registry:
+        _registry["sync"] = Anthropic(
+            api_key=_api_key(),
+            http_client=DefaultHttpxClient(limits=_pool_limits()),
+        )
+    return _registry["sync"]
+
+
+def new_async_anthropic_client():
+    """Build a pooled async client.
+
+    httpx async pools are tied to the event loop that created them, so
+    callers create one per ``asyncio.run`` and share it across the
+    coroutines inside it.
+    """
+    return AsyncAnthropic(
+        api_key=_api_key(),
+        http_client=DefaultAsyncHttpxClient(limits=_pool_limits()),
+    )
+
+
+def close_clients():
+    client = _registry.pop("sync", None)
+    if client is not None:
+        client.close()
+
+
+@worker_process_init.connect
+def init_worker_clients(**kwargs):
+    # A client inherited from the parent across fork would share sockets
+    _registry.clear()
+    get_anthropic_client()
+    logger.info("Anthropic client pool initialised for worker process")
+
+
+@worker_process_shutdown.connect
+def close_worker_clients(**kwargs):
+    close_clients()
@@ -0,0 +1,190 @@
+"""Redis cache backend with a small per-process in-memory tier in front.
+
+Reads are served from the local tier (L1) when possible and fall back to
+Redis (L2). L1 entries live for at most ``L1_TIMEOUT`` seconds, which
+bounds how stale another process's write can look, and the least
+recently used are evicted beyond ``L1_MAX_ENTRIES``.
+
+``get_or_set`` only lets one caller recompute a missing key at a time;
+the others wait briefly for the value instead of all hitting the
+database together.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache, RedisCacheClient
+from .instrumentation import record_cache_lookup
+
+_MISSING = object()
+
+
+class LocalLRU:
+    """Thread-safe, size-bounded store of pickled values with expiry."""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, pickled = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout):
+        # timeout is the Redis TTL: None means persistent, 0 means gone
+        if timeout == 0 or self.max_entries <= 0:
+            self.delete(key)
+            return
+        ttl = self.timeout if timeout is None else min(timeout, self.timeout)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, pickled)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TwoTierCacheClient(RedisCacheClient):
+    def __init__(self, servers, l1_max_entries, l1_timeout, **options):
+        super().__init__(servers, **options)
+        self.l1 = LocalLRU(l1_max_entries, l1_timeout)
+
+    def get(self, key, default):
+        value = self.l1.get(key)
+        if value is not _MISSING:
+            return value
+        value = super().get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        # Only the Redis TTL is unknown here, so cache for the L1 timeout
+        self.l1.set(key, value, None)
+        return value
+
+    def get_many(self, keys):
+        found = {}
+        remote = []
+        for key in keys:
+            value = self.l1.get(key)
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        if remote:
+            for key, value in super().get_many(remote).items():
+                self.l1.set(key, value, None)
+                found[key] = value
+        return found
+
+    def set(self, key, value, timeout):
+        super().set(key, value, timeout)
+        self.l1.set(key, value, timeout)
+
+    def add(self, key, value, timeout):
+        added = super().add(key, value, timeout)
+        if added:
+            self.l1.set(key, value, timeout)
+        return added
+
+    def set_many(self, data, timeout):
+        super().set_many(data, timeout)
+        for key, value in data.items():
+            self.l1.set(key, value, timeout)
+
+    def delete(self, key):
+        self.l1.delete(key)
+        return super().delete(key)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.l1.delete(key)
+        return super().delete_many(keys)
+
+    def touch(self, key, timeout):
+        self.l1.delete(key)
+        return super().touch(key, timeout)
+
+    def incr(self, key, delta):
+        self.l1.delete(key)
+        return super().incr(key, delta)
+
+    def clear(self):
+        self.l1.clear()
+        return super().clear()
+
+
+class TwoTierRedisCache(RedisCache):
+    """RedisCache with an optional per-process L1 and stampede protection.
+
+    Extra OPTIONS: ``L1_MAX_ENTRIES`` (0 disables the L1), ``L1_TIMEOUT``
+    seconds, ``STAMPEDE_LOCK_TIMEOUT`` (longest a recomputation may hold
+    its lock) and ``STAMPEDE_WAIT`` (how long other callers wait for it).
+    """
+
+    def __init__(self, server, params):
+        options = dict(params.get("OPTIONS", {}))
+        l1_max_entries = options.pop("L1_MAX_ENTRIES", 1000)
+        l1_timeout = options.pop("L1_TIMEOUT", 5)
+        self.stampede_lock_timeout = options.pop("STAMPEDE_LOCK_TIMEOUT", 30)
+        self.stampede_wait = options.pop("STAMPEDE_WAIT", 5)
+        super().__init__(server, dict(params, OPTIONS=options))
+        self._class = TwoTierCacheClient
+        self._options = dict(
+            options, l1_max_entries=l1_max_entries, l1_timeout=l1_timeout
+        )
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version=version)
+        hit = value is not _MISSING
+        record_cache_lookup(hits=int(hit), misses=int(not hit))
+        return value if hit else default
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = super().get_many(keys, version=version)
+        record_cache_lookup(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self.get(key, _MISSING, version=version)
+        if value is not _MISSING:
+            return value
+        lock_key = f"{key}:recompute-lock"
+        if self.add(lock_key, 1, self.stampede_lock_timeout, version=version):
+            try:
+                return self._compute_and_set(key, default, timeout, version)
+            finally:
+                self.delete(lock_key, version=version)
+        # Another process is recomputing; wait for its result
+        deadline = time.monotonic() + self.stampede_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = self.get(key, _MISSING, version=version)
+            if value is not _MISSING:
+                return value
+        return self._compute_and_set(key, default, timeout, version)
+
+    def _compute_and_set(self, key, default, timeout, version):
+        value = default() if callable(default) else default
+        if value is not None:
+            self.set(key, value, timeout, version=version)
+        return value
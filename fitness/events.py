@@ -0,0 +1,73 @@
+"""Redis pub/sub channel used to tell waiting browsers a plan is ready."""
+
+import asyncio
+import logging
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from .redis_utils import connection_kwargs, get_redis
+
+logger = logging.getLogger(__name__)
+
+# How long a browser may hold the stream open, and how often we send a
+# keep-alive comment so proxies (e.g. Heroku's 55s idle timeout) don't cut it
+STREAM_TIMEOUT_SECONDS = 600
+HEARTBEAT_SECONDS = 20
+
+
+def plan_channel(plan_id):
+    return f"plan-ready:{plan_id}"
+
+
+def publish_plan_ready(plan_id, state):
+    """Announce plan progress: 'week' when another streamed week is saved,
+    then 'ready' or 'error'. Failures are logged only - browsers fall back
+    to polling."""
+    try:
+        get_redis().publish(plan_channel(plan_id), state)
+    except redis.RedisError:
+        logger.warning("Could not publish ready event for plan %s", plan_id)
+
+
+def sse_event(event, data=""):
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def plan_ready_stream(plan_id, check_state):
+    """Yield Server-Sent Events until the plan is ready.
+
+    ``check_state`` is an async callable returning the plan's finished
+    state or None. It is re-checked after subscribing so a completion
+    published between page render and subscription isn't missed.
+    """
+    state = await check_state()
+    if state:
+        yield sse_event(state)
+        return
+
+    client = aioredis.Redis.from_url(settings.REDIS_URL, **connection_kwargs())
+    pubsub = client.pubsub()
+    try:
+        await pubsub.subscribe(plan_channel(plan_id))
+        state = await check_state()
+        if state:
+            yield sse_event(state)
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STREAM_TIMEOUT_SECONDS
+        while loop.time() < deadline:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=HEARTBEAT_SECONDS
+            )
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_event(message["data"].decode())
+            return
+        yield sse_event("timeout")
+    except redis.RedisError:
+        logger.warning("Plan event stream for plan %s lost Redis", plan_id)
+        yield sse_event("timeout")
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
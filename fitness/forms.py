@@ -115,6 +115,15 @@ class PlanGenerationForm(forms.ModelForm):
         ),
     )
 
+    fresh_plan = forms.BooleanField(
+        label="Generate a completely fresh plan",
+        required=False,
+        help_text=(
+            "Skip any previously generated plan for the same details "
+            "and ask the AI for a new one."
+        ),
+    )
+
     class Meta:
         model = TrainingPlan
         fields = ["minor_injuries", "last_plan_feedback", "plan_preferences"]
@@ -131,5 +140,32 @@ class PlanGenerationForm(forms.ModelForm):
             Field("minor_injuries"),
             Field("last_plan_feedback"),
             Field("plan_preferences"),
+            Field("fresh_plan"),
             Submit("submit", "Generate Training Plan", css_class="btn btn-primary"),
         )
+
+
+class PlanRevisionForm(forms.ModelForm):
+    """Form to revise a finished plan for changed injuries or preferences."""
+
+    class Meta:
+        model = TrainingPlan
+        fields = ["minor_injuries", "plan_preferences"]
+        widgets = {
+            "minor_injuries": forms.Textarea(attrs={"rows": 3}),
+            "plan_preferences": forms.Textarea(attrs={"rows": 3}),
+        }
+        labels = {
+            "minor_injuries": "Current minor injuries or concerns",
+            "plan_preferences": "Plan Preferences",
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.form_method = "post"
+        self.helper.layout = Layout(
+            Field("minor_injuries"),
+            Field("plan_preferences"),
+            Submit("submit", "Revise Plan", css_class="btn btn-primary"),
+        )
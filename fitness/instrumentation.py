@@ -0,0 +1,107 @@
+"""Per-request cost metrics: SQL queries, repeated queries, cache lookups
+and template rendering time.
+
+RequestMetrics.collect() switches recording on for the current request.
+The database is measured with execute wrappers, so DEBUG isn't needed.
+The cache backend and template renders report in through
+record_cache_lookup() and the installed template timer.
+"""
+
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from django.db import connections
+
+_current = ContextVar("request_metrics", default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:\?, )*\?\)", re.IGNORECASE)
+
+
+def fingerprint(sql):
+    """``sql`` with its literal values removed, so the same query run for
+    different rows (the N+1 pattern) shares one fingerprint."""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    return _IN_LIST.sub("IN (...)", " ".join(sql.split()))
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.template_time = 0.0
+        self._template_depth = 0
+
+    @contextmanager
+    def collect(self):
+        token = _current.set(self)
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(self._time_query))
+                yield self
+        finally:
+            _current.reset(token)
+
+    def _time_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold=2):
+        """Fingerprints run at least ``threshold`` times, most first."""
+        return [
+            (sql, count)
+            for sql, count in self.fingerprints.most_common()
+            if count >= threshold
+        ]
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+
+def record_cache_lookup(hits, misses):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+def install_template_timer():
+    """Time top-level template renders. Templates rendered inside another
+    (crispy forms fields, for example) are part of the outer render."""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, "_timed", False):
+        return
+    render = Template.render
+
+    def timed_render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return render(self, context, request)
+        metrics._template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            metrics._template_depth -= 1
+            if metrics._template_depth == 0:
+                metrics.template_time += time.perf_counter() - started
+
+    timed_render._timed = True
+    Template.render = timed_render
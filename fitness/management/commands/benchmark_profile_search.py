@@ -0,0 +1,119 @@
+import random
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from fitness.models import UserProfile
+from fitness.search import build_search_document, ensure_search_index, search_profiles
+
+BENCH_PREFIX = "bench_"
+GOALS = [
+    "London Marathon",
+    "Berlin Half Marathon",
+    "Ironman Wales",
+    "Parkrun PB",
+    "Great North Run",
+    "Powerlifting meet",
+    "Tough Mudder",
+    "Couch to 5k",
+]
+WORDS = [
+    "runner",
+    "cyclist",
+    "lifter",
+    "swimmer",
+    "coach",
+    "trail",
+    "hills",
+    "tempo",
+    "recovery",
+    "strength",
+]
+QUERIES = ["marathon", "ironman", "bench_12345", "trail coach", "powerlifting"]
+
+
+def _legacy_search(query):
+    """The old per-field __icontains lookups, OR-ed together."""
+    return list(
+        UserProfile.objects.filter(user__is_active=True)
+        .filter(
+            Q(user__username__icontains=query)
+            | Q(display_name__icontains=query)
+            | Q(goal_event__icontains=query)
+            | Q(bio__icontains=query)
+        )
+        .select_related("user")
+        .order_by("user__username")[:50]
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates synthetic profiles and compares the legacy __icontains "
+        "search with the indexed, ranked search."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", type=int, default=1_000_000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--keep", action="store_true", help="Don't delete the profiles after."
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        self._create_profiles(options["profiles"], options["batch_size"], rng)
+        ensure_search_index(connection)
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE fitness_userprofile")
+
+        self.stdout.write(f"{'query':<16}{'legacy ms':>12}{'indexed ms':>12}")
+        for query in QUERIES:
+            legacy = self._median_ms(_legacy_search, query, options["repeat"])
+            indexed = self._median_ms(search_profiles, query, options["repeat"])
+            self.stdout.write(f"{query:<16}{legacy:>12.1f}{indexed:>12.1f}")
+
+        if not options["keep"]:
+            User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    def _create_profiles(self, total, batch_size, rng):
+        existing = User.objects.filter(username__startswith=BENCH_PREFIX).count()
+        for start in range(existing, total, batch_size):
+            names = [
+                f"{BENCH_PREFIX}{n}"
+                for n in range(start, min(start + batch_size, total))
+            ]
+            # bulk_create skips the post_save signal, so profiles are made below
+            users = User.objects.bulk_create([User(username=name) for name in names])
+            if users[0].pk is None:
+                users = User.objects.filter(username__in=names)
+            profiles = []
+            for user in users:
+                goal = rng.choice(GOALS)
+                bio = " ".join(rng.choices(WORDS, k=8))
+                display_name = user.username.replace("_", " ").title()
+                profiles.append(
+                    UserProfile(
+                        user=user,
+                        display_name=display_name,
+                        goal_event=goal,
+                        bio=bio,
+                        search_document=build_search_document(
+                            user.username, display_name, goal, bio
+                        ),
+                    )
+                )
+            UserProfile.objects.bulk_create(profiles)
+            self.stdout.write(f"Created {start + len(names)} of {total} profiles")
+
+    def _median_ms(self, search, query, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            search(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,283 @@
+import json
+import math
+import time
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from fitness.instrumentation import RequestMetrics
+from fitness.models import Comment, FollowRequest, TrainingPlan, UserProfile
+from fitness.urls import urlpatterns
+
+# The SSE stream stays open until the plan is ready, so it has no latency
+# to measure here
+SKIPPED = {"plan_events": "long-lived event stream"}
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def percentile(timings, pct):
+    """Nearest-rank percentile of a sorted list."""
+    index = max(0, math.ceil(pct / 100 * len(timings)) - 1)
+    return timings[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures latency percentiles and query counts for every URL in "
+        "fitness/urls.py against the current (ideally seeded) database. "
+        "Writes made by the views, and any rows created to benchmark them, "
+        "are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            metavar="USERS",
+            help="Run seed_synthetic_data with this many users first "
+            "(e.g. 1000, 100000 or 1000000).",
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument(
+            "--only", nargs="+", metavar="URL_NAME", help="Benchmark just these."
+        )
+        parser.add_argument("--json", metavar="PATH", help="Also write results here.")
+        parser.add_argument(
+            "--configured-cache",
+            action="store_true",
+            help="Use settings.CACHES instead of local memory (needs Redis).",
+        )
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            call_command(
+                "seed_synthetic_data", users=options["seed"], stdout=self.stdout
+            )
+        # cases() may create a comment and a follow request to act on; they
+        # are rolled back with everything else so runs don't accumulate rows
+        with transaction.atomic():
+            results = self.benchmark(options)
+            transaction.set_rollback(True)
+        if options["json"]:
+            with open(options["json"], "w") as fh:
+                json.dump(
+                    {"profiles": UserProfile.objects.count(), "results": results},
+                    fh,
+                    indent=2,
+                )
+
+    def benchmark(self, options):
+        cases = self.cases()
+        if options["only"]:
+            cases = [case for case in cases if case[0] in options["only"]]
+        for name, reason in SKIPPED.items():
+            self.stdout.write(f"Skipping {name}: {reason}")
+        covered = {case[0].split(" ")[0] for case in cases} | set(SKIPPED)
+        for pattern in urlpatterns:
+            if pattern.name and pattern.name not in covered:
+                self.stdout.write(
+                    self.style.WARNING(f"No benchmark for {pattern.name}")
+                )
+
+        cache_settings = {} if options["configured_cache"] else {"CACHES": LOCAL_CACHES}
+        results = []
+        # Plan requests would otherwise be sent to Celery for real
+        with (
+            override_settings(**cache_settings),
+            mock.patch("fitness.views.generate_training_plan_task.apply_async"),
+        ):
+            self.stdout.write(
+                f"{'url':<32}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+            )
+            for case in cases:
+                result = self.run_case(*case, options["repeat"], options["warmup"])
+                results.append(result)
+                self.stdout.write(
+                    f"{result['url']:<32}{result['p50_ms']:>9.1f}"
+                    f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+                    f"{result['max_queries']:>9}"
+                )
+        return results
+
+    def run_case(self, name, method, url, data, user, repeat, warmup):
+        client = Client(HTTP_HOST="localhost")
+        timings = []
+        queries = []
+        for iteration in range(warmup + repeat):
+            if user is not None:
+                client.force_login(user)
+            metrics = RequestMetrics()
+            with transaction.atomic():
+                with metrics.collect():
+                    started = time.perf_counter()
+                    response = getattr(client, method)(url, data)
+                    elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+            if response.status_code >= 400:
+                raise CommandError(f"{url} returned {response.status_code}")
+            if iteration >= warmup:
+                timings.append(elapsed * 1000)
+                queries.append(metrics.queries)
+        timings.sort()
+        return {
+            "url": name,
+            "path": url,
+            "p50_ms": round(percentile(timings, 50), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+            "p99_ms": round(percentile(timings, 99), 2),
+            "max_queries": max(queries),
+        }
+
+    def cases(self):
+        """(url name, method, path, data, user) for every fitness URL,
+        browsing as the seeded user with the most plans."""
+        viewer = (
+            UserProfile.objects.annotate(plan_total=Count("plans"))
+            .select_related("user")
+            .order_by("-plan_total", "pk")
+            .first()
+        )
+        plan = TrainingPlan.objects.filter(user=viewer).order_by("-pk").first()
+        if plan is None:
+            raise CommandError("No training plans found; run with --seed first.")
+        # The most followed profile has the biggest comment thread
+        popular = (
+            UserProfile.objects.exclude(pk=viewer.pk)
+            .select_related("user")
+            .order_by("-followers_count", "pk")
+            .first()
+        )
+        comment = Comment.objects.filter(author=viewer).first() or (
+            Comment.objects.create(author=viewer, profile=popular, content="Hi")
+        )
+        received = Comment.objects.filter(profile=viewer).first() or (
+            Comment.objects.create(author=popular, profile=viewer, content="Hi")
+        )
+        follow, _ = FollowRequest.objects.get_or_create(
+            from_user=popular, to_user=viewer
+        )
+        user = viewer.user
+        username = user.username
+        plan_form = {"goal_type": "combined", "target_event": "10k"}
+        return [
+            ("home", "get", reverse("home"), None, None),
+            ("signup", "get", reverse("signup"), None, None),
+            ("login", "get", reverse("login"), None, None),
+            ("logout", "post", reverse("logout"), None, user),
+            ("accounts_profile", "get", "/accounts/profile/", None, user),
+            ("profile_list", "get", reverse("profile_list"), None, None),
+            ("edit_profile", "get", reverse("edit_profile"), None, user),
+            (
+                "profile_detail",
+                "get",
+                reverse("profile_detail", args=[popular.user.username]),
+                None,
+                user,
+            ),
+            (
+                "profile_detail (own)",
+                "get",
+                reverse("profile_detail", args=[username]),
+                None,
+                user,
+            ),
+            (
+                "edit_comment",
+                "get",
+                reverse("edit_comment", args=[comment.pk]),
+                None,
+                user,
+            ),
+            (
+                "delete_comment",
+                "post",
+                reverse("delete_comment", args=[comment.pk]),
+                None,
+                user,
+            ),
+            (
+                "approve_comment",
+                "post",
+                reverse("approve_comment", args=[received.pk]),
+                None,
+                user,
+            ),
+            (
+                "add_comment",
+                "post",
+                reverse("add_comment", args=[popular.pk]),
+                {"content": "Benchmark comment"},
+                user,
+            ),
+            (
+                "add_comment (reply)",
+                "post",
+                reverse("add_comment", args=[received.profile_id, received.pk]),
+                {"content": "Benchmark reply"},
+                user,
+            ),
+            (
+                "send_follow_request",
+                "post",
+                reverse("send_follow_request", args=[popular.pk]),
+                None,
+                user,
+            ),
+            (
+                "approve_follow_request",
+                "post",
+                reverse("approve_follow_request", args=[follow.pk]),
+                None,
+                user,
+            ),
+            (
+                "create_training_plan",
+                "get",
+                reverse("create_training_plan"),
+                None,
+                user,
+            ),
+            (
+                "create_training_plan (post)",
+                "post",
+                reverse("create_training_plan"),
+                plan_form,
+                user,
+            ),
+            ("previous_plans", "get", reverse("previous_plans"), None, user),
+            ("plan_detail", "get", reverse("plan_detail", args=[plan.pk]), None, user),
+            ("plan_status", "get", reverse("plan_status", args=[plan.pk]), None, user),
+            ("revise_plan", "get", reverse("revise_plan", args=[plan.pk]), None, user),
+            (
+                "delete_plan_and_retry",
+                "post",
+                reverse("delete_plan_and_retry", args=[plan.pk]),
+                None,
+                user,
+            ),
+            (
+                "search_profiles",
+                "get",
+                reverse("search_profiles"),
+                {"q": "trail"},
+                None,
+            ),
+            (
+                "search_profiles_by_username",
+                "get",
+                reverse("search_profiles_by_username"),
+                {"q": "synth_00001"},
+                None,
+            ),
+            (
+                "search_profiles_by_goal_event",
+                "get",
+                reverse("search_profiles_by_goal_event"),
+                {"q": "marathon"},
+                None,
+            ),
+        ]
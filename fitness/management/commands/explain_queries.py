@@ -0,0 +1,148 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from fitness.models import FollowRequest, TrainingPlan, UserProfile
+
+# Plan nodes that read a whole table rather than an index
+SCAN_MARKERS = {
+    "postgresql": ("Seq Scan",),
+    "sqlite": ("SCAN ",),
+}
+INDEX_MARKERS = {
+    "postgresql": ("Index Scan", "Index Only Scan", "Bitmap Index Scan"),
+    "sqlite": (
+        "USING INDEX",
+        "USING COVERING INDEX",
+        "USING INTEGER PRIMARY KEY",
+        "VIRTUAL TABLE INDEX",  # the FTS5 search index
+    ),
+}
+
+
+def explain(sql):
+    """Return the query plan for ``sql`` as a list of lines."""
+    prefix = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        rows = cursor.fetchall()
+    # SQLite's detail is the last column, Postgres has a single column
+    return [str(row[-1]) for row in rows]
+
+
+def classify(plan):
+    """Returns "scan" if any step of ``plan`` reads a full table, else
+    "index" (or "other" when neither shows up, e.g. a constant query)."""
+    scans = SCAN_MARKERS.get(connection.vendor, ())
+    indexes = INDEX_MARKERS.get(connection.vendor, ())
+    for line in plan:
+        # SQLite reports "SCAN t USING COVERING INDEX" for index-only scans
+        if any(marker in line for marker in scans) and not any(
+            marker in line for marker in indexes
+        ):
+            return "scan"
+    if any(marker in line for line in plan for marker in indexes):
+        return "index"
+    return "other"
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests each main page as a seeded user, runs EXPLAIN on every "
+        "SELECT it makes and reports whether it uses an index or a scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username",
+            help="User to browse as. Defaults to the one with the most plans.",
+        )
+        parser.add_argument(
+            "--verbose-plans", action="store_true", help="Print each full plan."
+        )
+
+    def handle(self, *args, **options):
+        viewer = self._viewer(options["username"])
+        plan = viewer.plans.order_by("-start_date").first()
+        # Someone the viewer follows, so profile_detail loads the comment thread
+        followed = (
+            FollowRequest.objects.filter(from_user=viewer, accepted=True)
+            .select_related("to_user__user")
+            .first()
+        )
+        other = followed.to_user if followed else viewer
+
+        pages = {
+            "profile_list": (reverse("profile_list"), False),
+            "profile_detail (own)": (
+                reverse("profile_detail", args=[viewer.user.username]),
+                True,
+            ),
+            "profile_detail (other)": (
+                reverse("profile_detail", args=[other.user.username]),
+                True,
+            ),
+            "previous_plans": (reverse("previous_plans"), True),
+            "create_training_plan": (reverse("create_training_plan"), True),
+            "search_profiles": (reverse("search_profiles") + "?q=run", True),
+        }
+        if plan:
+            pages["plan_detail"] = (reverse("plan_detail", args=[plan.pk]), True)
+            pages["plan_status"] = (reverse("plan_status", args=[plan.pk]), True)
+
+        if connection.vendor == "postgresql":
+            # Fresh statistics, or the planner may scan tables it thinks tiny
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+        totals = {"index": 0, "scan": 0, "other": 0}
+        for name, (url, logged_in) in pages.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name}: {url}"))
+            for sql in self._selects(url, viewer.user if logged_in else None):
+                plan_lines = explain(sql)
+                verdict = classify(plan_lines)
+                totals[verdict] += 1
+                style = self.style.ERROR if verdict == "scan" else self.style.SUCCESS
+                self.stdout.write(f"  {style(verdict.upper()):<7} {sql[:110]}")
+                if options["verbose_plans"] or verdict == "scan":
+                    for line in plan_lines:
+                        self.stdout.write(f"      {line}")
+        self.stdout.write(
+            f"{totals['index']} indexed, {totals['scan']} scans, "
+            f"{totals['other']} other queries."
+        )
+
+    def _viewer(self, username):
+        profiles = UserProfile.objects.select_related("user")
+        if username:
+            try:
+                return profiles.get(user__username=username)
+            except UserProfile.DoesNotExist:
+                raise CommandError(f"No profile for user '{username}'.")
+        viewer = (
+            TrainingPlan.objects.values("user")
+            .order_by()
+            .annotate(total=Count("pk"))
+            .order_by("-total")
+            .values_list("user", flat=True)
+            .first()
+        )
+        if viewer is None:
+            raise CommandError("No training plans found; seed the database first.")
+        return profiles.get(pk=viewer)
+
+    def _selects(self, url, user):
+        client = Client(HTTP_HOST="localhost")
+        if user is not None:
+            client.force_login(user)
+        with CaptureQueriesContext(connection) as captured:
+            client.get(url)
+        # The session lookup is the same on every page, so skip it
+        return [
+            query["sql"]
+            for query in captured.captured_queries
+            if query["sql"].lstrip().upper().startswith("SELECT")
+            and "django_session" not in query["sql"]
+        ]
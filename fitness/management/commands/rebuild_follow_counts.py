@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from fitness.models import UserProfile, FollowRequest
+
+
+def _accepted_count(field):
+    """Subquery counting accepted follow requests where ``field`` is the
+    outer profile."""
+    return Coalesce(
+        Subquery(
+            FollowRequest.objects.filter(accepted=True, **{field: OuterRef("pk")})
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total"),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the follower/following counters on every UserProfile."
+
+    def handle(self, *args, **options):
+        updated = UserProfile.objects.update(
+            followers_count=_accepted_count("to_user"),
+            following_count=_accepted_count("from_user"),
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt counters for {updated} profiles.")
+        )
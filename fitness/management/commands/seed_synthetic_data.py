@@ -0,0 +1,277 @@
+import random
+from datetime import date, timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from fitness.models import Comment, FollowRequest, TrainingPlan, UserProfile
+from fitness.plan_summary import summarise_plan
+from fitness.search import build_search_document
+
+SYNTHETIC_PREFIX = "synth_"
+GOALS = [
+    "London Marathon",
+    "Manchester Half Marathon",
+    "Ironman 70.3",
+    "Parkrun PB",
+    "Great North Run",
+    "First pull-up",
+    "Powerlifting meet",
+    "Hyrox",
+    "Couch to 5k",
+    "",
+]
+BIO_WORDS = (
+    "runner cyclist lifter swimmer parent coach trail hills tempo recovery "
+    "strength mobility knee ankle weekends early mornings gym home"
+).split()
+EXERCISES = {
+    "strength": ["Back Squat", "Deadlift", "Bench Press", "Lunges", "Rows", "Plank"],
+    "cardio": ["Easy Run", "Tempo Run", "Intervals", "Bike", "Swim", "Long Run"],
+    "flexibility": ["Hip Mobility", "Yoga Flow", "Hamstring Stretch"],
+}
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+COMMENTS = [
+    "Great progress!",
+    "How did the long run feel?",
+    "Good luck on race day.",
+    "Love this plan, might steal it.",
+    "Rest days matter too!",
+]
+
+
+def synthetic_plan_json(rng, days_per_week):
+    """A two-week plan shaped like the ones Claude returns."""
+    training_days = sorted(rng.sample(range(7), days_per_week))
+    weeks = []
+    for week_number in (1, 2):
+        days = []
+        for index, day in enumerate(DAYS):
+            if index not in training_days:
+                workout = [
+                    {
+                        "exercise": "Rest Day",
+                        "type": "rest",
+                        "sets": None,
+                        "reps": None,
+                        "intensity": None,
+                    }
+                ]
+            else:
+                workout = []
+                for _ in range(rng.randint(3, 6)):
+                    kind = rng.choice(list(EXERCISES))
+                    cardio = kind == "cardio"
+                    workout.append(
+                        {
+                            "exercise": rng.choice(EXERCISES[kind]),
+                            "type": kind,
+                            "sets": None if cardio else rng.randint(2, 5),
+                            "reps": f"{rng.randint(3, 10)} km" if cardio else "8-12",
+                            "intensity": rng.randint(4, 9),
+                        }
+                    )
+            days.append({"day": day, "workout": workout})
+        weeks.append({"week_number": week_number, "days": days})
+    return {
+        "plan_title": f"{days_per_week}-day training block",
+        "plan_summary": "Two progressive weeks building towards the goal event.",
+        "plan_weeks": weeks,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-creates synthetic users, profiles, a power-law follow graph, "
+        "threaded comments and training plans for benchmarking."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--max-following",
+            type=int,
+            default=200,
+            help="Upper bound on how many profiles one user follows.",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--flush",
+            action="store_true",
+            help="Delete previously generated synthetic data and stop.",
+        )
+
+    def handle(self, *args, **options):
+        if options["flush"]:
+            deleted, _ = User.objects.filter(
+                username__startswith=SYNTHETIC_PREFIX
+            ).delete()
+            self.stdout.write(f"Deleted {deleted} synthetic rows.")
+            return
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        profile_ids = self.create_profiles(options["users"])
+        self.create_follows(profile_ids, options["max_following"])
+        self.create_comments(profile_ids)
+        self.create_plans(profile_ids)
+        call_command("rebuild_follow_counts", stdout=self.stdout)
+
+    def batches(self, items):
+        for start in range(0, len(items), self.batch_size):
+            yield items[start : start + self.batch_size]
+
+    def create_profiles(self, total):
+        start = User.objects.filter(username__startswith=SYNTHETIC_PREFIX).count()
+        # Hashing once keeps a million users from taking a million hashes
+        password = make_password("synthetic-password")
+        names = [f"{SYNTHETIC_PREFIX}{n:07d}" for n in range(start, start + total)]
+        profile_ids = []
+        for batch in self.batches(names):
+            with transaction.atomic():
+                users = User.objects.bulk_create(
+                    [User(username=name, password=password) for name in batch]
+                )
+                if users[0].pk is None:  # backends without RETURNING
+                    users = list(User.objects.filter(username__in=batch))
+                profiles = []
+                for user in users:
+                    display_name = user.username.replace("_", " ").title()
+                    goal = self.rng.choice(GOALS)
+                    bio = " ".join(
+                        self.rng.choices(BIO_WORDS, k=self.rng.randint(4, 20))
+                    )
+                    profiles.append(
+                        UserProfile(
+                            user=user,
+                            display_name=display_name,
+                            goal_event=goal,
+                            bio=bio,
+                            exercise_days_per_week=self.rng.randint(2, 6),
+                            search_document=build_search_document(
+                                user.username, display_name, goal, bio
+                            ),
+                        )
+                    )
+                profiles = UserProfile.objects.bulk_create(profiles)
+            if profiles[0].pk is None:
+                profiles = UserProfile.objects.filter(user__in=users)
+            profile_ids.extend(profile.pk for profile in profiles)
+            self.stdout.write(f"Created {len(profile_ids)} profiles")
+        return profile_ids
+
+    def create_follows(self, profile_ids, max_following):
+        """Each user follows a Pareto-distributed number of profiles, picked
+        with Zipf weights, so a few profiles have most of the followers."""
+        if len(profile_ids) < 2:
+            return
+        popularity = list(profile_ids)
+        self.rng.shuffle(popularity)
+        cum_weights = []
+        running = 0.0
+        for rank in range(1, len(popularity) + 1):
+            running += 1 / rank
+            cum_weights.append(running)
+        pending = []
+        created = 0
+        for from_id in profile_ids:
+            count = min(int(self.rng.paretovariate(1.2)), max_following)
+            targets = set(
+                self.rng.choices(popularity, cum_weights=cum_weights, k=count)
+            )
+            targets.discard(from_id)
+            pending.extend(
+                FollowRequest(
+                    from_user_id=from_id,
+                    to_user_id=to_id,
+                    accepted=self.rng.random() < 0.85,
+                )
+                for to_id in targets
+            )
+            if len(pending) >= self.batch_size:
+                created += self.flush_follows(pending)
+        created += self.flush_follows(pending)
+        self.stdout.write(f"Created {created} follow requests")
+
+    def flush_follows(self, pending):
+        FollowRequest.objects.bulk_create(pending, ignore_conflicts=True)
+        count = len(pending)
+        pending.clear()
+        return count
+
+    def create_comments(self, profile_ids):
+        """Threads on about a fifth of profiles: top-level comments with a
+        few levels of replies, some still waiting for approval."""
+        now = timezone.now()
+        created = 0
+        targets = self.rng.sample(profile_ids, max(1, len(profile_ids) // 5))
+        for batch in self.batches(targets):
+            top_level = [
+                self.comment(profile_id, profile_ids)
+                for profile_id in batch
+                for _ in range(self.rng.randint(1, 6))
+            ]
+            level = Comment.objects.bulk_create(top_level)
+            # auto_now_add stamps them all now; spread them over a year
+            for comment in level:
+                comment.created_at = now - timedelta(
+                    minutes=self.rng.randint(0, 525600)
+                )
+            thread = list(level)
+            for _depth in range(self.rng.randint(0, 3)):
+                replies = []
+                for parent in level:
+                    for _ in range(self.rng.randint(0, 2)):
+                        reply = self.comment(parent.profile_id, profile_ids)
+                        reply.parent = parent
+                        replies.append(reply)
+                if not replies:
+                    break
+                level = Comment.objects.bulk_create(replies)
+                for reply in level:
+                    reply.created_at = min(
+                        now,
+                        reply.parent.created_at
+                        + timedelta(minutes=self.rng.randint(1, 4320)),
+                    )
+                thread.extend(level)
+            Comment.objects.bulk_update(thread, ["created_at"])
+            created += len(thread)
+        self.stdout.write(f"Created {created} comments")
+
+    def comment(self, profile_id, profile_ids):
+        return Comment(
+            profile_id=profile_id,
+            author_id=self.rng.choice(profile_ids),
+            content=self.rng.choice(COMMENTS),
+            approved=self.rng.random() < 0.9,
+        )
+
+    def create_plans(self, profile_ids):
+        today = date.today()
+        created = 0
+        for batch in self.batches(profile_ids):
+            plans = []
+            for profile_id in batch:
+                for _ in range(self.rng.choice([0, 1, 1, 2, 3, 5])):
+                    plan_json = synthetic_plan_json(self.rng, self.rng.randint(2, 6))
+                    plans.append(
+                        TrainingPlan(
+                            user_id=profile_id,
+                            plan_json=plan_json,
+                            plan_title=plan_json["plan_title"],
+                            plan_summary=plan_json["plan_summary"],
+                            target_event=self.rng.choice(GOALS),
+                            plan_version=1,
+                            **summarise_plan(plan_json),
+                        )
+                    )
+            plans = TrainingPlan.objects.bulk_create(plans)
+            # auto_now_add stamps them all today; spread them over a year
+            for plan in plans:
+                plan.start_date = today - timedelta(days=self.rng.randint(0, 365))
+            TrainingPlan.objects.bulk_update(plans, ["start_date"])
+            created += len(plans)
+        self.stdout.write(f"Created {created} training plans")
@@ -0,0 +1,95 @@
+"""Request instrumentation middleware.
+
+Records SQL, cache and template cost for a sample of requests and
+reports it as a ``Server-Timing`` header (visible in the browser's
+network panel) and as one structured log line per request.
+"""
+
+import logging
+import random
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from .instrumentation import RequestMetrics, install_template_timer
+
+logger = logging.getLogger("fitness.request_metrics")
+
+
+class RequestMetricsMiddleware:
+    """Enabled with REQUEST_METRICS_ENABLED; REQUEST_METRICS_SAMPLE_RATE
+    is the fraction of requests measured. Runs natively under ASGI so the
+    async plan_events view isn't forced through a sync adapter."""
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_METRICS_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, "REQUEST_METRICS_SAMPLE_RATE", 1.0)
+        self.duplicate_threshold = getattr(
+            settings, "REQUEST_METRICS_DUPLICATE_THRESHOLD", 2
+        )
+        install_template_timer()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        with metrics.collect():
+            response = self.get_response(request)
+        self.report(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        metrics = RequestMetrics()
+        with metrics.collect():
+            response = await self.get_response(request)
+        self.report(request, response, metrics)
+        return response
+
+    def report(self, request, response, metrics):
+        duplicates = metrics.duplicates(self.duplicate_threshold)
+        repeated = sum(count for _, count in duplicates)
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+                f'dup;desc="{repeated} repeated queries"',
+                f'cache;desc="{metrics.cache_hits} hits {metrics.cache_misses} misses"',
+                f"tpl;dur={metrics.template_time * 1000:.1f}",
+                f"total;dur={metrics.total_time * 1000:.1f}",
+            ]
+        )
+        match = request.resolver_match
+        fields = {
+            "method": request.method,
+            "path": request.path,
+            "view": match.view_name if match else None,
+            "status": response.status_code,
+            "queries": metrics.queries,
+            "db_ms": round(metrics.db_time * 1000, 1),
+            "repeated_queries": repeated,
+            "cache_hits": metrics.cache_hits,
+            "cache_misses": metrics.cache_misses,
+            "template_ms": round(metrics.template_time * 1000, 1),
+            "total_ms": round(metrics.total_time * 1000, 1),
+        }
+        logger.info(
+            " ".join(f"{key}={value}" for key, value in fields.items()),
+            extra={"request_metrics": fields},
+        )
+        for sql, count in duplicates:
+            logger.warning(
+                "Query repeated %s times on %s: %s",
+                count,
+                fields["view"],
+                sql[:300],
+                extra={"request_metrics": dict(fields, fingerprint=sql, count=count)},
+            )
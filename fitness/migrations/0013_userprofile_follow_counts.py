@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_follow_counts(apps, schema_editor):
+    UserProfile = apps.get_model("fitness", "UserProfile")
+    FollowRequest = apps.get_model("fitness", "FollowRequest")
+    accepted = FollowRequest.objects.filter(accepted=True)
+    for row in accepted.values("to_user").annotate(total=Count("pk")):
+        UserProfile.objects.filter(pk=row["to_user"]).update(
+            followers_count=row["total"]
+        )
+    for row in accepted.values("from_user").annotate(total=Count("pk")):
+        UserProfile.objects.filter(pk=row["from_user"]).update(
+            following_count=row["total"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fitness", "0012_remove_userprofile_age_remove_userprofile_gender_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userprofile",
+            name="followers_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="userprofile",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_follow_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fitness", "0013_userprofile_follow_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trainingplan",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fitness", "0014_trainingplan_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PlanGenerationBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("batch_id", models.CharField(max_length=100, unique=True)),
+                ("plan_ids", models.JSONField(default=list)),
+                ("submitted_at", models.DateTimeField(auto_now_add=True)),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fitness", "0015_plangenerationbatch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trainingplan",
+            name="plan_version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:10
+
+from django.db import migrations, models
+from fitness.search import (
+    build_search_document,
+    drop_search_index,
+    ensure_search_index,
+)
+
+
+def backfill_search_documents(apps, schema_editor):
+    UserProfile = apps.get_model("fitness", "UserProfile")
+    profiles = UserProfile.objects.select_related("user")
+    for profile in profiles.iterator(chunk_size=1000):
+        profile.search_document = build_search_document(
+            profile.user.username,
+            profile.display_name,
+            profile.goal_event,
+            profile.bio,
+        )
+        profile.save(update_fields=["search_document"])
+
+
+def create_search_index(apps, schema_editor):
+    ensure_search_index(schema_editor.connection)
+
+
+def remove_search_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fitness", "0016_trainingplan_plan_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userprofile",
+            name="search_document",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
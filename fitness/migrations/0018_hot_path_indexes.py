@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fitness", "0017_userprofile_search_document"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("approved", True), ("parent__isnull", True)),
+                fields=["profile", "-created_at"],
+                name="comment_profile_thread_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="followrequest",
+            index=models.Index(
+                fields=["to_user", "accepted"], name="follow_to_accepted_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="followrequest",
+            index=models.Index(
+                fields=["from_user", "accepted"], name="follow_from_accepted_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trainingplan",
+            index=models.Index(
+                fields=["user", "-start_date", "-id"], name="plan_user_start_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trainingplan",
+            index=models.Index(
+                fields=["user", "-target_date"], name="plan_user_target_idx"
+            ),
+        ),
+    ]
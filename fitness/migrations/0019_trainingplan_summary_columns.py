@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:15
+
+from django.db import migrations, models
+from fitness.plan_summary import summarise_plan
+
+
+def backfill_plan_summaries(apps, schema_editor):
+    TrainingPlan = apps.get_model("fitness", "TrainingPlan")
+    for plan in TrainingPlan.objects.only("plan_json").iterator(chunk_size=500):
+        summary = summarise_plan(plan.plan_json)
+        TrainingPlan.objects.filter(pk=plan.pk).update(**summary)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fitness", "0018_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trainingplan",
+            name="average_intensity",
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="trainingplan",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("generating", "Generating"),
+                    ("ready", "Ready"),
+                    ("error", "Failed"),
+                ],
+                default="pending",
+                editable=False,
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="trainingplan",
+            name="total_sets",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="trainingplan",
+            name="training_day_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="trainingplan",
+            name="week_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_plan_summaries, migrations.RunPython.noop),
+    ]
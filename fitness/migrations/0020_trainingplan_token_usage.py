@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fitness", "0019_trainingplan_summary_columns"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trainingplan",
+            name="cache_read_tokens",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="trainingplan",
+            name="cache_write_tokens",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="trainingplan",
+            name="input_tokens",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="trainingplan",
+            name="output_tokens",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
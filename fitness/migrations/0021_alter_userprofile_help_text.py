@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fitness", "0020_trainingplan_token_usage"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="userprofile",
+            name="equipment_text",
+            field=models.TextField(
+                blank=True,
+                help_text="List your available equipment (e.g., dumbbells 5–12kg, resistance bands medium, bike etc.)",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="userprofile",
+            name="injuries_and_limitations",
+            field=models.TextField(
+                blank=True,
+                help_text="Describe any long-term injuries or mobility limitations.",
+                null=True,
+            ),
+        ),
+    ]
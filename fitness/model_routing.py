@@ -0,0 +1,217 @@
+"""Model choice, deadlines and hedging for plan generation calls.
+
+Simple requests go to PLAN_MODEL_FAST. Requests that score at least
+PLAN_COMPLEXITY_THRESHOLD (many training days, injuries, feedback to
+act on) go to PLAN_MODEL_COMPLEX. Each model's call latencies are kept in
+hourly Redis histograms. Those set each attempt's deadline and, with
+PLAN_HEDGING on, the p95 after which a duplicate request is fired.
+Whichever request returns first is used.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+import anthropic
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+LATENCY_KEY_PREFIX = "plan-latency:"
+# Histogram bucket upper bounds in seconds; slower calls land in "inf"
+LATENCY_BUCKETS = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144]
+# A model's deadline is this multiple of its p99, within the bounds below
+DEADLINE_P99_MULTIPLIER = 2
+MIN_ATTEMPT_DEADLINE = 30
+# Days per week from which a plan counts as complex
+COMPLEX_DAYS_PER_WEEK = 5
+
+
+def plan_complexity(plan):
+    """One point each for many training days, injuries and feedback."""
+    profile = plan.user
+    previous = plan.previous_plan
+    return sum(
+        [
+            profile.exercise_days_per_week >= COMPLEX_DAYS_PER_WEEK,
+            bool(profile.injuries_and_limitations or plan.minor_injuries),
+            bool(plan.plan_preferences or (previous and previous.progress_comment)),
+        ]
+    )
+
+
+def choose_plan_model(plan):
+    if plan_complexity(plan) >= settings.PLAN_COMPLEXITY_THRESHOLD:
+        return settings.PLAN_MODEL_COMPLEX
+    return settings.PLAN_MODEL_FAST
+
+
+def _bucket(seconds):
+    for bound in LATENCY_BUCKETS:
+        if seconds <= bound:
+            return str(bound)
+    return "inf"
+
+
+def _latency_key(model, hour):
+    return f"{LATENCY_KEY_PREFIX}{model}:{hour}"
+
+
+def record_latency(model, seconds):
+    """Count one call of ``seconds`` in this hour's histogram."""
+    hour = int(time.time() // 3600)
+    key = _latency_key(model, hour)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hincrby(key, _bucket(seconds), 1)
+        pipe.expire(key, (settings.PLAN_LATENCY_WINDOW_HOURS + 1) * 3600)
+        pipe.execute()
+    except redis.RedisError:
+        logger.info("Could not record %s latency", model)
+
+
+def latency_histogram(model):
+    """Bucket counts for ``model`` over the last PLAN_LATENCY_WINDOW_HOURS."""
+    hour = int(time.time() // 3600)
+    try:
+        pipe = get_redis().pipeline()
+        for offset in range(settings.PLAN_LATENCY_WINDOW_HOURS):
+            pipe.hgetall(_latency_key(model, hour - offset))
+        hours = pipe.execute()
+    except redis.RedisError:
+        logger.info("Could not read %s latency", model)
+        return {}
+    counts = {}
+    for histogram in hours:
+        for bucket, count in histogram.items():
+            bucket = bucket.decode() if isinstance(bucket, bytes) else bucket
+            counts[bucket] = counts.get(bucket, 0) + int(count)
+    return counts
+
+
+def latency_percentile(model, pct, counts=None):
+    """Upper bound in seconds of the bucket holding the ``pct``th
+    percentile, or None until PLAN_LATENCY_MIN_SAMPLES calls are in."""
+    if counts is None:
+        counts = latency_histogram(model)
+    total = sum(counts.values())
+    if total < settings.PLAN_LATENCY_MIN_SAMPLES:
+        return None
+    rank = math.ceil(pct / 100 * total)
+    seen = 0
+    for bound in LATENCY_BUCKETS:
+        seen += counts.get(str(bound), 0)
+        if seen >= rank:
+            return bound
+    return math.inf
+
+
+def attempt_deadline(model, counts=None):
+    """Seconds one attempt on ``model`` may take before it times out."""
+    ceiling = settings.PLAN_ATTEMPT_DEADLINE
+    p99 = latency_percentile(model, 99, counts)
+    if p99 is None:
+        return ceiling
+    return min(max(p99 * DEADLINE_P99_MULTIPLIER, MIN_ATTEMPT_DEADLINE), ceiling)
+
+
+def timed_create(client, params, deadline):
+    """messages.create() with ``deadline``, recording how long it took.
+    Timeouts are recorded at the deadline so slow models still show."""
+    started = time.perf_counter()
+    try:
+        message = client.messages.create(**params, timeout=deadline)
+    except anthropic.APITimeoutError:
+        record_latency(params["model"], deadline)
+        raise
+    record_latency(params["model"], time.perf_counter() - started)
+    return message
+
+
+def request_limits(model):
+    """``model``'s attempt deadline, and the seconds after which to hedge
+    (None when hedging is off, the p95 is unknown or past the deadline)."""
+    counts = latency_histogram(model)
+    deadline = attempt_deadline(model, counts)
+    hedge_after = None
+    if settings.PLAN_HEDGING:
+        hedge_after = latency_percentile(model, 95, counts)
+    if hedge_after is not None and hedge_after >= deadline:
+        hedge_after = None
+    return deadline, hedge_after
+
+
+@lru_cache(maxsize=1)
+def hedge_executor():
+    return ThreadPoolExecutor(thread_name_prefix="plan-hedge")
+
+
+def routed_create(client, params):
+    """Send a plan request under its model's deadline.
+
+    With PLAN_HEDGING on and a known p95 below the deadline, a second,
+    identical request is sent if the first hasn't answered by then and
+    the first to succeed wins. The loser still runs to completion in the
+    background (and is billed); only its latency is kept.
+    """
+    model = params["model"]
+    deadline, hedge_after = request_limits(model)
+    if hedge_after is None:
+        return timed_create(client, params, deadline)
+
+    executor = hedge_executor()
+    primary = executor.submit(timed_create, client, params, deadline)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+    logger.info("Hedging %s plan request after %ss", model, hedge_after)
+    pending = {primary, executor.submit(timed_create, client, params, deadline)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+    # Both failed: surface the original request's error
+    return primary.result()
+
+
+async def timed_create_async(client, params, deadline):
+    """timed_create() for the async client."""
+    started = time.perf_counter()
+    try:
+        message = await client.messages.create(**params, timeout=deadline)
+    except anthropic.APITimeoutError:
+        await sync_to_async(record_latency)(params["model"], deadline)
+        raise
+    await sync_to_async(record_latency)(params["model"], time.perf_counter() - started)
+    return message
+
+
+async def routed_create_async(client, params):
+    """routed_create() for the async client. The hedge races as a task on
+    the event loop, so here the losing request is cancelled."""
+    model = params["model"]
+    deadline, hedge_after = await sync_to_async(request_limits)(model)
+    if hedge_after is None:
+        return await timed_create_async(client, params, deadline)
+
+    primary = asyncio.ensure_future(timed_create_async(client, params, deadline))
+    done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+    if done:
+        return primary.result()
+    logger.info("Hedging %s plan request after %ss", model, hedge_after)
+    hedge = asyncio.ensure_future(timed_create_async(client, params, deadline))
+    pending = {primary, hedge}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                return future.result()
+    return primary.result()
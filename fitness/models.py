@@ -1,8 +1,13 @@
-from django.db import models
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import models, transaction
+from django.db.models import DEFERRED, F
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from cloudinary.models import CloudinaryField
 from django.templatetags.static import static
+from .plan_summary import STATUS_CHOICES, STATUS_PENDING, summarise_plan
+from .search import build_search_document
 
 # Create your models here.
 
@@ -80,6 +85,36 @@ class UserProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalised follow counts, kept in step with accepted FollowRequests
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+    following_count = models.PositiveIntegerField(default=0, editable=False)
+    # Lower-cased username, display name, goal and bio for fitness.search
+    search_document = models.TextField(blank=True, default="", editable=False)
+
+    DEFAULT_BIO = "This user hasn't added a bio yet."
+
+    def _build_search_document(self):
+        return build_search_document(
+            self.user.username, self.display_name, self.goal_event, self.bio
+        )
+
+    def save(self, *args, **kwargs):
+        self.search_document = self._build_search_document()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "search_document"}
+        super().save(*args, **kwargs)
+
+    def sync_search_document(self):
+        """Write the search document only if it's stale (e.g. after a
+        username change). Returns whether a row was updated."""
+        document = self._build_search_document()
+        if document == self.search_document:
+            return False
+        self.search_document = document
+        UserProfile.objects.filter(pk=self.pk).update(search_document=document)
+        return True
+
     @property
     def approved_followers(self):
         return UserProfile.objects.filter(
@@ -109,8 +144,8 @@ class UserProfile(models.Model):
             "fitness_level": self.fitness_level,
             "exercise_days_per_week": self.exercise_days_per_week,
             "exercise_duration": self.exercise_duration,
-            "followers_count": self.approved_followers.count(),
-            "following_count": self.approved_following.count(),
+            "followers_count": self.followers_count,
+            "following_count": self.following_count,
         }
 
     def __str__(self):
@@ -145,10 +180,94 @@ class TrainingPlan(models.Model):
     minor_injuries = models.TextField(blank=True, null=True)
     start_date = models.DateField(auto_now_add=True)
     end_date = models.DateField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Bumped whenever plan_json changes; keys the cached week grid
+    plan_version = models.PositiveIntegerField(default=0, editable=False)
+    # Summary of plan_json, refreshed when it changes, for list pages
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, editable=False
+    )
+    week_count = models.PositiveIntegerField(default=0, editable=False)
+    training_day_count = models.PositiveIntegerField(default=0, editable=False)
+    total_sets = models.PositiveIntegerField(default=0, editable=False)
+    average_intensity = models.FloatField(blank=True, null=True, editable=False)
+    # Claude token usage for generating this plan, incl. prompt cache hits
+    input_tokens = models.PositiveIntegerField(default=0, editable=False)
+    output_tokens = models.PositiveIntegerField(default=0, editable=False)
+    cache_read_tokens = models.PositiveIntegerField(default=0, editable=False)
+    cache_write_tokens = models.PositiveIntegerField(default=0, editable=False)
+
+    # Template fragment name for the rendered week grid in plan_detail
+    WEEKS_FRAGMENT = "plan_weeks"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Kept by reference, so loading costs nothing: plan writers assign
+        # a new plan_json rather than editing the loaded one in place
+        instance._loaded_plan_json = instance.__dict__.get("plan_json", DEFERRED)
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        self._loaded_plan_json = self.__dict__.get("plan_json", DEFERRED)
+
+    def plan_json_changed(self):
+        if "plan_json" in self.get_deferred_fields():
+            return False
+        loaded = getattr(self, "_loaded_plan_json", DEFERRED)
+        if loaded is DEFERRED:
+            return True
+        return self.plan_json is not loaded and self.plan_json != loaded
+
+    def save(self, *args, **kwargs):
+        changed = self.plan_json_changed()
+        old_version = self.plan_version
+        if changed:
+            self.plan_version += 1
+            summary = summarise_plan(self.plan_json)
+            for field, value in summary.items():
+                setattr(self, field, value)
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {
+                    *update_fields,
+                    "plan_json",
+                    "plan_version",
+                    *summary,
+                }
+        super().save(*args, **kwargs)
+        if "plan_json" not in self.get_deferred_fields():
+            self._loaded_plan_json = self.plan_json
+        if changed:
+            cache.delete(
+                make_template_fragment_key(self.WEEKS_FRAGMENT, [self.pk, old_version])
+            )
 
     def __str__(self):
         return self.plan_title or f"Plan {self.id} for {self.user}"
 
+    class Meta:
+        indexes = [
+            # A user's plans newest first, including the keyset tiebreak
+            models.Index(
+                fields=["user", "-start_date", "-id"], name="plan_user_start_idx"
+            ),
+            models.Index(fields=["user", "-target_date"], name="plan_user_target_idx"),
+        ]
+
+
+class PlanGenerationBatch(models.Model):
+    """A Message Batches API submission regenerating several plans."""
+
+    batch_id = models.CharField(max_length=100, unique=True)
+    plan_ids = models.JSONField(default=list)
+    submitted_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Batch {self.batch_id} ({len(self.plan_ids)} plans)"
+
 
 class Comment(models.Model):
     """Comments made by users on profiles or plans."""
@@ -193,6 +312,14 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Top-level approved comments on a profile, newest first
+            models.Index(
+                fields=["profile", "-created_at"],
+                condition=models.Q(approved=True, parent__isnull=True),
+                name="comment_profile_thread_idx",
+            ),
+        ]
 
 
 class FollowRequest(models.Model):
@@ -209,6 +336,23 @@ class FollowRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     accepted = models.BooleanField(default=False)
 
+    def accept(self):
+        """Accept the request and bump both profiles' follow counters.
+        Returns False if the request had already been accepted."""
+        with transaction.atomic():
+            updated = FollowRequest.objects.filter(pk=self.pk, accepted=False).update(
+                accepted=True
+            )
+            if updated:
+                UserProfile.objects.filter(pk=self.to_user_id).update(
+                    followers_count=F("followers_count") + 1
+                )
+                UserProfile.objects.filter(pk=self.from_user_id).update(
+                    following_count=F("following_count") + 1
+                )
+        self.accepted = True
+        return bool(updated)
+
     def __str__(self):
         status = "Accepted" if self.accepted else "Pending"
         return f"Follow request from {self.from_user} "
@@ -219,3 +363,9 @@ class FollowRequest(models.Model):
             "from_user",
             "to_user",
         )
+        indexes = [
+            models.Index(fields=["to_user", "accepted"], name="follow_to_accepted_idx"),
+            models.Index(
+                fields=["from_user", "accepted"], name="follow_from_accepted_idx"
+            ),
+        ]
@@ -0,0 +1,57 @@
+"""Keyset (cursor) pagination on a sort column plus the primary key.
+
+Each page is fetched with ``WHERE (sort_key, id) > (last_sort_key, last_id)``
+rather than an OFFSET, so a deep page costs the same as the first one and
+stays stable when rows are added in front of it.
+"""
+
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+
+
+def encode_token(value, pk):
+    raw = json.dumps([value, pk], default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_token(token):
+    """Return (sort_value, pk) from a page token, or None if it's invalid."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded))
+        return value, int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+
+
+def keyset_paginate(queryset, sort_field, token, page_size, descending=False):
+    """Return ``(items, next_token)`` for the page after ``token``.
+
+    ``next_token`` is None on the last page. An invalid or missing token,
+    or one whose value doesn't fit ``sort_field``, gives the first page.
+    """
+    direction = "-" if descending else ""
+    queryset = queryset.annotate(keyset_sort_key=F(sort_field)).order_by(
+        f"{direction}{sort_field}", f"{direction}pk"
+    )
+    cursor = decode_token(token) if token else None
+    if cursor is not None:
+        value, pk = cursor
+        op = "lt" if descending else "gt"
+        try:
+            queryset = queryset.filter(
+                Q(**{f"{sort_field}__{op}": value})
+                | Q(**{sort_field: value, f"pk__{op}": pk})
+            )
+        except (ValidationError, ValueError, TypeError):
+            # A well-formed token carrying the wrong type of value
+            pass
+    items = list(queryset[: page_size + 1])
+    if len(items) <= page_size:
+        return items, None
+    items = items[:page_size]
+    last = items[-1]
+    return items, encode_token(last.keyset_sort_key, last.pk)
@@ -0,0 +1,71 @@
+"""Content-addressed Redis cache of validated Claude plan outputs.
+
+Entries are keyed on a hash of the normalised prompt, the model and the
+tool schema, expire after ``PLAN_CACHE_TTL`` seconds, and are evicted
+least-recently-used once there are more than ``PLAN_CACHE_MAX_ENTRIES``.
+"""
+
+import hashlib
+import json
+import logging
+import time
+import redis
+from django.conf import settings
+from .redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "plan-cache:"
+# Sorted set of cache keys scored by last access time, used for LRU eviction
+LRU_INDEX_KEY = "plan-cache-lru"
+
+
+def normalise_prompt(text):
+    """Collapse whitespace so cosmetic prompt changes share an entry."""
+    return " ".join(text.split())
+
+
+def plan_cache_key(model, system, prompt, schema):
+    payload = json.dumps(
+        {
+            "model": model,
+            "system": normalise_prompt(system),
+            "prompt": normalise_prompt(prompt),
+            "schema": schema,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return KEY_PREFIX + hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_cached_plan(key):
+    """Return the cached plan dict for ``key`` or None on a miss."""
+    try:
+        client = get_redis()
+        raw = client.get(key)
+        if raw is None:
+            client.zrem(LRU_INDEX_KEY, key)
+            return None
+        client.zadd(LRU_INDEX_KEY, {key: time.time()})
+    except redis.RedisError:
+        logger.warning("Plan cache unavailable, treating %s as a miss", key)
+        return None
+    return json.loads(raw)
+
+
+def set_cached_plan(key, plan_data):
+    """Store a validated plan and evict the least recently used entries."""
+    try:
+        client = get_redis()
+        pipe = client.pipeline()
+        pipe.set(key, json.dumps(plan_data), ex=settings.PLAN_CACHE_TTL)
+        pipe.zadd(LRU_INDEX_KEY, {key: time.time()})
+        pipe.zcard(LRU_INDEX_KEY)
+        size = pipe.execute()[-1]
+        overflow = size - settings.PLAN_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = [k for k, _ in client.zpopmin(LRU_INDEX_KEY, overflow)]
+            client.delete(*evicted)
+    except redis.RedisError:
+        logger.warning("Plan cache unavailable, not storing %s", key)
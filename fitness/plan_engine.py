@@ -0,0 +1,209 @@
+"""Rule-based plan generator that runs locally.
+
+It builds a PLAN_SCHEMA-shaped two-week plan from the profile's fitness
+level, training days, session length, equipment and injuries. It uses
+a fixed exercise catalogue and makes no network calls, so it returns in
+milliseconds. It is used for instant drafts that Claude then refines, and
+as the fallback when Claude can't be reached or the ai queue is backed up.
+The same inputs always produce the same plan.
+"""
+
+import re
+from collections import namedtuple
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+PLAN_WEEKS = 2
+
+# equipment: keywords any one of which must appear in the profile's
+# equipment text (empty means bodyweight). avoid: body areas it loads.
+Exercise = namedtuple("Exercise", "name type equipment avoid reps")
+
+CATALOGUE = [
+    # Strength
+    Exercise("Bodyweight Squat", "strength", (), ("knee",), "12"),
+    Exercise("Glute Bridge", "strength", (), (), "15"),
+    Exercise("Push Ups", "strength", (), ("wrist", "shoulder"), "10"),
+    Exercise("Plank", "strength", (), ("back",), "30 sec"),
+    Exercise("Reverse Lunge", "strength", (), ("knee",), "10 each side"),
+    Exercise("Dead Bug", "strength", (), (), "10 each side"),
+    Exercise("Side Plank", "strength", (), ("shoulder",), "20 sec each side"),
+    Exercise("Calf Raise", "strength", (), ("ankle",), "15"),
+    Exercise("Dumbbell Goblet Squat", "strength", ("dumbbell",), ("knee",), "10"),
+    Exercise("Dumbbell Row", "strength", ("dumbbell",), ("back",), "10 each side"),
+    Exercise("Dumbbell Shoulder Press", "strength", ("dumbbell",), ("shoulder",), "10"),
+    Exercise("Kettlebell Swing", "strength", ("kettlebell",), ("back",), "15"),
+    Exercise("Band Pull Apart", "strength", ("band",), (), "15"),
+    Exercise("Band Row", "strength", ("band",), (), "12"),
+    Exercise("Barbell Deadlift", "strength", ("barbell", "gym"), ("back",), "6"),
+    Exercise("Barbell Back Squat", "strength", ("barbell", "gym"), ("knee",), "6"),
+    Exercise("Pull Ups", "strength", ("pull-up", "pull up", "gym"), ("shoulder",), "6"),
+    # Cardio
+    Exercise("Brisk Walk", "cardio", (), (), "20 min"),
+    Exercise("Easy Run", "cardio", (), ("knee", "ankle"), "20 min"),
+    Exercise("Jumping Jacks", "cardio", (), ("knee", "ankle"), "45 sec"),
+    Exercise("Mountain Climbers", "cardio", (), ("wrist",), "30 sec"),
+    Exercise("Bike Ride", "cardio", ("bike", "cycle", "gym"), (), "30 min"),
+    Exercise(
+        "Rowing Intervals", "cardio", ("rower", "rowing", "gym"), ("back",), "5 x 2 min"
+    ),
+    Exercise("Swim", "cardio", ("pool", "swim"), ("shoulder",), "20 min"),
+    Exercise(
+        "Treadmill Intervals",
+        "cardio",
+        ("treadmill", "gym"),
+        ("knee", "ankle"),
+        "6 x 1 min",
+    ),
+    # Flexibility
+    Exercise("Hip Flexor Stretch", "flexibility", (), (), "45 sec each side"),
+    Exercise("Cat-Cow", "flexibility", (), (), "10"),
+    Exercise("Hamstring Stretch", "flexibility", (), (), "45 sec each side"),
+    Exercise("Thoracic Rotation", "flexibility", (), (), "8 each side"),
+    Exercise("Yoga Flow", "flexibility", ("mat", "yoga"), (), "10 min"),
+]
+
+# Words in injury text that point at each body area
+INJURY_AREAS = {
+    "knee": ("knee", "acl", "mcl", "menisc", "patell"),
+    "back": ("back", "spine", "spinal", "disc", "lumbar", "sciatica"),
+    "shoulder": ("shoulder", "rotator", "labrum"),
+    "wrist": ("wrist", "carpal", "hand"),
+    "ankle": ("ankle", "achilles", "plantar", "foot", "feet", "shin"),
+}
+
+# Sets and week 1 RPE per fitness level; week 2 adds one RPE point
+LEVELS = {
+    "beginner": (2, 5),
+    "novice": (3, 6),
+    "intermediate": (3, 7),
+    "advanced": (4, 8),
+}
+MAX_INTENSITY = 9
+
+# Main exercises per session, before the closing stretch
+EXERCISES_PER_DURATION = {"30": 2, "31-60": 3, "61-90": 4, "91-120": 5, "120+": 5}
+
+# Goal words that tip sessions towards cardio or strength
+CARDIO_GOALS = ("run", "5k", "10k", "marathon", "race", "cycl", "swim", "triathlon")
+STRENGTH_GOALS = ("strength", "muscle", "lift", "power", "pull-up", "pull up")
+
+
+def injured_areas(*texts):
+    text = " ".join(t.lower() for t in texts if t)
+    return {
+        area
+        for area, words in INJURY_AREAS.items()
+        if any(word in text for word in words)
+    }
+
+
+def _has_equipment(exercise, equipment_text):
+    if not exercise.equipment:
+        return True
+    return any(keyword in equipment_text for keyword in exercise.equipment)
+
+
+def available_exercises(equipment_text, areas):
+    """Catalogue entries the user has the kit for and that spare
+    ``areas``, grouped by type in catalogue order."""
+    equipment_text = (equipment_text or "").lower()
+    pools = {"strength": [], "cardio": [], "flexibility": []}
+    for exercise in CATALOGUE:
+        if _has_equipment(exercise, equipment_text) and not areas & set(exercise.avoid):
+            pools[exercise.type].append(exercise)
+    return pools
+
+
+def training_days(days_per_week):
+    """Indexes into DAYS, spread evenly through the week."""
+    days_per_week = min(max(days_per_week or 1, 1), 7)
+    return sorted({round(i * 7 / days_per_week) % 7 for i in range(days_per_week)})
+
+
+def session_focus(goal_text, count):
+    """Alternate strength and cardio sessions, starting with the goal's."""
+    goal_text = (goal_text or "").lower()
+    if any(word in goal_text for word in CARDIO_GOALS):
+        order = ["cardio", "strength"]
+    elif any(word in goal_text for word in STRENGTH_GOALS):
+        order = ["strength", "strength", "cardio"]
+    else:
+        order = ["strength", "cardio"]
+    return [order[i % len(order)] for i in range(count)]
+
+
+def _pick(pool, start, count):
+    if not pool:
+        return []
+    return [pool[(start + k) % len(pool)] for k in range(min(count, len(pool)))]
+
+
+def _item(exercise, sets, intensity):
+    cardio = exercise.type == "cardio"
+    return {
+        "exercise": exercise.name,
+        "type": exercise.type,
+        # Cardio is prescribed by time, as the system prompt asks of Claude
+        "sets": 1 if cardio else sets,
+        "reps": exercise.reps,
+        "intensity": intensity,
+    }
+
+
+def _rest_day(day):
+    return {"day": day, "workout": [{"exercise": "Rest Day", "type": "rest"}]}
+
+
+def build_local_plan(profile, minor_injuries="", goal=""):
+    """Return a complete two-week plan for ``profile`` without calling
+    Claude."""
+    sets, base_intensity = LEVELS.get(profile.fitness_level, LEVELS["novice"])
+    per_session = EXERCISES_PER_DURATION.get(profile.exercise_duration, 3)
+    areas = injured_areas(profile.injuries_and_limitations, minor_injuries)
+    pools = available_exercises(profile.equipment_text, areas)
+    goal = goal or profile.goal_event or ""
+    day_indexes = training_days(profile.exercise_days_per_week)
+    focuses = session_focus(goal, len(day_indexes))
+
+    weeks = []
+    session = 0
+    for week_number in range(1, PLAN_WEEKS + 1):
+        intensity = min(base_intensity + week_number - 1, MAX_INTENSITY)
+        days = []
+        for index, day in enumerate(DAYS):
+            if index not in day_indexes:
+                days.append(_rest_day(day))
+                continue
+            focus = focuses[day_indexes.index(index)]
+            other = "cardio" if focus == "strength" else "strength"
+            main = _pick(pools[focus], session * (per_session - 1), per_session - 1)
+            main += _pick(pools[other], session, 1)
+            main += _pick(pools["flexibility"], session, 1)
+            days.append(
+                {"day": day, "workout": [_item(e, sets, intensity) for e in main]}
+            )
+            session += 1
+        weeks.append({"week_number": week_number, "days": days})
+
+    level = profile.get_fitness_level_display().split(" (")[0]
+    title = f"{profile.exercise_days_per_week}-Day {level} Plan"
+    if goal:
+        title += f" for {re.sub(r'\s+', ' ', goal).strip()[:60]}"
+    summary = (
+        f"{len(day_indexes)} sessions a week of "
+        f"{profile.get_exercise_duration_display().lower()}, alternating "
+        "strength and cardio and finishing with a stretch. Week 2 raises the "
+        "intensity by one RPE point."
+    )
+    if areas:
+        summary += f" Avoids loading the {', '.join(sorted(areas))}."
+    return {"plan_title": title, "plan_summary": summary, "plan_weeks": weeks}
+
+
+def build_local_plan_for(plan):
+    """build_local_plan() for a TrainingPlan's own inputs."""
+    return build_local_plan(
+        plan.user,
+        minor_injuries=plan.minor_injuries or "",
+        goal=plan.target_event or "",
+    )
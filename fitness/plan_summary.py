@@ -0,0 +1,58 @@
+"""Summary figures for a plan's ``plan_json``.
+
+They're stored on TrainingPlan whenever plan_json changes, so list
+pages can show a plan's status and size without loading the JSON.
+"""
+
+STATUS_PENDING = "pending"
+STATUS_GENERATING = "generating"
+STATUS_READY = "ready"
+STATUS_ERROR = "error"
+
+STATUS_CHOICES = [
+    (STATUS_PENDING, "Pending"),
+    (STATUS_GENERATING, "Generating"),
+    (STATUS_READY, "Ready"),
+    (STATUS_ERROR, "Failed"),
+]
+
+
+def plan_status(plan_json):
+    if not isinstance(plan_json, dict):
+        return STATUS_PENDING
+    if "error" in plan_json:
+        return STATUS_ERROR
+    # Streamed weeks so far, or a local draft Claude is still refining
+    if "partial" in plan_json or "draft" in plan_json:
+        return STATUS_GENERATING
+    if "plan_weeks" in plan_json:
+        return STATUS_READY
+    return STATUS_PENDING
+
+
+def summarise_plan(plan_json):
+    """Return the TrainingPlan summary field values for ``plan_json``."""
+    weeks = plan_json.get("plan_weeks") if isinstance(plan_json, dict) else None
+    weeks = weeks if isinstance(weeks, list) else []
+    training_days = 0
+    total_sets = 0
+    intensities = []
+    for week in weeks:
+        for day in week.get("days") or []:
+            workout = [item for item in day.get("workout") or [] if item]
+            if any(item.get("type") != "rest" for item in workout):
+                training_days += 1
+            for item in workout:
+                if isinstance(item.get("sets"), int):
+                    total_sets += item["sets"]
+                if isinstance(item.get("intensity"), (int, float)):
+                    intensities.append(item["intensity"])
+    return {
+        "status": plan_status(plan_json),
+        "week_count": len(weeks),
+        "training_day_count": training_days,
+        "total_sets": total_sets,
+        "average_intensity": (
+            round(sum(intensities) / len(intensities), 1) if intensities else None
+        ),
+    }
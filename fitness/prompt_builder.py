@@ -0,0 +1,141 @@
+"""Compact, token-budgeted user prompt for plan generation.
+
+Each profile and plan field is sent once, under the name the system
+prompt's rules use. Free text is stripped of HTML and cut down to
+PLAN_PROMPT_FIELD_TOKENS. If the whole payload is still over
+PLAN_PROMPT_TOKEN_BUDGET, the least safety-critical text is trimmed
+first. Tokens are estimated locally, so building a prompt never needs
+an API call.
+"""
+
+import json
+import math
+from django.conf import settings
+from django.utils.html import strip_tags
+
+# A conservative average for English text and compact JSON
+CHARS_PER_TOKEN = 4
+# No free-text field is trimmed below this many tokens
+MIN_FIELD_TOKENS = 20
+# Free-text fields, trimmed in this order when over budget; injuries last
+SHRINK_ORDER = [
+    ("previous_plan", "summary"),
+    ("plan_preferences",),
+    ("previous_plan", "progress"),
+    ("equipment_text",),
+    ("previous_plan", "injuries"),
+    ("minor_injuries",),
+    ("long_term_injuries",),
+]
+
+# Output tokens for max_tokens: the title/summary and JSON framing, then
+# each training day (several exercises) and rest day (one object) in
+# each of the plan's two weeks
+OUTPUT_BASE_TOKENS = 400
+OUTPUT_TOKENS_PER_TRAINING_DAY = 400
+OUTPUT_TOKENS_PER_REST_DAY = 40
+PLAN_WEEKS = 2
+MAX_OUTPUT_TOKENS = 8192
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def clean_text(text):
+    return " ".join(strip_tags(text or "").split())
+
+
+def truncate_to_tokens(text, tokens):
+    """Cut ``text`` at a word boundary to roughly ``tokens`` tokens."""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[: limit - 1]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut + "…"
+
+
+def plan_payload(plan):
+    """The canonical, deduplicated data for one plan's prompt."""
+    profile = plan.user
+    field_tokens = settings.PLAN_PROMPT_FIELD_TOKENS
+
+    def text(value):
+        return truncate_to_tokens(clean_text(value), field_tokens)
+
+    payload = {
+        "fitness_level": profile.get_fitness_level_display(),
+        "exercise_days_per_week": profile.exercise_days_per_week,
+        "exercise_duration": profile.get_exercise_duration_display(),
+        "equipment_text": text(profile.equipment_text),
+        "long_term_injuries": text(profile.injuries_and_limitations),
+        "minor_injuries": text(plan.minor_injuries),
+        "goal_event": profile.goal_event,
+        "goal_date": profile.goal_date.isoformat() if profile.goal_date else "",
+        "plan_preferences": text(plan.plan_preferences),
+    }
+    if plan.previous_plan:
+        previous = plan.previous_plan
+        payload["previous_plan"] = {
+            "summary": text(previous.plan_summary),
+            "progress": text(previous.progress_comment),
+            "injuries": text(previous.minor_injuries),
+        }
+    return _drop_empty(payload)
+
+
+def _drop_empty(payload):
+    compact = {}
+    for key, value in payload.items():
+        if isinstance(value, dict):
+            value = _drop_empty(value)
+        if value not in ("", None, {}):
+            compact[key] = value
+    return compact
+
+
+def _render(payload):
+    return "User profile data: " + json.dumps(
+        payload, ensure_ascii=False, separators=(",", ":")
+    )
+
+
+def fit_to_budget(payload, budget):
+    """Trim free text, least important first, until the rendered prompt
+    fits ``budget`` tokens or nothing more can be trimmed."""
+    prompt = _render(payload)
+    while estimate_tokens(prompt) > budget:
+        for path in SHRINK_ORDER:
+            *parents, key = path
+            container = payload
+            for parent in parents:
+                container = container.get(parent, {})
+            value = container.get(key)
+            tokens = estimate_tokens(value) if value else 0
+            if tokens > MIN_FIELD_TOKENS:
+                container[key] = truncate_to_tokens(
+                    value, max(MIN_FIELD_TOKENS, tokens // 2)
+                )
+                break
+        else:
+            break
+        prompt = _render(payload)
+    return prompt
+
+
+def build_plan_prompt(plan):
+    """Build the user prompt for a plan from its profile and history."""
+    return fit_to_budget(plan_payload(plan), settings.PLAN_PROMPT_TOKEN_BUDGET)
+
+
+def plan_max_tokens(days_per_week, weeks=PLAN_WEEKS):
+    """``max_tokens`` sized to the number of training days requested,
+    for the whole plan or just ``weeks`` of it."""
+    days_per_week = min(max(days_per_week or 1, 1), 7)
+    per_week = (
+        days_per_week * OUTPUT_TOKENS_PER_TRAINING_DAY
+        + (7 - days_per_week) * OUTPUT_TOKENS_PER_REST_DAY
+    )
+    return min(OUTPUT_BASE_TOKENS + weeks * per_week, MAX_OUTPUT_TOKENS)
@@ -0,0 +1,18 @@
+"""Shared Redis connections on the project's REDIS_URL."""
+
+from functools import lru_cache
+import redis
+from django.conf import settings
+
+
+def connection_kwargs():
+    # Heroku Redis uses self-signed certs, same as the Celery broker settings
+    if settings.REDIS_URL.startswith("rediss://"):
+        return {"ssl_cert_reqs": None}
+    return {}
+
+
+@lru_cache(maxsize=1)
+def get_redis():
+    """Process-wide synchronous client (redis-py pools connections)."""
+    return redis.Redis.from_url(settings.REDIS_URL, **connection_kwargs())
@@ -0,0 +1,166 @@
+"""Indexed, ranked profile search.
+
+Every profile keeps a denormalised, lower-cased ``search_document``
+(username, display name, goal event and bio). On Postgres it has a
+``pg_trgm`` GIN index and results are ranked by trigram word similarity.
+Locally on SQLite an FTS5 trigram table mirrors it and results are ranked
+by bm25.
+"""
+
+from django.db import DatabaseError, connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+from .pagination import keyset_paginate
+
+SEARCH_LIMIT = 50
+FTS_TABLE = "fitness_userprofile_fts"
+PG_INDEX = "fitness_userprofile_search_trgm"
+# The FTS5 trigram tokenizer can't match anything shorter than this
+MIN_FTS_QUERY_LENGTH = 3
+
+SQLITE_TRIGGERS = {
+    f"{FTS_TABLE}_ai": (
+        "AFTER INSERT ON fitness_userprofile BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, search_document) "
+        "VALUES (new.id, new.search_document); END"
+    ),
+    f"{FTS_TABLE}_ad": (
+        "AFTER DELETE ON fitness_userprofile BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) "
+        "VALUES ('delete', old.id, old.search_document); END"
+    ),
+    f"{FTS_TABLE}_au": (
+        "AFTER UPDATE OF search_document ON fitness_userprofile BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) "
+        "VALUES ('delete', old.id, old.search_document); "
+        f"INSERT INTO {FTS_TABLE}(rowid, search_document) "
+        "VALUES (new.id, new.search_document); END"
+    ),
+}
+
+
+def normalise_query(text):
+    return " ".join(text.lower().split())
+
+
+def build_search_document(username, display_name, goal_event, bio):
+    parts = [username, display_name, goal_event, strip_tags(bio or "")]
+    return normalise_query(" ".join(part for part in parts if part))
+
+
+def ensure_search_index(conn=connection):
+    """Create the search index for this database if it's missing.
+
+    Safe to run repeatedly. SQLite migrations that rebuild the profile
+    table drop its triggers, so this also runs after every migrate.
+    """
+    with conn.cursor() as cursor:
+        if conn.vendor == "postgresql":
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON fitness_userprofile "
+                "USING gin (search_document gin_trgm_ops)"
+            )
+        elif conn.vendor == "sqlite":
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                f"AND name LIKE '{FTS_TABLE}_%'"
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            if existing == set(SQLITE_TRIGGERS):
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "search_document, content='fitness_userprofile', "
+                "content_rowid='id', tokenize='trigram')"
+            )
+            for name, body in SQLITE_TRIGGERS.items():
+                cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+            # Triggers were missing, so the FTS table may be out of date
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(conn=connection):
+    with conn.cursor() as cursor:
+        if conn.vendor == "postgresql":
+            cursor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+        elif conn.vendor == "sqlite":
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def _fts_phrase(query):
+    return '"' + query.replace('"', '""') + '"'
+
+
+def matching_profiles(query, field=None, use_fts=True):
+    """Active profiles matching ``query``, annotated with a ``rank`` where
+    higher is better.
+
+    The index picks the candidates. With ``field`` (e.g. ``goal_event``) a
+    match must also be in that field, and an empty query matches everyone.
+    """
+    from .models import UserProfile
+
+    query = normalise_query(query)
+    profiles = UserProfile.objects.filter(user__is_active=True).select_related("user")
+    if not query:
+        return profiles.annotate(rank=Value(0.0)) if field else profiles.none()
+    if field:
+        profiles = profiles.filter(**{f"{field}__icontains": query})
+
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        match = Q(search_document__contains=query)
+        if not field:
+            match |= Q(search_document__trigram_word_similar=query)
+        return profiles.annotate(
+            rank=TrigramWordSimilarity(query, "search_document")
+        ).filter(match)
+
+    if connection.vendor == "sqlite" and use_fts and len(query) >= MIN_FTS_QUERY_LENGTH:
+        phrase = _fts_phrase(query)
+        # bm25 is lower for better matches
+        rank = RawSQL(
+            f"SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = fitness_userprofile.id",
+            [phrase],
+            output_field=FloatField(),
+        )
+        matches = RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [phrase]
+        )
+        return profiles.annotate(rank=rank).filter(id__in=matches)
+
+    return profiles.filter(search_document__contains=query).annotate(rank=Value(0.0))
+
+
+def search_page(query, token, page_size, field=None):
+    """One keyset page of ``matching_profiles()``: ``(profiles,
+    next_token)``, best match first, or by username within ``field``."""
+    sort_field, descending = ("user__username", False) if field else ("rank", True)
+    try:
+        return keyset_paginate(
+            matching_profiles(query, field),
+            sort_field,
+            token,
+            page_size,
+            descending=descending,
+        )
+    except DatabaseError:
+        # FTS5 unavailable; fall back to a plain scan
+        return keyset_paginate(
+            matching_profiles(query, field, use_fts=False),
+            sort_field,
+            token,
+            page_size,
+            descending=descending,
+        )
+
+
+def search_profiles(query, limit=SEARCH_LIMIT):
+    """Return active profiles matching ``query``, best match first."""
+    return search_page(query, None, limit)[0]
@@ -1,7 +1,10 @@
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db import connections
+from django.db.models.signals import post_save, post_delete, post_migrate
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, FollowRequest
+from .search import ensure_search_index
 
 
 @receiver(post_save, sender=User)
@@ -10,10 +13,42 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(
             user=instance,
             display_name=instance.username,
+            bio=UserProfile.DEFAULT_BIO,
         )
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    if hasattr(instance, "userprofile"):
-        instance.userprofile.save()
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    """Only the username feeds into the profile (via its search document),
+    so saves that can't have changed it, like the last_login update on
+    every login, don't touch the profile at all."""
+    if created:
+        return
+    if update_fields is not None and "username" not in update_fields:
+        return
+    try:
+        profile = instance.userprofile
+    except UserProfile.DoesNotExist:
+        return
+    profile.sync_search_document()
+
+
+@receiver(post_delete, sender=FollowRequest)
+def decrement_follow_counts(sender, instance, **kwargs):
+    """Keep the denormalised follow counters in step when an accepted
+    follow is removed."""
+    if not instance.accepted:
+        return
+    UserProfile.objects.filter(pk=instance.to_user_id, followers_count__gt=0).update(
+        followers_count=F("followers_count") - 1
+    )
+    UserProfile.objects.filter(pk=instance.from_user_id, following_count__gt=0).update(
+        following_count=F("following_count") - 1
+    )
+
+
+@receiver(post_migrate)
+def ensure_profile_search_index(sender, using, **kwargs):
+    """SQLite table rebuilds drop the FTS triggers, so restore them."""
+    if sender.name == "fitness":
+        ensure_search_index(connections[using])
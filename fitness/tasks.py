@@ -1,10 +1,32 @@
+import asyncio
+import copy
 import json
-import os
 import logging
+import time
+from collections import Counter
+from datetime import date, timedelta
+import anthropic
+import redis
+from anthropic._exceptions import OverloadedError
 from celery import shared_task
-from anthropic import Anthropic
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from .models import TrainingPlan
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from .models import TrainingPlan, PlanGenerationBatch
+from .events import publish_plan_ready
+from .ai_clients import get_anthropic_client, new_async_anthropic_client
+from .redis_utils import get_redis
+from .plan_cache import plan_cache_key, get_cached_plan, set_cached_plan
+from .prompt_builder import MAX_OUTPUT_TOKENS, build_plan_prompt, plan_max_tokens
+from .plan_engine import build_local_plan_for
+from .model_routing import (
+    attempt_deadline,
+    choose_plan_model,
+    record_latency,
+    routed_create,
+    routed_create_async,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -93,74 +115,54 @@ PLAN_SCHEMA = {
 }
 
 
-@shared_task
-def generate_training_plan_task(plan_id):
-    """Generate a 2-week training plan using Claude API."""
-    client = Anthropic(api_key=os.getenv("CLAUDE_API_KEY", settings.CLAUDE_API_KEY))
-
-    try:
-        plan = TrainingPlan.objects.get(id=plan_id)
-    except TrainingPlan.DoesNotExist:
-        logger.error("TrainingPlan %s not found", plan_id)
-        return
-
-    profile = plan.user
+# Provider errors worth retrying with backoff: 429s, 5xx/overloaded and
+# timeouts or dropped connections. Anything else fails the plan at once.
+# 529 Overloaded raises OverloadedError, which the SDK doesn't export
+# or derive from InternalServerError.
+TRANSIENT_ERRORS = (
+    anthropic.RateLimitError,
+    anthropic.InternalServerError,
+    OverloadedError,
+    anthropic.APIConnectionError,
+)
+# Follow-up prompts allowed when Claude's plan doesn't match the schema
+PLAN_REPAIR_ATTEMPTS = 1
+# Held while a plan is generating so a duplicated delivery can't run too
+GENERATION_LOCK_SECONDS = 15 * 60
 
-    # Prepare feedback context
-    feedback_context = "No previous feedback."
-    if plan.previous_plan:
-        prev = plan.previous_plan
-        feedback_context = (
-            f"Previous summary: {prev.plan_summary or 'None'}. "
-            f"Progress: {prev.progress_comment or 'None'}. "
-            f"Injuries: {prev.minor_injuries or 'None'}."
-        )
-
-    # Prepare user profile data
-    profile_data = {
-        "fitness_level": getattr(profile, "fitness_level", "unknown"),
-        "exercise_days_per_week": getattr(profile, "exercise_days_per_week", 3),
-        "Fitness_Level": profile.get_fitness_level_display(),
-        "Exercise_Duration_Minutes": profile.get_exercise_duration_display(),
-        "exercise_duration": getattr(profile, "exercise_duration", "30 min"),
-        "equipment_text": getattr(profile, "equipment_text", "None"),
-        "long_term_injuries": getattr(profile, "injuries_and_limitations", ""),
-        "minor_injuries": plan.minor_injuries or "",
-    }
-
-    user_preferences = "None"
-    if plan.plan_json and isinstance(plan.plan_json, dict):
-        user_preferences = plan.plan_json.get("user_preferences", "None")
+# Celery priorities for the ai queue (lower runs first)
+PRIORITY_FIRST_PLAN = 0
+PRIORITY_NEW_PLAN = 3
+PRIORITY_RETRY = 6
+AI_QUEUE = "ai"
 
-    # Build prompt
-    prompt = f"""
-You are an expert fitness coach. Your task is to generate a comprehensive
-2-week training plan.
-
-Previous plan summary and feedback: {feedback_context}
-User profile data: {json.dumps(profile_data, separators=(',', ':'))}
-User preferences/goals: {user_preferences}
+PLAN_RULES = """You are an expert fitness coach. Your task is to generate a \
+comprehensive 2-week training plan for the user described in the message.
 
 PLAN RULES:
-1. Duration: Exactly 2 weeks, with training days
-   matching `exercise_days_per_week`
-   ({profile.exercise_days_per_week}).
+1. Duration: Exactly 2 weeks, with training days matching the profile's
+   `exercise_days_per_week`.
 2. Rest Days: For rest days, return EXACTLY ONE exercise object with:
    - "exercise": "Rest Day"
    - "type": "rest"
    - DO NOT include sets, reps, or intensity fields
-   Example: {{"exercise": "Rest Day", "type": "rest"}}
+   Example: {"exercise": "Rest Day", "type": "rest"}
 3. Training Days: Each workout must list exercises including:
    - exercise name
    - type (strength/cardio/flexibility)
    - sets (integer)
    - reps (string - e.g. '12', '30 sec', '5 km')
    - intensity (RPE 1-10)
-4. Safety: Respect all injuries and available equipment
-   ({profile.equipment_text or 'None'}).
-5. Time: Each workout must fit within the user's specified duration
-   ({profile.exercise_duration}).
+4. Safety: Respect all injuries and the available equipment
+   (`equipment_text`).
+5. Time: Each workout must fit within the user's `exercise_duration`.
+"""
 
+# Everything that is the same for every user lives here and in PLAN_TOOL,
+# so it forms one prompt-cacheable prefix; only the user message varies.
+SYSTEM_PROMPT = (
+    PLAN_RULES
+    + """
 CRITICAL: Your response MUST include:
 1. plan_title (string)
 2. plan_summary (string)
@@ -171,56 +173,965 @@ Never return incomplete data. Always generate the full 2-week plan structure.
 Use the `get_plan_json` tool to return the complete plan.
 Do not include any text, conversation, or markdown outside of the tool's input.
 """
+)
+
+PLAN_TOOL = {
+    "name": "get_plan_json",
+    "description": ("Generates 2-week plan based " "on user profile and rules."),
+    "input_schema": PLAN_SCHEMA,
+}
+
+
+# With the tool schema the prefix is about 660 tokens (780 for the
+# parallel prompts). That is under the 1024-token minimum Sonnet caches,
+# and Haiku's is higher, so for now these breakpoints are no-ops. They take
+# effect once the prefix grows or a model with a lower minimum is used.
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def cached_prefix(system, tools):
+    """``system`` and ``tools`` as request params, marked cacheable. Tools
+    render before the system prompt, so the system breakpoint caches both."""
+    return {
+        "system": [{"type": "text", "text": system, "cache_control": CACHE_CONTROL}],
+        "tools": tools[:-1] + [dict(tools[-1], cache_control=CACHE_CONTROL)],
+    }
+
+
+def plan_request_params(prompt, max_tokens=MAX_OUTPUT_TOKENS, model=None):
+    """Messages API parameters for one plan, shared by sync and batch calls."""
+    return {
+        "model": model or settings.PLAN_MODEL_FAST,
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": prompt}],
+        "tool_choice": {"type": "tool", "name": "get_plan_json"},
+        **cached_prefix(SYSTEM_PROMPT, [PLAN_TOOL]),
+    }
+
+
+# Response usage attributes and the TrainingPlan fields they're added to
+USAGE_FIELDS = {
+    "input_tokens": "input_tokens",
+    "output_tokens": "output_tokens",
+    "cache_read_input_tokens": "cache_read_tokens",
+    "cache_creation_input_tokens": "cache_write_tokens",
+}
+
+
+def record_usage(usage, message):
+    """Add a response's token counts, including prompt cache reads and
+    writes, to the ``usage`` Counter."""
+    message_usage = getattr(message, "usage", None)
+    if usage is None or message_usage is None:
+        return
+    for source, field in USAGE_FIELDS.items():
+        usage[field] += getattr(message_usage, source, None) or 0
+
 
+class PlanSchemaError(ValueError):
+    """Claude answered, but not with a usable get_plan_json plan."""
+
+
+JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "null": type(None),
+}
+
+
+def plan_schema_errors(value, schema=PLAN_SCHEMA, path="plan"):
+    """The ways ``value`` breaks ``schema``, checking the parts of JSON
+    Schema that PLAN_SCHEMA uses (types, enums, required keys)."""
+    types = schema.get("type", [])
+    types = [types] if isinstance(types, str) else types
+    # bool is an int subclass, but never a valid sets or intensity
+    if types and (
+        isinstance(value, bool)
+        or not isinstance(value, tuple(JSON_TYPES[t] for t in types))
+    ):
+        return [f"{path} is not {' or '.join(types)}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path} is not one of {', '.join(schema['enum'])}"]
+    errors = []
+    if isinstance(value, dict):
+        errors += [
+            f"{path}.{key} is missing"
+            for key in schema.get("required", [])
+            if key not in value
+        ]
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                errors += plan_schema_errors(value[key], subschema, f"{path}.{key}")
+    if isinstance(value, list) and "items" in schema:
+        for index, item in enumerate(value):
+            errors += plan_schema_errors(item, schema["items"], f"{path}[{index}]")
+    return errors
+
+
+def extract_tool_input(message, tool_name):
+    """Return the ``tool_name`` tool input from a Claude message."""
+    if not message.content or message.content[0].type != "tool_use":
+        raise PlanSchemaError("AI response did not contain a tool use block.")
+    tool_use = message.content[0]
+    if tool_use.name != tool_name:
+        raise PlanSchemaError(f"Unexpected tool used: {tool_use.name}")
+    return tool_use.input
+
+
+def extract_plan_data(message):
+    """Return the validated get_plan_json tool input from a Claude message."""
+    ai_data = extract_tool_input(message, "get_plan_json")
+    if "plan_weeks" not in ai_data or not ai_data["plan_weeks"]:
+        raise PlanSchemaError("AI did not return plan_weeks data")
+    errors = plan_schema_errors(ai_data)
+    if errors:
+        raise PlanSchemaError("; ".join(errors[:5]))
+    return ai_data
+
+
+def repair_request_params(params, message, exc):
+    """Follow-up request telling Claude what was wrong with its plan."""
+    tool_use = message.content[0] if message.content else None
+    if tool_use is None or tool_use.type != "tool_use":
+        # Nothing to answer, so just ask again from the start
+        return params
+    return dict(
+        params,
+        messages=params["messages"]
+        + [
+            {
+                "role": "assistant",
+                "content": [
+                    {
+                        "type": "tool_use",
+                        "id": tool_use.id,
+                        "name": tool_use.name,
+                        "input": tool_use.input,
+                    }
+                ],
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "tool_result",
+                        "tool_use_id": tool_use.id,
+                        "is_error": True,
+                        "content": (
+                            f"{exc} Call get_plan_json again with the "
+                            "complete plan: plan_title, plan_summary and "
+                            "plan_weeks for both weeks."
+                        ),
+                    }
+                ],
+            },
+        ],
+    )
+
+
+def validated_plan_data(client, params, message, usage=None):
+    """Validate a response, re-prompting up to PLAN_REPAIR_ATTEMPTS times
+    if it doesn't match the schema."""
+    for attempt in range(PLAN_REPAIR_ATTEMPTS + 1):
+        record_usage(usage, message)
+        try:
+            return extract_plan_data(message)
+        except PlanSchemaError as exc:
+            if attempt == PLAN_REPAIR_ATTEMPTS:
+                raise
+            logger.warning("Repairing invalid plan response: %s", exc)
+            message = routed_create(client, repair_request_params(params, message, exc))
+
+
+def request_plan_from_claude(
+    prompt, usage=None, max_tokens=MAX_OUTPUT_TOKENS, model=None
+):
+    """Call Claude and return the validated get_plan_json tool input."""
+    client = get_anthropic_client()
+    params = plan_request_params(prompt, max_tokens, model)
+    message = routed_create(client, params)
+    return validated_plan_data(client, params, message, usage)
+
+
+def stream_plan_from_claude(
+    prompt, on_week_completed, usage=None, max_tokens=MAX_OUTPUT_TOKENS, model=None
+):
+    """Stream the get_plan_json tool input from Claude.
+
+    ``on_week_completed(weeks)`` is called with the finished weeks each
+    time a new week starts arriving, so they can be saved before the
+    whole plan is done. Returns the validated, complete tool input.
+    """
+    client = get_anthropic_client()
+    params = plan_request_params(prompt, max_tokens, model)
+    completed = 0
+    started = time.perf_counter()
+    deadline = attempt_deadline(params["model"])
+    with client.messages.stream(**params, timeout=deadline) as stream:
+        for event in stream:
+            if event.type != "input_json" or not isinstance(event.snapshot, dict):
+                continue
+            # Every week before the last one in the snapshot is closed
+            weeks = event.snapshot.get("plan_weeks") or []
+            if len(weeks) - 1 > completed:
+                completed = len(weeks) - 1
+                on_week_completed(weeks[:completed])
+        message = stream.get_final_message()
+    record_latency(params["model"], time.perf_counter() - started)
+    return validated_plan_data(client, params, message, usage)
+
+
+# --- PARALLEL WEEK GENERATION ---
+# Output tokens dominate generation time, so instead of one call writing
+# both weeks, a short call lays out the plan and each week is then
+# written by its own call, all at once.
+SKELETON_MAX_TOKENS = 1024
+WEEK_SCHEMA = PLAN_SCHEMA["properties"]["plan_weeks"]["items"]
+SKELETON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "plan_title": PLAN_SCHEMA["properties"]["plan_title"],
+        "plan_summary": PLAN_SCHEMA["properties"]["plan_summary"],
+        "plan_weeks": {
+            "type": "array",
+            "description": "Each week's day-by-day layout, without exercises.",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "week_number": {"type": "integer"},
+                    "days": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "day": {"type": "string"},
+                                "focus": {
+                                    "type": "string",
+                                    "enum": [
+                                        "strength",
+                                        "cardio",
+                                        "flexibility",
+                                        "mixed",
+                                        "rest",
+                                    ],
+                                },
+                            },
+                            "required": ["day", "focus"],
+                        },
+                    },
+                },
+                "required": ["week_number", "days"],
+            },
+        },
+    },
+    "required": ["plan_title", "plan_summary", "plan_weeks"],
+}
+SKELETON_TOOL = {
+    "name": "get_plan_skeleton",
+    "description": "Lays out the 2-week plan's training and rest days.",
+    "input_schema": SKELETON_SCHEMA,
+}
+WEEK_TOOL = {
+    "name": "get_plan_week",
+    "description": "Generates one week of the plan, following its skeleton.",
+    "input_schema": WEEK_SCHEMA,
+}
+# Shared by the skeleton and week calls so they share one cached prefix
+PARALLEL_SYSTEM_PROMPT = (
+    PLAN_RULES
+    + """
+The plan is built in parts. Return only the part the message asks for:
+- `get_plan_skeleton`: plan_title, plan_summary and, for both weeks, every
+  day of the week with its focus, using "rest" for rest days.
+- `get_plan_week`: that week's complete workouts, following the skeleton's
+  days and focus exactly.
+
+Do not include any text, conversation, or markdown outside of the tool's input.
+"""
+)
+
+
+def part_request_params(content, tool, max_tokens, model):
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": content}],
+        "tool_choice": {"type": "tool", "name": tool["name"]},
+        **cached_prefix(PARALLEL_SYSTEM_PROMPT, [SKELETON_TOOL, WEEK_TOOL]),
+    }
+
+
+def week_prompt(prompt, skeleton, week_number):
+    layout = json.dumps(skeleton, ensure_ascii=False, separators=(",", ":"))
+    return (
+        f"{prompt}\n\nPlan skeleton: {layout}\n\n"
+        f"Generate week {week_number} with get_plan_week."
+    )
+
+
+def merge_plan_parts(skeleton, weeks):
+    """Combine the skeleton and its weeks into one plan, raising
+    PlanSchemaError unless it matches PLAN_SCHEMA and the layout."""
+    ai_data = {
+        "plan_title": skeleton["plan_title"],
+        "plan_summary": skeleton["plan_summary"],
+        "plan_weeks": [
+            dict(week, week_number=layout["week_number"])
+            for layout, week in zip(skeleton["plan_weeks"], weeks)
+        ],
+    }
+    errors = plan_schema_errors(ai_data)
+    for layout, week in zip(skeleton["plan_weeks"], ai_data["plan_weeks"]):
+        if len(week.get("days") or []) != len(layout["days"]):
+            errors.append(f"week {layout['week_number']} doesn't match its layout")
+    if errors:
+        raise PlanSchemaError("; ".join(errors[:5]))
+    return ai_data
+
+
+async def _request_part(client, content, tool, max_tokens, model, timing, usage):
+    """One part call. Latencies are appended to ``timing["latencies"]``
+    rather than recorded here, as recording blocks on Redis."""
+    started = time.perf_counter()
+    response = await client.messages.create(
+        **part_request_params(content, tool, max_tokens, model),
+        timeout=timing["deadline"],
+    )
+    timing["latencies"].append(time.perf_counter() - started)
+    record_usage(usage, response)
+    return extract_tool_input(response, tool["name"])
+
+
+async def _generate_plan_in_parts(prompt, days_per_week, model, timing, usage):
+    week_tokens = plan_max_tokens(days_per_week, weeks=1)
+    async with new_async_anthropic_client() as client:
+        skeleton = await _request_part(
+            client, prompt, SKELETON_TOOL, SKELETON_MAX_TOKENS, model, timing, usage
+        )
+        errors = plan_schema_errors(skeleton, SKELETON_SCHEMA, "skeleton")
+        if errors or not skeleton["plan_weeks"]:
+            raise PlanSchemaError(
+                "; ".join(errors[:5]) or "AI did not return plan_weeks data"
+            )
+        weeks = await asyncio.gather(
+            *(
+                _request_part(
+                    client,
+                    week_prompt(prompt, skeleton, layout["week_number"]),
+                    WEEK_TOOL,
+                    week_tokens,
+                    model,
+                    timing,
+                    usage,
+                )
+                for layout in skeleton["plan_weeks"]
+            )
+        )
+    return merge_plan_parts(skeleton, weeks)
+
+
+def request_plan_in_parallel(prompt, days_per_week, usage=None, model=None):
+    """Generate the plan skeleton, then every week concurrently, and
+    return the merged, validated plan.
+
+    The deadline is looked up before the event loop starts and the
+    latencies recorded after it ends, so no Redis call blocks the loop.
+    """
+    model = model or settings.PLAN_MODEL_FAST
+    timing = {"deadline": attempt_deadline(model), "latencies": []}
     try:
-        response = client.messages.create(
-            model="claude-haiku-4-5-20251001",
-            max_tokens=8192,
-            system=(
-                "You are an expert fitness trainer. "
-                "You MUST return a complete training plan "
-                "using the get_plan_json tool. "
-                "The response MUST include: plan_title, "
-                "plan_summary, and plan_weeks "
-                "(with all weeks, days, and exercises). "
-                "For rest days, use: "
-                "{'exercise': 'Rest Day', 'type': 'rest'}. "
-                "Never return partial data, "
-                "always include the complete 2-week plan structure."
-            ),
-            messages=[{"role": "user", "content": prompt}],
-            tool_choice={"type": "tool", "name": "get_plan_json"},
-            tools=[
+        return asyncio.run(
+            _generate_plan_in_parts(prompt, days_per_week, model, timing, usage)
+        )
+    finally:
+        for seconds in timing["latencies"]:
+            record_latency(model, seconds)
+
+
+def save_partial_plan(plan, weeks):
+    previous = plan.plan_json if isinstance(plan.plan_json, dict) else {}
+    if previous.get("draft"):
+        # Keep showing the draft's later weeks until Claude's arrive
+        weeks = weeks + previous["plan_weeks"][len(weeks) :]
+    plan.plan_json = {"plan_weeks": weeks, "partial": True}
+    plan.save(update_fields=["plan_json", "updated_at"])
+    publish_plan_ready(plan.pk, "week")
+
+
+def save_generated_plan(plan, ai_data, usage=None):
+    plan.plan_json = ai_data
+    plan.plan_summary = ai_data.get("plan_summary", "Plan generated.")
+    plan.plan_title = ai_data.get("plan_title", plan.plan_title or "New Training Plan")
+    for field in USAGE_FIELDS.values():
+        setattr(plan, field, (usage or {}).get(field, 0))
+    plan.save()
+    logger.info(
+        "Training plan %s generated successfully (tokens: %s)", plan.pk, usage or {}
+    )
+    publish_plan_ready(plan.pk, "ready")
+
+
+def save_failed_plan(plan, exc):
+    plan.plan_json = {"error": f"Generation failed: {exc}"}
+    plan.plan_summary = f"Generation failed: {exc}"
+    plan.save()
+    publish_plan_ready(plan.pk, "error")
+
+
+def draft_plan_data(plan):
+    """A local plan to show straight away while Claude refines it."""
+    return dict(build_local_plan_for(plan), draft=True)
+
+
+def save_local_plan(plan, reason):
+    """Finish ``plan`` with the local engine's plan instead of Claude's."""
+    ai_data = build_local_plan_for(plan)
+    ai_data["generated_by"] = "local"
+    ai_data["plan_summary"] += f" ({reason}, so this plan was built from your profile.)"
+    save_generated_plan(plan, ai_data)
+
+
+def save_unavailable_plan(plan, exc):
+    """Claude couldn't produce ``plan``: build it locally when
+    PLAN_LOCAL_FALLBACK is on, otherwise record the failure."""
+    if not settings.PLAN_LOCAL_FALLBACK:
+        save_failed_plan(plan, exc)
+        return
+    logger.warning("Falling back to the local plan engine for plan %s", plan.pk)
+    try:
+        save_local_plan(plan, "The AI planner was unavailable")
+    except Exception:
+        logger.exception("Local plan engine failed for plan %s", plan.pk)
+        save_failed_plan(plan, exc)
+
+
+# Markers on plan_json about how it was made, not part of the plan itself
+PLAN_STATE_KEYS = ("draft", "partial", "error", "revision_error")
+
+
+def plan_content(plan_json):
+    """``plan_json`` without its PLAN_STATE_KEYS markers."""
+    return {
+        key: value for key, value in plan_json.items() if key not in PLAN_STATE_KEYS
+    }
+
+
+def save_failed_revision(plan, exc):
+    """A revision couldn't be made: keep the plan it revised, rather than
+    a local plan, and note why on it."""
+    prior = plan.plan_json if isinstance(plan.plan_json, dict) else {}
+    if plan.previous_plan is not None and not prior.get("plan_weeks"):
+        prior = plan.previous_plan.plan_json
+    plan.plan_json = plan_content(prior)
+    plan.plan_json["revision_error"] = f"Revision failed: {exc}"
+    plan.save()
+    publish_plan_ready(plan.pk, "error")
+
+
+def ai_queue_depth():
+    """Tasks waiting on the ai queue, across its priority lists."""
+    options = settings.CELERY_BROKER_TRANSPORT_OPTIONS
+    keys = [AI_QUEUE] + [
+        f"{AI_QUEUE}{options['sep']}{step}" for step in options["priority_steps"][1:]
+    ]
+    pipe = get_redis().pipeline()
+    for key in keys:
+        pipe.llen(key)
+    return sum(pipe.execute())
+
+
+def ai_queue_is_saturated():
+    """True when more than PLAN_QUEUE_SATURATION plans are waiting.
+    Fails open: if Redis can't be asked, plans are queued as usual."""
+    limit = settings.PLAN_QUEUE_SATURATION
+    if not limit:
+        return False
+    try:
+        return ai_queue_depth() > limit
+    except redis.RedisError:
+        return False
+
+
+def plan_is_complete(plan):
+    return bool(
+        isinstance(plan.plan_json, dict)
+        and plan.plan_json.get("plan_weeks")
+        and not plan.plan_json.get("partial")
+        and not plan.plan_json.get("draft")
+    )
+
+
+def acquire_generation_lock(plan_id):
+    """Return the plan's generation lock and whether it was acquired:
+    None if Redis couldn't be asked, so generation fails open."""
+    lock = get_redis().lock(
+        f"plan-generation-lock:{plan_id}",
+        timeout=GENERATION_LOCK_SECONDS,
+        blocking=False,
+    )
+    try:
+        return lock, lock.acquire()
+    except redis.RedisError:
+        return lock, None
+
+
+def release_generation_lock(lock, locked):
+    if locked:
+        try:
+            lock.release()
+        except redis.RedisError:
+            pass
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=TRANSIENT_ERRORS,
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_jitter=True,
+    max_retries=5,
+)
+def generate_training_plan_task(self, plan_id, use_cache=True):
+    """Generate a 2-week training plan using Claude API.
+
+    Identical prompts are served from the plan cache unless
+    ``use_cache`` is False (the user asked for a fresh plan). With
+    PLAN_PARALLEL_WEEKS on, the weeks are generated concurrently; with
+    PLAN_STREAMING on, each week is saved as soon as it is generated.
+    Transient provider errors are retried with jittered backoff; if
+    Claude still can't produce the plan, the local engine builds it.
+    """
+    try:
+        plan = TrainingPlan.objects.get(id=plan_id)
+    except TrainingPlan.DoesNotExist:
+        logger.error("TrainingPlan %s not found", plan_id)
+        return
+
+    # Idempotency: a redelivered task must not redo or overwrite a plan
+    if plan_is_complete(plan):
+        logger.info("Training plan %s already generated, skipping", plan_id)
+        return
+    lock, locked = acquire_generation_lock(plan_id)
+    if locked is False:
+        logger.info("Training plan %s is already being generated", plan_id)
+        return
+
+    try:
+        # The lock holder before us may have finished it since we loaded it
+        plan.refresh_from_db(fields=["plan_json"])
+        if plan_is_complete(plan):
+            logger.info("Training plan %s already generated, skipping", plan_id)
+            return
+        usage = Counter()
+        prompt = build_plan_prompt(plan)
+        max_tokens = plan_max_tokens(plan.user.exercise_days_per_week)
+        model = choose_plan_model(plan)
+        cache_key = plan_cache_key(model, SYSTEM_PROMPT, prompt, PLAN_SCHEMA)
+        ai_data = get_cached_plan(cache_key) if use_cache else None
+        if ai_data is not None:
+            logger.info("Training plan %s served from cache", plan_id)
+        elif settings.PLAN_PARALLEL_WEEKS:
+            ai_data = request_plan_in_parallel(
+                prompt, plan.user.exercise_days_per_week, usage, model
+            )
+            set_cached_plan(cache_key, ai_data)
+        elif settings.PLAN_STREAMING:
+            ai_data = stream_plan_from_claude(
+                prompt,
+                lambda weeks: save_partial_plan(plan, weeks),
+                usage,
+                max_tokens,
+                model,
+            )
+            set_cached_plan(cache_key, ai_data)
+        else:
+            ai_data = request_plan_from_claude(prompt, usage, max_tokens, model)
+            set_cached_plan(cache_key, ai_data)
+        save_generated_plan(plan, ai_data, usage)
+
+    except TRANSIENT_ERRORS as exc:
+        if self.request.retries < self.max_retries:
+            logger.warning("Transient error for plan %s, retrying: %s", plan_id, exc)
+            raise
+        logger.exception("Giving up on plan %s after retries", plan_id)
+        save_unavailable_plan(plan, exc)
+
+    except Exception as exc:
+        logger.exception("Error generating plan %s: %s", plan_id, str(exc))
+        save_unavailable_plan(plan, exc)
+
+    finally:
+        release_generation_lock(lock, locked)
+
+
+async def validated_plan_data_async(client, params, message, usage=None):
+    """validated_plan_data() for the async client."""
+    for attempt in range(PLAN_REPAIR_ATTEMPTS + 1):
+        record_usage(usage, message)
+        try:
+            return extract_plan_data(message)
+        except PlanSchemaError as exc:
+            if attempt == PLAN_REPAIR_ATTEMPTS:
+                raise
+            logger.warning("Repairing invalid plan response: %s", exc)
+            message = await routed_create_async(
+                client, repair_request_params(params, message, exc)
+            )
+
+
+async def _generate_plan_async(client, semaphore, plan_id, use_cache):
+    """One plan of an async batch, with the same idempotency check, lock,
+    routing and schema repair as generate_training_plan_task. A transient
+    error hands the plan to that task, which retries it with backoff."""
+    try:
+        plan = await TrainingPlan.objects.select_related("user", "previous_plan").aget(
+            id=plan_id
+        )
+    except TrainingPlan.DoesNotExist:
+        logger.error("TrainingPlan %s not found", plan_id)
+        return
+
+    if plan_is_complete(plan):
+        logger.info("Training plan %s already generated, skipping", plan_id)
+        return
+    lock, locked = await sync_to_async(acquire_generation_lock)(plan_id)
+    if locked is False:
+        logger.info("Training plan %s is already being generated", plan_id)
+        return
+
+    retry = False
+    try:
+        # The lock holder before us may have finished it since we loaded it
+        await plan.arefresh_from_db(fields=["plan_json"])
+        if plan_is_complete(plan):
+            logger.info("Training plan %s already generated, skipping", plan_id)
+            return
+        prompt = build_plan_prompt(plan)
+        model = choose_plan_model(plan)
+        cache_key = plan_cache_key(model, SYSTEM_PROMPT, prompt, PLAN_SCHEMA)
+        ai_data = None
+        usage = Counter()
+        if use_cache:
+            ai_data = await sync_to_async(get_cached_plan)(cache_key)
+        if ai_data is None:
+            params = plan_request_params(
+                prompt, plan_max_tokens(plan.user.exercise_days_per_week), model
+            )
+            async with semaphore:
+                response = await routed_create_async(client, params)
+                ai_data = await validated_plan_data_async(
+                    client, params, response, usage
+                )
+            await sync_to_async(set_cached_plan)(cache_key, ai_data)
+        await sync_to_async(save_generated_plan)(plan, ai_data, usage)
+
+    except TRANSIENT_ERRORS as exc:
+        logger.warning("Transient error for plan %s, retrying: %s", plan_id, exc)
+        retry = True
+
+    except Exception as exc:
+        logger.exception("Error generating plan %s: %s", plan_id, str(exc))
+        await sync_to_async(save_unavailable_plan)(plan, exc)
+
+    finally:
+        await sync_to_async(release_generation_lock)(lock, locked)
+
+    # Queued only once the lock is released, or the retry would skip itself
+    if retry:
+        await sync_to_async(generate_training_plan_task.apply_async)(
+            args=[plan_id],
+            kwargs={"use_cache": use_cache},
+            priority=PRIORITY_RETRY,
+        )
+
+
+async def _generate_plans_async(plan_ids, use_cache):
+    semaphore = asyncio.Semaphore(settings.ANTHROPIC_MAX_CONNECTIONS)
+    async with new_async_anthropic_client() as client:
+        await asyncio.gather(
+            *(
+                _generate_plan_async(client, semaphore, plan_id, use_cache)
+                for plan_id in plan_ids
+            )
+        )
+
+
+@shared_task
+def generate_training_plans_async_task(plan_ids, use_cache=True):
+    """Generate several plans concurrently from a single worker process.
+
+    The Claude calls share one pooled async client, so a worker waits on
+    many in-flight requests at once instead of one blocking call each.
+    """
+    asyncio.run(_generate_plans_async(plan_ids, use_cache))
+
+
+# --- BATCH REGENERATION ---
+# Plans last two weeks, after which users are re-planned in bulk through
+# the Message Batches API rather than one blocking call per worker slot.
+PLAN_LENGTH_DAYS = 14
+BATCH_MAX_REQUESTS = 1000
+
+
+def _batch_custom_id(plan_id):
+    return f"plan-{plan_id}"
+
+
+def plans_due_for_regeneration(today=None):
+    """Each user's latest completed plan, if it has run its two weeks."""
+    today = today or date.today()
+    latest = (
+        TrainingPlan.objects.filter(user=OuterRef("user"))
+        .order_by("-start_date", "-pk")
+        .values("pk")[:1]
+    )
+    return TrainingPlan.objects.filter(
+        pk=Subquery(latest),
+        start_date__lte=today - timedelta(days=PLAN_LENGTH_DAYS),
+        plan_json__has_key="plan_weeks",
+    ).select_related("user")
+
+
+@shared_task
+def submit_plan_regeneration_batch():
+    """Create follow-on plans for ended plans and submit them as batches."""
+    due = list(plans_due_for_regeneration()[:BATCH_MAX_REQUESTS])
+    if not due:
+        return None
+    new_plans = [
+        TrainingPlan.objects.create(
+            user=old.user,
+            previous_plan=old,
+            plan_json={},
+            goal_type=old.goal_type,
+            target_event=old.target_event,
+            target_date=old.target_date,
+            plan_preferences=old.plan_preferences,
+        )
+        for old in due
+    ]
+    try:
+        batch = get_anthropic_client().messages.batches.create(
+            requests=[
                 {
-                    "name": "get_plan_json",
-                    "description": (
-                        "Generates 2-week plan based " "on user profile and rules."
+                    "custom_id": _batch_custom_id(plan.pk),
+                    "params": plan_request_params(
+                        build_plan_prompt(plan),
+                        plan_max_tokens(plan.user.exercise_days_per_week),
+                        choose_plan_model(plan),
                     ),
-                    "input_schema": PLAN_SCHEMA,
                 }
-            ],
+                for plan in new_plans
+            ]
         )
+    except Exception as exc:
+        logger.exception("Could not submit plan regeneration batch")
+        for plan in new_plans:
+            save_unavailable_plan(plan, exc)
+        return None
+    PlanGenerationBatch.objects.create(
+        batch_id=batch.id, plan_ids=[plan.pk for plan in new_plans]
+    )
+    logger.info("Submitted batch %s for %s plans", batch.id, len(new_plans))
+    return batch.id
+
+
+@shared_task
+def poll_plan_batches():
+    """Fan results of finished batches back into their training plans."""
+    client = get_anthropic_client()
+    for plan_batch in PlanGenerationBatch.objects.filter(completed_at__isnull=True):
+        batch = client.messages.batches.retrieve(plan_batch.batch_id)
+        if batch.processing_status != "ended":
+            continue
+        plans = TrainingPlan.objects.in_bulk(plan_batch.plan_ids)
+        for entry in client.messages.batches.results(plan_batch.batch_id):
+            plan = plans.pop(int(entry.custom_id.removeprefix("plan-")), None)
+            if plan is None:
+                continue
+            try:
+                if entry.result.type != "succeeded":
+                    raise ValueError(f"Batch request {entry.result.type}")
+                message = entry.result.message
+                usage = Counter()
+                record_usage(usage, message)
+                save_generated_plan(plan, extract_plan_data(message), usage)
+            except Exception as exc:
+                logger.warning("Batch plan %s failed: %s", plan.pk, exc)
+                save_unavailable_plan(plan, exc)
+        # Anything the batch didn't return a result for
+        for plan in plans.values():
+            save_unavailable_plan(plan, ValueError("Missing from batch results"))
+        plan_batch.completed_at = timezone.now()
+        plan_batch.save(update_fields=["completed_at"])
 
-        if response.content and response.content[0].type == "tool_use":
-            tool_use = response.content[0]
-            if tool_use.name == "get_plan_json":
-                ai_data = tool_use.input
-                if "plan_weeks" not in ai_data or not ai_data["plan_weeks"]:
-                    raise ValueError("AI did not return plan_weeks data")
-                plan.plan_json = ai_data
-                plan.plan_summary = ai_data.get("plan_summary", "Plan generated.")
-                plan.plan_title = ai_data.get(
-                    "plan_title", plan.plan_title or "New Training Plan"
-                )
-                plan.save()
-                logger.info("Training plan %s generated successfully", plan_id)
-            else:
-                raise ValueError(f"Unexpected tool used: {tool_use.name}")
-        else:
-            raise ValueError("AI response did not contain a tool use block.")
+
+# --- INCREMENTAL REVISION ---
+# A revision copies a finished plan and asks Claude only for the days
+# that changed inputs affect, instead of regenerating all fourteen.
+REVISED_FIELDS = ["minor_injuries", "plan_preferences"]
+DAY_WORKOUT_SCHEMA = WEEK_SCHEMA["properties"]["days"]["items"]["properties"]["workout"]
+PATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "changed_days": {
+            "type": "array",
+            "description": "Only the days whose workout must change.",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "week_number": {"type": "integer"},
+                    "day": {"type": "string"},
+                    "workout": DAY_WORKOUT_SCHEMA,
+                },
+                "required": ["week_number", "day", "workout"],
+            },
+        },
+        "plan_summary": {
+            "type": "string",
+            "description": "A new summary, only if the old one no longer fits.",
+        },
+    },
+    "required": ["changed_days"],
+}
+PATCH_TOOL = {
+    "name": "get_plan_patch",
+    "description": "Returns replacement workouts for the affected days only.",
+    "input_schema": PATCH_SCHEMA,
+}
+REVISION_SYSTEM_PROMPT = (
+    PLAN_RULES
+    + """
+The user already has a plan and some of their inputs have changed. Return,
+with `get_plan_patch`, a complete replacement workout for each day that the
+changes affect and nothing for days that can stay as they are. Leave
+plan_summary out unless the current one no longer describes the plan.
+
+Do not include any text, conversation, or markdown outside of the tool's input.
+"""
+)
+
+
+def revision_changes(plan):
+    """Inputs that differ from the revised plan's, as before/after pairs."""
+    previous = plan.previous_plan
+    changes = {}
+    for field in REVISED_FIELDS:
+        before = (getattr(previous, field) or "").strip()
+        after = (getattr(plan, field) or "").strip()
+        if before != after:
+            changes[field] = {"before": before, "after": after}
+    return changes
+
+
+def revision_prompt(plan):
+    current = plan.previous_plan.plan_json
+    compact = {"plan_summary": current.get("plan_summary", "")}
+    compact["plan_weeks"] = current["plan_weeks"]
+    return "\n\n".join(
+        [
+            build_plan_prompt(plan),
+            "Current plan: "
+            + json.dumps(compact, ensure_ascii=False, separators=(",", ":")),
+            "Changed inputs: "
+            + json.dumps(
+                revision_changes(plan), ensure_ascii=False, separators=(",", ":")
+            ),
+        ]
+    )
+
+
+def apply_plan_patch(plan_json, patch):
+    """``plan_json`` with the patch's days replaced, raising
+    PlanSchemaError if a day doesn't exist or the result is invalid."""
+    ai_data = copy.deepcopy(plan_content(plan_json))
+    days = {
+        (week.get("week_number"), day.get("day", "").lower()): day
+        for week in ai_data["plan_weeks"]
+        for day in week.get("days") or []
+    }
+    for change in patch["changed_days"]:
+        day = days.get((change["week_number"], change["day"].lower()))
+        if day is None:
+            raise PlanSchemaError(
+                f"No {change['day']} in week {change['week_number']} to patch"
+            )
+        day["workout"] = change["workout"]
+    if patch.get("plan_summary"):
+        ai_data["plan_summary"] = patch["plan_summary"]
+    errors = plan_schema_errors(ai_data)
+    if errors:
+        raise PlanSchemaError("; ".join(errors[:5]))
+    return ai_data
+
+
+def request_plan_patch(plan, usage=None):
+    """Ask Claude which days to rewrite and return the patched plan."""
+    model = choose_plan_model(plan)
+    params = {
+        "model": model,
+        "max_tokens": plan_max_tokens(plan.user.exercise_days_per_week),
+        "messages": [{"role": "user", "content": revision_prompt(plan)}],
+        "tool_choice": {"type": "tool", "name": PATCH_TOOL["name"]},
+        **cached_prefix(REVISION_SYSTEM_PROMPT, [PATCH_TOOL]),
+    }
+    message = routed_create(get_anthropic_client(), params)
+    record_usage(usage, message)
+    patch = extract_tool_input(message, PATCH_TOOL["name"])
+    errors = plan_schema_errors(patch, PATCH_SCHEMA, "patch")
+    if errors:
+        raise PlanSchemaError("; ".join(errors[:5]))
+    logger.info("Revision %s rewrites %s days", plan.pk, len(patch["changed_days"]))
+    return apply_plan_patch(plan.previous_plan.plan_json, patch)
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=TRANSIENT_ERRORS,
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_jitter=True,
+    max_retries=5,
+)
+def revise_training_plan_task(self, plan_id):
+    """Finish a revision (a plan whose previous_plan it revises) by
+    patching only the days its changed inputs affect."""
+    try:
+        plan = TrainingPlan.objects.select_related("user", "previous_plan").get(
+            id=plan_id
+        )
+    except TrainingPlan.DoesNotExist:
+        logger.error("TrainingPlan %s not found", plan_id)
+        return
+    if plan_is_complete(plan):
+        logger.info("Revision %s already generated, skipping", plan_id)
+        return
+    lock, locked = acquire_generation_lock(plan_id)
+    if locked is False:
+        logger.info("Revision %s is already being generated", plan_id)
+        return
+
+    try:
+        # The lock holder before us may have finished it since we loaded it
+        plan.refresh_from_db(fields=["plan_json"])
+        if plan_is_complete(plan):
+            logger.info("Revision %s already generated, skipping", plan_id)
+            return
+        usage = Counter()
+        save_generated_plan(plan, request_plan_patch(plan, usage), usage)
+
+    except TRANSIENT_ERRORS as exc:
+        if self.request.retries < self.max_retries:
+            logger.warning("Transient error for plan %s, retrying: %s", plan_id, exc)
+            raise
+        logger.exception("Giving up on revision %s after retries", plan_id)
+        save_failed_revision(plan, exc)
 
     except Exception as exc:
-        logger.exception("Error generating plan %s: %s", plan_id, str(exc))
-        plan.plan_json = {"error": f"Generation failed: {exc}"}
-        plan.plan_summary = f"Generation failed: {exc}"
-        plan.save()
+        logger.exception("Error revising plan %s: %s", plan_id, str(exc))
+        save_failed_revision(plan, exc)
+
+    finally:
+        release_generation_lock(lock, locked)
@@ -0,0 +1,85 @@
+import threading
+import time
+from django.test import SimpleTestCase
+from fitness.cache_backends import TwoTierRedisCache
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for the Django cache client."""
+
+    def __init__(self):
+        self.data = {}
+        self.reads = 0
+
+    def get(self, key):
+        self.reads += 1
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        return int(self.data.pop(key, None) is not None)
+
+
+class TwoTierRedisCacheTest(SimpleTestCase):
+    """Tests the Redis cache backend's in-memory tier and stampede guard."""
+
+    def make_cache(self, **options):
+        cache = TwoTierRedisCache("redis://localhost:6379/0", {"OPTIONS": options})
+        self.redis = FakeRedis()
+        cache._cache.get_client = lambda *args, **kwargs: self.redis
+        return cache
+
+    def test_repeat_reads_are_served_from_memory(self):
+        """Tests a second read of a key doesn't go back to Redis."""
+        cache = self.make_cache(L1_MAX_ENTRIES=10, L1_TIMEOUT=60)
+        cache.set("plan", {"weeks": 2})
+        cache._cache.l1.clear()
+        self.assertEqual(cache.get("plan"), {"weeks": 2})
+        self.assertEqual(cache.get("plan"), {"weeks": 2})
+        self.assertEqual(self.redis.reads, 1)
+
+    def test_memory_tier_is_size_bounded(self):
+        """Tests the least recently used key is evicted from memory."""
+        cache = self.make_cache(L1_MAX_ENTRIES=2, L1_TIMEOUT=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.redis.reads = 0
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(self.redis.reads, 0)
+        self.assertEqual(cache.get("b"), 2)
+        self.assertEqual(self.redis.reads, 1)
+
+    def test_get_or_set_recomputes_once_under_concurrency(self):
+        """Tests concurrent misses only run the expensive default once."""
+        cache = self.make_cache(L1_MAX_ENTRIES=0, STAMPEDE_WAIT=5)
+        calls = []
+
+        def expensive():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(cache.get_or_set("key", expensive))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 5)
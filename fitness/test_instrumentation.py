@@ -0,0 +1,105 @@
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from fitness.instrumentation import RequestMetrics, fingerprint, record_cache_lookup
+from fitness.middleware import RequestMetricsMiddleware
+from fitness.models import TrainingPlan, UserProfile
+from fitness.cache_backends import TwoTierRedisCache
+from fitness.test_cache import FakeRedis
+
+
+class FingerprintTest(SimpleTestCase):
+    """Tests SQL fingerprints group queries that differ only by values."""
+
+    def test_literals_are_removed(self):
+        """Tests ids, strings and IN lists don't change the fingerprint."""
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 1 AND name = 'a''b'"),
+            fingerprint("SELECT * FROM t  WHERE id = 22 AND name = 'c'"),
+        )
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s)"),
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s)"),
+        )
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_SAMPLE_RATE=1.0)
+class RequestMetricsMiddlewareTest(TestCase):
+    """Tests the per-request Server-Timing header and log line."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="runner")
+        self.client.force_login(self.user)
+
+    def test_server_timing_and_log_line(self):
+        """Tests queries, templates and the view are reported."""
+        url = reverse("profile_detail", args=["runner"])
+        with self.assertLogs("fitness.request_metrics", "INFO") as logs:
+            response = self.client.get(url)
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(timing, r"tpl;dur=[\d.]+")
+        record = logs.records[0]
+        self.assertEqual(record.request_metrics["view"], "profile_detail")
+        self.assertGreater(record.request_metrics["queries"], 0)
+        self.assertGreater(record.request_metrics["template_ms"], 0)
+
+    def test_wraps_async_handlers_natively(self):
+        """Tests the middleware is a coroutine function over an async chain."""
+
+        async def get_response(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(RequestMetricsMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(RequestMetricsMiddleware(HttpResponse)))
+
+    async def test_async_requests_are_measured(self):
+        """Tests requests to async views are measured without a sync hop."""
+        plan = await TrainingPlan.objects.acreate(
+            user=await UserProfile.objects.aget(user=self.user),
+            plan_json={"plan_weeks": []},
+        )
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs("fitness.request_metrics", "INFO") as logs:
+            response = await self.async_client.get(
+                reverse("plan_events", args=[plan.pk])
+            )
+        self.assertRegex(response["Server-Timing"], r'desc="\d+ queries"')
+        self.assertEqual(logs.records[0].request_metrics["view"], "plan_events")
+        self.assertGreater(logs.records[0].request_metrics["queries"], 0)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_untouched(self):
+        """Tests requests outside the sample get no header."""
+        response = self.client.get(reverse("profile_detail", args=["runner"]))
+        self.assertNotIn("Server-Timing", response)
+
+    def test_repeated_queries_share_a_fingerprint(self):
+        """Tests an N+1 pattern shows up as one repeated fingerprint."""
+        metrics = RequestMetrics()
+        with metrics.collect():
+            for username in ("a", "b", "c"):
+                User.objects.filter(username=username).exists()
+        [(sql, count)] = metrics.duplicates()
+        self.assertEqual(count, 3)
+        self.assertIn("auth_user", sql)
+
+
+class CacheLookupMetricsTest(SimpleTestCase):
+    """Tests the Redis cache backend reports hits and misses."""
+
+    def test_hits_and_misses_are_counted(self):
+        """Tests get and get_many feed the current request's metrics."""
+        cache = TwoTierRedisCache("redis://localhost:6379/0", {})
+        redis = FakeRedis()
+        cache._cache.get_client = lambda *args, **kwargs: redis
+        cache.set("a", 1)
+        metrics = RequestMetrics()
+        with metrics.collect():
+            cache.get("a")
+            cache.get("missing")
+            cache.get_many(["a", "b"])
+        record_cache_lookup(hits=5, misses=5)  # outside a request: ignored
+        self.assertEqual((metrics.cache_hits, metrics.cache_misses), (2, 2))
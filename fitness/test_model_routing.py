@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from fitness import model_routing
+from fitness.models import TrainingPlan
+
+
+class FakeHashRedis:
+    """Just enough of redis.Redis for the latency histograms."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.queued = []
+
+    def pipeline(self):
+        return self
+
+    def hincrby(self, key, field, amount):
+        self.queued.append(lambda: self._incr(key, field, amount))
+
+    def _incr(self, key, field, amount):
+        bucket = self.hashes.setdefault(key, {})
+        bucket[field] = bucket.get(field, 0) + amount
+        return bucket[field]
+
+    def expire(self, key, seconds):
+        self.queued.append(lambda: True)
+
+    def hgetall(self, key):
+        self.queued.append(lambda: dict(self.hashes.get(key, {})))
+
+    def execute(self):
+        results = [command() for command in self.queued]
+        self.queued = []
+        return results
+
+
+class ModelChoiceTest(TestCase):
+    """Tests plans are routed to a model by how complex they are."""
+
+    def setUp(self):
+        self.profile = User.objects.create_user(username="router").userprofile
+        self.plan = TrainingPlan.objects.create(user=self.profile, plan_json={})
+
+    @override_settings(
+        PLAN_MODEL_FAST="fast",
+        PLAN_MODEL_COMPLEX="complex",
+        PLAN_COMPLEXITY_THRESHOLD=2,
+    )
+    def test_complex_requests_get_the_complex_model(self):
+        """Tests the model switches exactly at the threshold score."""
+        self.assertEqual(model_routing.plan_complexity(self.plan), 0)
+        self.assertEqual(model_routing.choose_plan_model(self.plan), "fast")
+        self.profile.exercise_days_per_week = 6
+        self.assertEqual(model_routing.plan_complexity(self.plan), 1)
+        self.assertEqual(model_routing.choose_plan_model(self.plan), "fast")
+        self.plan.minor_injuries = "Tight calf"
+        self.assertEqual(model_routing.plan_complexity(self.plan), 2)
+        self.assertEqual(model_routing.choose_plan_model(self.plan), "complex")
+        self.plan.plan_preferences = "More running"
+        self.assertEqual(model_routing.plan_complexity(self.plan), 3)
+        self.assertEqual(model_routing.choose_plan_model(self.plan), "complex")
+
+
+@override_settings(PLAN_LATENCY_MIN_SAMPLES=10, PLAN_ATTEMPT_DEADLINE=120)
+class LatencyHistogramTest(SimpleTestCase):
+    """Tests latency histograms and the deadlines they drive."""
+
+    def setUp(self):
+        self.redis = FakeHashRedis()
+        patcher = mock.patch.object(model_routing, "get_redis", lambda: self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_percentiles_need_enough_samples(self):
+        """Tests thresholds stay off until the histogram has data."""
+        model_routing.record_latency("m", 4)
+        self.assertIsNone(model_routing.latency_percentile("m", 95))
+        self.assertEqual(model_routing.attempt_deadline("m"), 120)
+
+    def test_percentiles_and_deadline(self):
+        """Tests p95 and the p99-based deadline come from the buckets."""
+        for seconds in [2.5] * 18 + [20, 40]:
+            model_routing.record_latency("m", seconds)
+        self.assertEqual(model_routing.latency_percentile("m", 50), 3)
+        self.assertEqual(model_routing.latency_percentile("m", 95), 21)
+        self.assertEqual(model_routing.attempt_deadline("m"), 110)
+        self.assertIsNone(model_routing.latency_percentile("other", 95))
+
+
+class SlowThenFastMessages:
+    """messages double whose first call hangs and later calls return."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def create(self, **params):
+        self.calls += 1
+        if self.calls == 1:
+            self.release.wait(5)
+            return "primary"
+        return "hedge"
+
+
+@override_settings(PLAN_HEDGING=True)
+class HedgedRequestTest(SimpleTestCase):
+    """Tests a duplicate request is raced against a slow one."""
+
+    @mock.patch.object(model_routing, "record_latency")
+    @mock.patch.object(model_routing, "latency_histogram", return_value={})
+    def test_hedge_wins_when_primary_is_slow(self, *mocks):
+        """Tests the hedge's answer is used once the p95 has passed."""
+        messages = SlowThenFastMessages()
+        client = SimpleNamespace(messages=messages)
+        with mock.patch.object(
+            model_routing, "latency_percentile", side_effect=[None, 0.05]
+        ):
+            started = time.perf_counter()
+            result = model_routing.routed_create(client, {"model": "m"})
+        messages.release.set()
+        # Let the slow request record its latency while Redis is patched
+        model_routing.hedge_executor().shutdown(wait=True)
+        model_routing.hedge_executor.cache_clear()
+        self.assertEqual(result, "hedge")
+        self.assertEqual(messages.calls, 2)
+        self.assertLess(time.perf_counter() - started, 2)
+
+    @mock.patch.object(model_routing, "record_latency")
+    @mock.patch.object(model_routing, "latency_histogram", return_value={})
+    def test_async_hedge_cancels_the_slow_request(self, *mocks):
+        """Tests the async client races the hedge and cancels the loser."""
+        calls = []
+
+        async def create(**params):
+            calls.append(params)
+            if len(calls) == 1:
+                await asyncio.sleep(5)
+                return "primary"
+            return "hedge"
+
+        client = SimpleNamespace(messages=SimpleNamespace(create=create))
+        with mock.patch.object(
+            model_routing, "latency_percentile", side_effect=[None, 0.05]
+        ):
+            started = time.perf_counter()
+            result = asyncio.run(
+                model_routing.routed_create_async(client, {"model": "m"})
+            )
+        self.assertEqual(result, "hedge")
+        self.assertEqual(len(calls), 2)
+        self.assertLess(time.perf_counter() - started, 2)
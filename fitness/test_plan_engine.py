@@ -0,0 +1,119 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from fitness.models import TrainingPlan
+from fitness.plan_engine import build_local_plan
+from fitness.plan_summary import STATUS_GENERATING, STATUS_READY
+from fitness.tasks import generate_training_plan_task, plan_schema_errors
+from fitness.test_tasks import generation_lock
+
+
+class LocalPlanEngineTest(TestCase):
+    """Tests the rule-based plan generator."""
+
+    def setUp(self):
+        self.profile = User.objects.create_user(username="local_user").userprofile
+
+    def exercises(self, plan_json):
+        return [
+            item
+            for week in plan_json["plan_weeks"]
+            for day in week["days"]
+            for item in day["workout"]
+        ]
+
+    def test_plan_matches_schema_and_training_days(self):
+        """Tests a valid two-week plan with the requested training days."""
+        for days_per_week in range(1, 8):
+            self.profile.exercise_days_per_week = days_per_week
+            plan_json = build_local_plan(self.profile)
+            self.assertEqual(plan_schema_errors(plan_json), [])
+            for week in plan_json["plan_weeks"]:
+                self.assertEqual(len(week["days"]), 7)
+                training = [
+                    day for day in week["days"] if day["workout"][0]["type"] != "rest"
+                ]
+                self.assertEqual(len(training), days_per_week)
+
+    def test_injuries_and_equipment_shape_exercises(self):
+        """Tests injured areas are spared and listed equipment is used."""
+        self.profile.injuries_and_limitations = "Old ACL repair"
+        self.profile.equipment_text = "Pair of dumbbells"
+        self.profile.exercise_days_per_week = 5
+        plan_json = build_local_plan(self.profile, minor_injuries="sore wrist")
+        names = {item["exercise"] for item in self.exercises(plan_json)}
+        self.assertIn("Dumbbell Row", names)
+        for name in ("Bodyweight Squat", "Easy Run", "Push Ups", "Barbell Deadlift"):
+            self.assertNotIn(name, names)
+        self.assertIn("knee", plan_json["plan_summary"])
+
+    def test_same_inputs_give_the_same_plan(self):
+        """Tests generation is deterministic."""
+        self.assertEqual(build_local_plan(self.profile), build_local_plan(self.profile))
+
+
+@generation_lock
+@mock.patch("fitness.tasks.publish_plan_ready")
+@mock.patch("fitness.tasks.set_cached_plan")
+@mock.patch("fitness.tasks.get_cached_plan", return_value=None)
+class LocalPlanFallbackTest(TestCase):
+    """Tests the local engine stands in when Claude can't be used."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="fallback", password="pw")
+        self.plan = TrainingPlan.objects.create(
+            user=self.user.userprofile, plan_json={}
+        )
+
+    @mock.patch(
+        "fitness.tasks.request_plan_from_claude", side_effect=ValueError("down")
+    )
+    def test_provider_failure_falls_back_to_local_plan(self, *mocks):
+        """Tests a failed generation still leaves the user a plan."""
+        with self.assertLogs("fitness.tasks", "WARNING"):
+            generate_training_plan_task(self.plan.pk)
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.status, STATUS_READY)
+        self.assertEqual(self.plan.plan_json["generated_by"], "local")
+
+    @override_settings(PLAN_LOCAL_FALLBACK=False)
+    @mock.patch(
+        "fitness.tasks.request_plan_from_claude", side_effect=ValueError("down")
+    )
+    def test_fallback_can_be_switched_off(self, *mocks):
+        """Tests the failure is recorded when the fallback is off."""
+        with self.assertLogs("fitness.tasks", "WARNING"):
+            generate_training_plan_task(self.plan.pk)
+        self.plan.refresh_from_db()
+        self.assertIn("error", self.plan.plan_json)
+
+    @override_settings(PLAN_INSTANT_DRAFT=True)
+    @mock.patch("fitness.tasks.ai_queue_depth", return_value=0)
+    @mock.patch("fitness.views.generate_training_plan_task.apply_async")
+    def test_draft_is_shown_then_refined(self, apply_async, *mocks):
+        """Tests an instant draft is saved and still sent to Claude."""
+        self.client.login(username="fallback", password="pw")
+        self.client.post(reverse("create_training_plan"), {"minor_injuries": ""})
+        apply_async.assert_called_once()
+        plan = TrainingPlan.objects.latest("pk")
+        self.assertTrue(plan.plan_json["draft"])
+        self.assertEqual(plan.status, STATUS_GENERATING)
+        response = self.client.get(reverse("plan_detail", args=[plan.pk]))
+        self.assertContains(response, "quick draft")
+        refined = {"plan_title": "AI", "plan_summary": "", "plan_weeks": [{}]}
+        with mock.patch("fitness.tasks.request_plan_from_claude", return_value=refined):
+            generate_training_plan_task(plan.pk)
+        plan.refresh_from_db()
+        self.assertEqual(plan.plan_json, refined)
+
+    @mock.patch("fitness.views.generate_training_plan_task.apply_async")
+    @mock.patch("fitness.tasks.ai_queue_depth", return_value=1000)
+    def test_saturated_queue_is_bypassed(self, depth, apply_async, *mocks):
+        """Tests a backed-up ai queue gets a local plan instead of a task."""
+        self.client.login(username="fallback", password="pw")
+        self.client.post(reverse("create_training_plan"), {"minor_injuries": ""})
+        apply_async.assert_not_called()
+        plan = TrainingPlan.objects.latest("pk")
+        self.assertEqual(plan.status, STATUS_READY)
+        self.assertEqual(plan.plan_json["generated_by"], "local")
@@ -0,0 +1,84 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from fitness.search import FTS_TABLE, search_profiles
+
+
+class ProfileSearchTest(TestCase):
+    """Tests the indexed, ranked profile search."""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice")
+        self.alice.userprofile.goal_event = "London Marathon"
+        self.alice.userprofile.bio = "<p>Trail runner and marathon addict</p>"
+        self.alice.userprofile.save()
+        self.bob = User.objects.create_user(username="bob")
+        self.bob.userprofile.display_name = "Bob the Lifter"
+        self.bob.userprofile.goal_event = "Berlin Marathon"
+        self.bob.userprofile.save()
+
+    def test_search_document_follows_profile_changes(self):
+        """Tests the search document is rebuilt, without HTML, on save."""
+        self.alice.username = "alice_runs"
+        self.alice.save()
+        self.alice.userprofile.refresh_from_db()
+        self.assertEqual(
+            self.alice.userprofile.search_document,
+            "alice_runs alice london marathon trail runner and marathon addict",
+        )
+
+    def test_matches_any_field_best_first(self):
+        """Tests one query searches every field and ranks the best match
+        first."""
+        results = search_profiles("Marathon")
+        self.assertEqual(results[0], self.alice.userprofile)
+        self.assertIn(self.bob.userprofile, results)
+        self.assertEqual(search_profiles("lifter"), [self.bob.userprofile])
+
+    def test_short_queries_and_inactive_users(self):
+        """Tests short queries still match and inactive users are hidden."""
+        self.assertEqual(search_profiles("bo"), [self.bob.userprofile])
+        self.bob.is_active = False
+        self.bob.save()
+        self.assertEqual(search_profiles("bob"), [])
+
+    def test_combined_search_view(self):
+        """Tests the combined search endpoint renders ranked results."""
+        response = self.client.get(reverse("search_profiles"), {"q": "berlin"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "profiles/profile_search_results.html")
+        self.assertEqual(list(response.context["profiles"]), [self.bob.userprofile])
+
+    def test_combined_search_is_paginated(self):
+        """Tests combined results come a page at a time without overlap."""
+        for i in range(15):
+            User.objects.create_user(username=f"marathoner{i:02d}")
+        seen = []
+        params = {"q": "marathon"}
+        while True:
+            response = self.client.get(reverse("search_profiles"), params)
+            page = response.context["profiles"]
+            self.assertLessEqual(len(page), 12)
+            seen += [profile.pk for profile in page]
+            if not response.context["next_page"]:
+                break
+            params["after"] = response.context["next_page"]
+        self.assertEqual(len(seen), 17)
+        self.assertEqual(len(set(seen)), 17)
+
+    def test_field_search_uses_the_index(self):
+        """Tests per-field search goes through the index and stays within
+        its field."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("search_profiles_by_goal_event"), {"q": "marathon"}
+            )
+        profiles = list(response.context["profiles"])
+        self.assertEqual(profiles, [self.alice.userprofile, self.bob.userprofile])
+        self.assertTrue(any(FTS_TABLE in q["sql"] for q in queries))
+        response = self.client.get(
+            reverse("search_profiles_by_goal_event"), {"q": "lifter"}
+        )
+        self.assertEqual(list(response.context["profiles"]), [])
@@ -0,0 +1,833 @@
+import asyncio
+import json
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import mock
+import anthropic
+import httpx
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+from fitness import ai_clients
+from fitness.models import TrainingPlan, PlanGenerationBatch
+from fitness.plan_cache import plan_cache_key
+from fitness.plan_summary import STATUS_READY
+from fitness.prompt_builder import estimate_tokens, plan_max_tokens
+from fitness.tasks import (
+    apply_plan_patch,
+    build_plan_prompt,
+    generate_training_plan_task,
+    generate_training_plans_async_task,
+    merge_plan_parts,
+    plan_request_params,
+    poll_plan_batches,
+    request_plan_from_claude,
+    request_plan_in_parallel,
+    revise_training_plan_task,
+    submit_plan_regeneration_batch,
+    PLAN_SCHEMA,
+    PLAN_TOOL,
+    PlanSchemaError,
+)
+from fitness.test_model_routing import FakeHashRedis
+
+SAMPLE_PLAN = {
+    "plan_title": "Sample Plan",
+    "plan_summary": "Two easy weeks.",
+    "plan_weeks": [
+        {
+            "week_number": 1,
+            "days": [
+                {
+                    "day": "Monday",
+                    "workout": [{"exercise": "Rest Day", "type": "rest"}],
+                }
+            ],
+        }
+    ],
+}
+
+
+def acquired_lock(plan_id):
+    """acquire_generation_lock() stand-in that never touches Redis."""
+    return mock.Mock(), True
+
+
+# Class decorator giving every test the generation lock without Redis
+generation_lock = mock.patch("fitness.tasks.acquire_generation_lock", acquired_lock)
+# Class decorator keeping the per-model latency histograms out of Redis
+latency_histograms = mock.patch("fitness.model_routing.get_redis", FakeHashRedis)
+
+
+class PlanCacheKeyTest(TestCase):
+    """Tests for the content-addressed plan cache key."""
+
+    def test_whitespace_does_not_change_key(self):
+        """Tests cosmetic whitespace differences share a cache entry."""
+        key = plan_cache_key("model", "system", "a  prompt\n", PLAN_SCHEMA)
+        self.assertEqual(
+            key, plan_cache_key("model", " system", "a prompt", PLAN_SCHEMA)
+        )
+
+    def test_model_and_prompt_change_key(self):
+        """Tests a different model or prompt never reuses an entry."""
+        key = plan_cache_key("model", "system", "prompt", PLAN_SCHEMA)
+        self.assertNotEqual(
+            key, plan_cache_key("other", "system", "prompt", PLAN_SCHEMA)
+        )
+        self.assertNotEqual(
+            key, plan_cache_key("model", "system", "prompt 2", PLAN_SCHEMA)
+        )
+
+
+@generation_lock
+@mock.patch("fitness.tasks.publish_plan_ready")
+@mock.patch("fitness.tasks.set_cached_plan")
+class GenerateTrainingPlanTaskTest(TestCase):
+    """Tests for generate_training_plan_task with Claude mocked out."""
+
+    def setUp(self):
+        user = User.objects.create_user(username="task_user", password="pw")
+        self.plan = TrainingPlan.objects.create(user=user.userprofile, plan_json={})
+
+    @mock.patch("fitness.tasks.request_plan_from_claude")
+    @mock.patch("fitness.tasks.get_cached_plan", return_value=SAMPLE_PLAN)
+    def test_cache_hit_skips_claude(self, get_cached, request_plan, *mocks):
+        """Tests a cached plan is saved without calling Claude."""
+        generate_training_plan_task(self.plan.pk)
+        request_plan.assert_not_called()
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.plan_title, "Sample Plan")
+
+    @mock.patch("fitness.tasks.request_plan_from_claude", return_value=SAMPLE_PLAN)
+    @mock.patch("fitness.tasks.get_cached_plan", return_value=SAMPLE_PLAN)
+    def test_fresh_plan_bypasses_cache(
+        self, get_cached, request_plan, set_cached, publish
+    ):
+        """Tests use_cache=False always asks Claude and stores the result."""
+        generate_training_plan_task(self.plan.pk, use_cache=False)
+        get_cached.assert_not_called()
+        request_plan.assert_called_once()
+        set_cached.assert_called_once()
+        publish.assert_called_once_with(self.plan.pk, "ready")
+
+    @mock.patch("fitness.tasks.request_plan_from_claude")
+    def test_plan_locked_elsewhere_is_skipped(self, request_plan, *mocks):
+        """Tests a plan another worker holds the lock for isn't generated."""
+        with mock.patch(
+            "fitness.tasks.acquire_generation_lock", return_value=(mock.Mock(), False)
+        ):
+            generate_training_plan_task(self.plan.pk)
+        request_plan.assert_not_called()
+
+    @mock.patch("fitness.tasks.request_plan_from_claude")
+    def test_plan_finished_while_waiting_for_the_lock(self, request_plan, *mocks):
+        """Tests a plan completed between loading it and taking the lock
+        isn't regenerated."""
+        lock = mock.Mock()
+
+        def finish_then_lock(plan_id):
+            TrainingPlan.objects.filter(pk=plan_id).update(plan_json=SAMPLE_PLAN)
+            return lock, True
+
+        with mock.patch("fitness.tasks.acquire_generation_lock", finish_then_lock):
+            generate_training_plan_task(self.plan.pk)
+        request_plan.assert_not_called()
+        lock.release.assert_called_once()
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.plan_json, SAMPLE_PLAN)
+        self.assertFalse(self.plan.plan_json_changed())
+
+    @mock.patch("fitness.tasks.get_cached_plan")
+    def test_saved_plan_fills_summary_columns(self, get_cached, *mocks):
+        """Tests the task's save stores the plan's status and totals."""
+        squat = {"exercise": "Squat", "type": "strength", "sets": 3, "intensity": 7}
+        run = {"exercise": "Run", "type": "cardio", "sets": None, "intensity": 5}
+        day = {"day": "Tuesday", "workout": [squat, run]}
+        week = SAMPLE_PLAN["plan_weeks"][0]
+        get_cached.return_value = dict(
+            SAMPLE_PLAN,
+            plan_weeks=[dict(week, days=week["days"] + [day]), week],
+        )
+        self.assertEqual(self.plan.status, "pending")
+        generate_training_plan_task(self.plan.pk)
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.status, "ready")
+        self.assertEqual(self.plan.week_count, 2)
+        self.assertEqual(self.plan.training_day_count, 1)
+        self.assertEqual(self.plan.total_sets, 3)
+        self.assertEqual(self.plan.average_intensity, 6.0)
+
+
+class FakeBatches:
+    """Local stand-in for the Message Batches API endpoint."""
+
+    def __init__(self):
+        self.submitted = {}
+
+    def create(self, requests):
+        batch_id = f"msgbatch_{len(self.submitted) + 1}"
+        self.submitted[batch_id] = requests
+        return SimpleNamespace(id=batch_id)
+
+    def retrieve(self, batch_id):
+        return SimpleNamespace(id=batch_id, processing_status="ended")
+
+    def results(self, batch_id):
+        for request in self.submitted[batch_id]:
+            tool_use = SimpleNamespace(
+                type="tool_use", name="get_plan_json", input=SAMPLE_PLAN
+            )
+            yield SimpleNamespace(
+                custom_id=request["custom_id"],
+                result=SimpleNamespace(
+                    type="succeeded", message=SimpleNamespace(content=[tool_use])
+                ),
+            )
+
+
+@mock.patch("fitness.tasks.publish_plan_ready")
+class PlanBatchTasksTest(TestCase):
+    """Tests for batch regeneration against a fake batch endpoint."""
+
+    def setUp(self):
+        self.batches = FakeBatches()
+        client = SimpleNamespace(messages=SimpleNamespace(batches=self.batches))
+        patcher = mock.patch("fitness.tasks.get_anthropic_client", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user(username="batch_user", password="pw")
+        self.old_plan = TrainingPlan.objects.create(
+            user=user.userprofile, plan_json=SAMPLE_PLAN
+        )
+        # start_date is auto_now_add, so backdate it with an update
+        TrainingPlan.objects.filter(pk=self.old_plan.pk).update(
+            start_date=date.today() - timedelta(days=15)
+        )
+
+    def test_ended_plans_are_regenerated_through_a_batch(self, publish):
+        """Tests ended plans are submitted as one batch and filled in."""
+        batch_id = submit_plan_regeneration_batch()
+        self.assertEqual(len(self.batches.submitted[batch_id]), 1)
+        new_plan = TrainingPlan.objects.get(previous_plan=self.old_plan)
+        self.assertEqual(new_plan.plan_json, {})
+
+        poll_plan_batches()
+        new_plan.refresh_from_db()
+        self.assertEqual(new_plan.plan_title, "Sample Plan")
+        self.assertEqual(new_plan.plan_json, SAMPLE_PLAN)
+        self.assertIsNotNone(PlanGenerationBatch.objects.get().completed_at)
+        # The new plan is now the latest, so nothing else is due
+        self.assertIsNone(submit_plan_regeneration_batch())
+
+    def test_recent_plans_are_not_regenerated(self, publish):
+        """Tests plans still within their two weeks are left alone."""
+        TrainingPlan.objects.filter(pk=self.old_plan.pk).update(start_date=date.today())
+        self.assertIsNone(submit_plan_regeneration_batch())
+        self.assertEqual(self.batches.submitted, {})
+
+
+class FakeStream:
+    """Context manager mimicking MessageStream for a streamed tool input."""
+
+    def __init__(self, snapshots, final_input):
+        self.snapshots = snapshots
+        self.final_input = final_input
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        for snapshot in self.snapshots:
+            yield SimpleNamespace(type="input_json", snapshot=snapshot)
+
+    def get_final_message(self):
+        tool_use = SimpleNamespace(
+            type="tool_use", name="get_plan_json", input=self.final_input
+        )
+        return SimpleNamespace(content=[tool_use])
+
+
+@latency_histograms
+@generation_lock
+@mock.patch("fitness.tasks.set_cached_plan")
+@mock.patch("fitness.tasks.get_cached_plan", return_value=None)
+class StreamingPlanGenerationTest(TestCase):
+    """Tests streamed generation persists weeks as they complete."""
+
+    def setUp(self):
+        user = User.objects.create_user(username="stream_user", password="pw")
+        self.plan = TrainingPlan.objects.create(user=user.userprofile, plan_json={})
+
+    def test_completed_weeks_are_saved_while_streaming(self, *mocks):
+        """Tests week 1 is saved as partial before the plan finishes."""
+        week1 = {"week_number": 1, "days": []}
+        week2 = {"week_number": 2, "days": []}
+        final = dict(SAMPLE_PLAN, plan_weeks=[week1, week2])
+        stream = FakeStream(
+            [
+                {"plan_title": "Sample Plan", "plan_weeks": [week1]},
+                {"plan_title": "Sample Plan", "plan_weeks": [week1, {}]},
+                {"plan_title": "Sample Plan", "plan_weeks": [week1, week2]},
+            ],
+            final,
+        )
+        client = SimpleNamespace(
+            messages=SimpleNamespace(stream=lambda **params: stream)
+        )
+        saved = []
+
+        def record_week(plan_id, state):
+            if state == "week":
+                saved.append(TrainingPlan.objects.get(pk=plan_id).plan_json)
+
+        with (
+            self.settings(PLAN_STREAMING=True),
+            mock.patch("fitness.tasks.get_anthropic_client", return_value=client),
+            mock.patch("fitness.tasks.publish_plan_ready", side_effect=record_week),
+        ):
+            generate_training_plan_task(self.plan.pk)
+
+        self.assertEqual(saved, [{"plan_weeks": [week1], "partial": True}])
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.plan_json, final)
+
+
+class AnthropicClientRegistryTest(TestCase):
+    """Tests the per-process Anthropic client registry."""
+
+    def tearDown(self):
+        ai_clients.close_clients()
+
+    def test_client_is_shared_until_worker_init(self):
+        """Tests one client is reused and rebuilt for a new worker process."""
+        client = ai_clients.get_anthropic_client()
+        self.assertIs(client, ai_clients.get_anthropic_client())
+        ai_clients.init_worker_clients()
+        self.assertIsNot(client, ai_clients.get_anthropic_client())
+
+
+class FakeAsyncClient:
+    """Async client double recording how many calls ran at once."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.messages = SimpleNamespace(create=self.create)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def create(self, **params):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        tool_use = SimpleNamespace(
+            type="tool_use", name="get_plan_json", input=SAMPLE_PLAN
+        )
+        return SimpleNamespace(content=[tool_use])
+
+
+@latency_histograms
+@generation_lock
+@mock.patch("fitness.tasks.publish_plan_ready")
+@mock.patch("fitness.tasks.set_cached_plan")
+class AsyncPlanGenerationTest(TransactionTestCase):
+    """Tests the asyncio task variant generates plans concurrently."""
+
+    def test_plans_are_generated_concurrently(self, *mocks):
+        """Tests several plans are in flight at once and all saved."""
+        user = User.objects.create_user(username="async_user", password="pw")
+        plans = [
+            TrainingPlan.objects.create(user=user.userprofile, plan_json={})
+            for _ in range(3)
+        ]
+        client = FakeAsyncClient()
+        with mock.patch(
+            "fitness.tasks.new_async_anthropic_client", return_value=client
+        ):
+            generate_training_plans_async_task(
+                [plan.pk for plan in plans], use_cache=False
+            )
+        self.assertEqual(client.max_in_flight, 3)
+        for plan in plans:
+            plan.refresh_from_db()
+            self.assertEqual(plan.plan_title, "Sample Plan")
+
+    def test_complete_plans_are_skipped(self, *mocks):
+        """Tests a duplicated batch leaves finished plans alone."""
+        user = User.objects.create_user(username="async_done", password="pw")
+        plan = TrainingPlan.objects.create(user=user.userprofile, plan_json=SAMPLE_PLAN)
+        client = FakeAsyncClient()
+        client.messages = SimpleNamespace(create=mock.AsyncMock())
+        with mock.patch(
+            "fitness.tasks.new_async_anthropic_client", return_value=client
+        ):
+            generate_training_plans_async_task([plan.pk], use_cache=False)
+        client.messages.create.assert_not_called()
+
+    @mock.patch("fitness.tasks.generate_training_plan_task.apply_async")
+    def test_transient_error_is_handed_to_the_sync_task(self, apply_async, *mocks):
+        """Tests a rate-limited plan is queued for the retrying task."""
+        user = User.objects.create_user(username="async_retry", password="pw")
+        plan = TrainingPlan.objects.create(user=user.userprofile, plan_json={})
+        request = httpx.Request("POST", "https://api.anthropic.com")
+        rate_limited = anthropic.Anthropic(api_key="test")._make_status_error(
+            "Slow down", body=None, response=httpx.Response(429, request=request)
+        )
+        client = FakeAsyncClient()
+        client.messages = SimpleNamespace(
+            create=mock.AsyncMock(side_effect=rate_limited)
+        )
+        with (
+            mock.patch("fitness.tasks.new_async_anthropic_client", return_value=client),
+            self.assertLogs("fitness.tasks", "WARNING"),
+        ):
+            generate_training_plans_async_task([plan.pk], use_cache=False)
+        apply_async.assert_called_once()
+        self.assertEqual(apply_async.call_args.kwargs["args"], [plan.pk])
+        plan.refresh_from_db()
+        self.assertEqual(plan.plan_json, {})
+
+    def test_invalid_plan_is_repaired(self, *mocks):
+        """Tests a response that breaks the schema gets a repair prompt."""
+        user = User.objects.create_user(username="async_repair", password="pw")
+        plan = TrainingPlan.objects.create(user=user.userprofile, plan_json={})
+        invalid = SimpleNamespace(
+            content=[
+                SimpleNamespace(
+                    type="tool_use",
+                    id="toolu_1",
+                    name="get_plan_json",
+                    input={"plan_title": "No weeks"},
+                )
+            ]
+        )
+        client = FakeAsyncClient()
+        repaired = client.create
+        calls = []
+
+        async def create(**params):
+            calls.append(params)
+            if len(calls) == 1:
+                return invalid
+            return await repaired(**params)
+
+        client.messages = SimpleNamespace(create=create)
+        with (
+            mock.patch("fitness.tasks.new_async_anthropic_client", return_value=client),
+            self.assertLogs("fitness.tasks", "WARNING"),
+        ):
+            generate_training_plans_async_task([plan.pk], use_cache=False)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[1]["messages"][-1]["content"][0]["type"], "tool_result")
+        plan.refresh_from_db()
+        self.assertEqual(plan.plan_title, "Sample Plan")
+
+
+class FakePartsClient(FakeAsyncClient):
+    """Async client double answering skeleton and week calls."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def create(self, **params):
+        tool = params["tool_choice"]["name"]
+        self.calls.append(tool)
+        if tool == "get_plan_skeleton":
+            tool_input = {
+                "plan_title": "Parallel Plan",
+                "plan_summary": "Built week by week.",
+                "plan_weeks": [
+                    {"week_number": n, "days": [{"day": "Monday", "focus": "rest"}]}
+                    for n in (1, 2)
+                ],
+            }
+        else:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0.01)
+            self.in_flight -= 1
+            # Claude doesn't always number the week it was asked for
+            tool_input = dict(SAMPLE_PLAN["plan_weeks"][0], week_number=1)
+        tool_use = SimpleNamespace(type="tool_use", name=tool, input=tool_input)
+        usage = SimpleNamespace(input_tokens=10, output_tokens=5)
+        return SimpleNamespace(content=[tool_use], usage=usage)
+
+
+@latency_histograms
+@generation_lock
+@override_settings(PLAN_PARALLEL_WEEKS=True)
+@mock.patch("fitness.tasks.publish_plan_ready")
+@mock.patch("fitness.tasks.set_cached_plan")
+@mock.patch("fitness.tasks.get_cached_plan", return_value=None)
+class ParallelWeekGenerationTest(TestCase):
+    """Tests plans generated as a skeleton plus concurrent weeks."""
+
+    def setUp(self):
+        user = User.objects.create_user(username="parallel_user", password="pw")
+        self.plan = TrainingPlan.objects.create(user=user.userprofile, plan_json={})
+
+    def test_weeks_are_generated_concurrently_and_merged(self, *mocks):
+        """Tests both weeks are in flight at once after the skeleton."""
+        client = FakePartsClient()
+        with mock.patch(
+            "fitness.tasks.new_async_anthropic_client", return_value=client
+        ):
+            generate_training_plan_task(self.plan.pk)
+        self.assertEqual(client.calls[0], "get_plan_skeleton")
+        self.assertEqual(client.calls.count("get_plan_week"), 2)
+        self.assertEqual(client.max_in_flight, 2)
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.plan_title, "Parallel Plan")
+        weeks = self.plan.plan_json["plan_weeks"]
+        self.assertEqual([week["week_number"] for week in weeks], [1, 2])
+        self.assertEqual(self.plan.output_tokens, 15)
+
+    def test_redis_is_not_called_inside_the_event_loop(self, *mocks):
+        """Tests the deadline and latencies are handled outside the loop."""
+        calls = []
+
+        def outside_loop(*args):
+            with self.assertRaises(RuntimeError):
+                asyncio.get_running_loop()
+            calls.append(args)
+            return 60
+
+        with (
+            mock.patch(
+                "fitness.tasks.new_async_anthropic_client",
+                return_value=FakePartsClient(),
+            ),
+            mock.patch("fitness.tasks.attempt_deadline", side_effect=outside_loop),
+            mock.patch("fitness.tasks.record_latency", side_effect=outside_loop),
+        ):
+            request_plan_in_parallel("prompt", 3, model="m")
+        # One deadline lookup, then the skeleton and two week latencies
+        self.assertEqual(len(calls), 4)
+
+    def test_merged_plan_is_validated(self, *mocks):
+        """Tests a week that breaks PLAN_SCHEMA fails the merge."""
+        skeleton = {
+            "plan_title": "T",
+            "plan_summary": "S",
+            "plan_weeks": [{"week_number": 1, "days": [{"day": "Monday"}]}],
+        }
+        bad_week = {"days": [{"day": "Monday", "workout": [{"type": "yoga"}]}]}
+        with self.assertRaisesRegex(PlanSchemaError, "exercise is missing"):
+            merge_plan_parts(skeleton, [bad_week])
+
+
+@latency_histograms
+@generation_lock
+@mock.patch("fitness.tasks.publish_plan_ready")
+@mock.patch("fitness.tasks.set_cached_plan")
+@mock.patch("fitness.tasks.get_cached_plan", return_value=None)
+class PlanGenerationRetryTest(TestCase):
+    """Tests retries, schema repair and idempotency of plan generation."""
+
+    def setUp(self):
+        user = User.objects.create_user(username="retry_user", password="pw")
+        self.plan = TrainingPlan.objects.create(user=user.userprofile, plan_json={})
+
+    def test_transient_error_is_retried(self, *mocks):
+        """Tests a timeout is retried instead of failing the plan."""
+        timeout = anthropic.APITimeoutError(
+            request=httpx.Request("POST", "https://api.anthropic.com")
+        )
+        with mock.patch(
+            "fitness.tasks.request_plan_from_claude",
+            side_effect=[timeout, SAMPLE_PLAN],
+        ) as request_plan:
+            generate_training_plan_task.apply(args=[self.plan.pk])
+        self.assertEqual(request_plan.call_count, 2)
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.plan_json, SAMPLE_PLAN)
+
+    def test_overloaded_error_is_retried(self, *mocks):
+        """Tests a 529 Overloaded response is retried like other 5xx."""
+        request = httpx.Request("POST", "https://api.anthropic.com")
+        # Built the way the SDK builds it from a real 529 response
+        overloaded = anthropic.Anthropic(api_key="test")._make_status_error(
+            "Overloaded", body=None, response=httpx.Response(529, request=request)
+        )
+        with mock.patch(
+            "fitness.tasks.request_plan_from_claude",
+            side_effect=[overloaded, SAMPLE_PLAN],
+        ) as request_plan:
+            generate_training_plan_task.apply(args=[self.plan.pk])
+        self.assertEqual(request_plan.call_count, 2)
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.plan_json, SAMPLE_PLAN)
+
+    @mock.patch("fitness.tasks.request_plan_from_claude")
+    def test_completed_plan_is_not_regenerated(self, request_plan, *mocks):
+        """Tests a duplicated delivery leaves a finished plan alone."""
+        self.plan.plan_json = SAMPLE_PLAN
+        self.plan.save()
+        generate_training_plan_task(self.plan.pk)
+        request_plan.assert_not_called()
+
+    def test_invalid_plan_gets_one_repair_prompt(self, *mocks):
+        """Tests a plan missing weeks is re-requested with the error."""
+        bad = SimpleNamespace(
+            id="toolu_1", type="tool_use", name="get_plan_json", input={}
+        )
+        good = SimpleNamespace(
+            id="toolu_2", type="tool_use", name="get_plan_json", input=SAMPLE_PLAN
+        )
+        create = mock.Mock(
+            side_effect=[
+                SimpleNamespace(content=[bad]),
+                SimpleNamespace(content=[good]),
+            ]
+        )
+        client = SimpleNamespace(messages=SimpleNamespace(create=create))
+        with mock.patch("fitness.tasks.get_anthropic_client", return_value=client):
+            self.assertEqual(request_plan_from_claude("prompt"), SAMPLE_PLAN)
+        repair_messages = create.call_args.kwargs["messages"]
+        self.assertEqual(repair_messages[-1]["content"][0]["type"], "tool_result")
+        self.assertTrue(repair_messages[-1]["content"][0]["is_error"])
+
+    def test_malformed_plan_is_repaired_not_accepted(self, *mocks):
+        """Tests wrong types and missing keys go through the repair call."""
+        week = {"week_number": 1, "days": [{"day": "Monday"}]}
+        malformed = dict(SAMPLE_PLAN, plan_weeks=[week])
+        bad = SimpleNamespace(
+            id="toolu_1", type="tool_use", name="get_plan_json", input=malformed
+        )
+        good = SimpleNamespace(
+            id="toolu_2", type="tool_use", name="get_plan_json", input=SAMPLE_PLAN
+        )
+        create = mock.Mock(
+            side_effect=[
+                SimpleNamespace(content=[bad]),
+                SimpleNamespace(content=[good]),
+            ]
+        )
+        client = SimpleNamespace(messages=SimpleNamespace(create=create))
+        with mock.patch("fitness.tasks.get_anthropic_client", return_value=client):
+            self.assertEqual(request_plan_from_claude("prompt"), SAMPLE_PLAN)
+        error = create.call_args.kwargs["messages"][-1]["content"][0]["content"]
+        self.assertIn("plan.plan_weeks[0].days[0].workout is missing", error)
+
+
+@latency_histograms
+@generation_lock
+@mock.patch("fitness.tasks.publish_plan_ready")
+@mock.patch("fitness.tasks.set_cached_plan")
+@mock.patch("fitness.tasks.get_cached_plan", return_value=None)
+class PromptCachingTest(TestCase):
+    """Tests the static prompt prefix is cacheable and usage is stored."""
+
+    def setUp(self):
+        user = User.objects.create_user(username="cache_user")
+        self.plan = TrainingPlan.objects.create(user=user.userprofile, plan_json={})
+
+    def test_only_user_data_varies(self, *mocks):
+        """Tests the rules sit in the cached system block, not the prompt."""
+        prompt = build_plan_prompt(self.plan)
+        params = plan_request_params(prompt)
+        self.assertNotIn("PLAN RULES", prompt)
+        self.assertIn("PLAN RULES", params["system"][-1]["text"])
+
+    def test_static_prefix_is_marked_cacheable(self, *mocks):
+        """Tests the system block and tool definition carry breakpoints."""
+        params = plan_request_params(build_plan_prompt(self.plan))
+        ephemeral = {"type": "ephemeral"}
+        self.assertEqual(params["system"][-1]["cache_control"], ephemeral)
+        self.assertEqual(params["tools"][-1]["cache_control"], ephemeral)
+        self.assertNotIn("cache_control", PLAN_TOOL)
+        self.assertIsInstance(params["messages"][0]["content"], str)
+
+    def test_cache_token_usage_is_recorded(self, *mocks):
+        """Tests cache reads and writes from the response are saved."""
+        message = SimpleNamespace(
+            content=[
+                SimpleNamespace(
+                    id="toolu_1",
+                    type="tool_use",
+                    name="get_plan_json",
+                    input=SAMPLE_PLAN,
+                )
+            ],
+            usage=SimpleNamespace(
+                input_tokens=300,
+                output_tokens=2000,
+                cache_read_input_tokens=1500,
+                cache_creation_input_tokens=0,
+            ),
+        )
+        client = SimpleNamespace(
+            messages=SimpleNamespace(create=mock.Mock(return_value=message))
+        )
+        with mock.patch("fitness.tasks.get_anthropic_client", return_value=client):
+            generate_training_plan_task(self.plan.pk)
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.input_tokens, 300)
+        self.assertEqual(self.plan.output_tokens, 2000)
+        self.assertEqual(self.plan.cache_read_tokens, 1500)
+        self.assertEqual(self.plan.cache_write_tokens, 0)
+
+
+class PromptBuilderTest(TestCase):
+    """Tests the compact, token-budgeted plan prompt."""
+
+    def setUp(self):
+        user = User.objects.create_user(username="prompt_user")
+        self.profile = user.userprofile
+        self.profile.fitness_level = "intermediate"
+        self.profile.equipment_text = "Dumbbells"
+        self.profile.save()
+        self.plan = TrainingPlan.objects.create(
+            user=self.profile, plan_json={}, plan_preferences="More <b>hills</b>"
+        )
+
+    def payload(self):
+        prompt = build_plan_prompt(self.plan)
+        return json.loads(prompt.removeprefix("User profile data: "))
+
+    def test_fields_are_sent_once(self):
+        """Tests each field appears once, canonically named, without HTML."""
+        payload = self.payload()
+        self.assertEqual(payload["fitness_level"], "Intermediate (Regular exercise)")
+        self.assertEqual(payload["plan_preferences"], "More hills")
+        self.assertNotIn("Fitness_Level", payload)
+        self.assertNotIn("Exercise_Duration_Minutes", payload)
+
+    @override_settings(PLAN_PROMPT_FIELD_TOKENS=1000, PLAN_PROMPT_TOKEN_BUDGET=300)
+    def test_overlong_text_fits_budget_keeping_injuries(self):
+        """Tests long free text is trimmed to the budget, injuries last."""
+        self.profile.injuries_and_limitations = "Bad left knee. " * 20
+        self.profile.save()
+        self.plan.plan_preferences = "I like running up big hills. " * 100
+        self.plan.save()
+        prompt = build_plan_prompt(self.plan)
+        self.assertLessEqual(estimate_tokens(prompt), 300)
+        payload = self.payload()
+        self.assertEqual(
+            payload["long_term_injuries"], ("Bad left knee. " * 20).strip()
+        )
+        self.assertTrue(payload["plan_preferences"].endswith("…"))
+
+    def test_max_tokens_follows_training_days(self):
+        """Tests fewer training days ask for fewer output tokens."""
+        self.assertLess(plan_max_tokens(2), plan_max_tokens(6))
+        self.assertLessEqual(plan_max_tokens(7), 8192)
+
+
+def two_week_plan():
+    day = {"day": "Monday", "workout": [{"exercise": "Squats", "type": "strength"}]}
+    return {
+        "plan_title": "Base",
+        "plan_summary": "Old summary.",
+        "plan_weeks": [{"week_number": n, "days": [dict(day)]} for n in (1, 2)],
+    }
+
+
+@generation_lock
+@mock.patch("fitness.tasks.publish_plan_ready")
+class PlanRevisionTest(TestCase):
+    """Tests revisions only rewrite the days Claude patches."""
+
+    def setUp(self):
+        profile = User.objects.create_user(username="revise_user").userprofile
+        self.base = TrainingPlan.objects.create(user=profile, plan_json=two_week_plan())
+        self.revision = TrainingPlan.objects.create(
+            user=profile,
+            previous_plan=self.base,
+            minor_injuries="Sore knee",
+            plan_json=dict(two_week_plan(), draft=True),
+        )
+
+    def test_patch_replaces_only_changed_days(self, publish):
+        """Tests untouched days are kept and the revision is saved."""
+        swim = [{"exercise": "Swim", "type": "cardio", "sets": 1}]
+        patch = {"changed_days": [{"week_number": 2, "day": "monday", "workout": swim}]}
+        tool_use = SimpleNamespace(type="tool_use", name="get_plan_patch", input=patch)
+        message = SimpleNamespace(
+            content=[tool_use], usage=SimpleNamespace(output_tokens=30)
+        )
+        with mock.patch("fitness.tasks.routed_create", return_value=message) as create:
+            revise_training_plan_task(self.revision.pk)
+        prompt = create.call_args.args[1]["messages"][0]["content"]
+        self.assertIn('"minor_injuries":{"before":"","after":"Sore knee"}', prompt)
+        self.revision.refresh_from_db()
+        weeks = self.revision.plan_json["plan_weeks"]
+        self.assertEqual(weeks[0]["days"][0]["workout"][0]["exercise"], "Squats")
+        self.assertEqual(weeks[1]["days"][0]["workout"], swim)
+        self.assertNotIn("draft", self.revision.plan_json)
+        self.assertEqual(self.revision.output_tokens, 30)
+
+    @override_settings(PLAN_LOCAL_FALLBACK=True)
+    def test_failed_revision_keeps_the_previous_plan(self, publish):
+        """Tests a failed patch leaves the prior plan, not a local one."""
+        with (
+            mock.patch(
+                "fitness.tasks.routed_create", side_effect=ValueError("bad patch")
+            ),
+            self.assertLogs("fitness.tasks", "ERROR"),
+        ):
+            revise_training_plan_task(self.revision.pk)
+        self.revision.refresh_from_db()
+        plan_json = self.revision.plan_json
+        self.assertEqual(plan_json["plan_weeks"], two_week_plan()["plan_weeks"])
+        self.assertNotIn("generated_by", plan_json)
+        self.assertIn("bad patch", plan_json["revision_error"])
+        self.assertEqual(self.revision.status, STATUS_READY)
+        publish.assert_called_once_with(self.revision.pk, "error")
+
+    def test_successful_revision_clears_an_earlier_failure(self, publish):
+        """Tests a revision after a failed one drops the failure note."""
+        with (
+            mock.patch(
+                "fitness.tasks.routed_create", side_effect=ValueError("bad patch")
+            ),
+            self.assertLogs("fitness.tasks", "ERROR"),
+        ):
+            revise_training_plan_task(self.revision.pk)
+        self.revision.refresh_from_db()
+        # Copied whole, as revise_plan used to, so the patch must drop it
+        retry = TrainingPlan.objects.create(
+            user=self.revision.user,
+            previous_plan=self.revision,
+            minor_injuries="Sore knee and ankle",
+            plan_json=dict(self.revision.plan_json, draft=True),
+        )
+        swim = [{"exercise": "Swim", "type": "cardio", "sets": 1}]
+        patch = {"changed_days": [{"week_number": 1, "day": "Monday", "workout": swim}]}
+        tool_use = SimpleNamespace(type="tool_use", name="get_plan_patch", input=patch)
+        message = SimpleNamespace(content=[tool_use])
+        with mock.patch("fitness.tasks.routed_create", return_value=message):
+            revise_training_plan_task(retry.pk)
+        retry.refresh_from_db()
+        self.assertNotIn("revision_error", retry.plan_json)
+        self.assertEqual(retry.plan_json["plan_weeks"][0]["days"][0]["workout"], swim)
+
+    def test_revision_finished_while_waiting_for_the_lock(self, publish):
+        """Tests a revision completed before the lock was taken is kept."""
+
+        def finish_then_lock(plan_id):
+            TrainingPlan.objects.filter(pk=plan_id).update(plan_json=two_week_plan())
+            return mock.Mock(), True
+
+        with (
+            mock.patch("fitness.tasks.acquire_generation_lock", finish_then_lock),
+            mock.patch("fitness.tasks.routed_create") as create,
+        ):
+            revise_training_plan_task(self.revision.pk)
+        create.assert_not_called()
+        publish.assert_not_called()
+
+    def test_patch_for_a_missing_day_is_rejected(self, publish):
+        """Tests a patch can't invent days the plan doesn't have."""
+        patch = {"changed_days": [{"week_number": 1, "day": "Friday", "workout": []}]}
+        with self.assertRaisesRegex(PlanSchemaError, "No Friday in week 1"):
+            apply_plan_patch(two_week_plan(), patch)
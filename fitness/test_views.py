@@ -1,10 +1,22 @@
+import asyncio
+from io import StringIO
+from unittest import mock
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.db import connection
 from django.urls import reverse
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.db.models.signals import post_save
+from fitness import events
 from fitness.signals import create_user_profile, save_user_profile
 from fitness.models import UserProfile, TrainingPlan, Comment, FollowRequest
 from fitness.forms import UserProfileForm
+from fitness.pagination import encode_token
+from fitness.plan_summary import STATUS_PENDING
+from fitness.tasks import PRIORITY_FIRST_PLAN, PRIORITY_NEW_PLAN, PRIORITY_RETRY
 from datetime import date, timedelta
 
 
@@ -162,6 +174,50 @@ class FitnessViewsTest(TestCase):
         )  # Should include user1 and user2
 
 
+@mock.patch("fitness.views.revise_training_plan_task.apply_async")
+class RevisePlanViewTest(TestCase):
+    """Tests revising a finished plan creates a linked revision."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="reviser", password="pw")
+        self.plan = TrainingPlan.objects.create(
+            user=self.user.userprofile,
+            plan_json={"plan_title": "Base", "plan_summary": "", "plan_weeks": []},
+            minor_injuries="",
+        )
+        self.url = reverse("revise_plan", kwargs={"pk": self.plan.pk})
+        self.client.login(username="reviser", password="pw")
+
+    def test_changed_inputs_queue_a_revision(self, apply_async):
+        """Tests the revision links back and starts as the old plan."""
+        response = self.client.post(self.url, {"minor_injuries": "Sore knee"})
+        revision = TrainingPlan.objects.get(previous_plan=self.plan)
+        self.assertRedirects(
+            response, reverse("plan_detail", kwargs={"pk": revision.pk})
+        )
+        self.assertTrue(revision.plan_json["draft"])
+        self.assertEqual(revision.minor_injuries, "Sore knee")
+        apply_async.assert_called_once_with(
+            args=[revision.pk], priority=PRIORITY_NEW_PLAN
+        )
+
+    def test_earlier_revision_failure_is_not_copied(self, apply_async):
+        """Tests the new draft starts without an old revision_error."""
+        self.plan.plan_json = dict(
+            self.plan.plan_json, revision_error="Revision failed: timeout"
+        )
+        self.plan.save()
+        self.client.post(self.url, {"minor_injuries": "Sore knee"})
+        revision = TrainingPlan.objects.get(previous_plan=self.plan)
+        self.assertNotIn("revision_error", revision.plan_json)
+
+    def test_unchanged_inputs_do_nothing(self, apply_async):
+        """Tests no revision is made when nothing was changed."""
+        self.client.post(self.url, {"minor_injuries": ""})
+        self.assertFalse(TrainingPlan.objects.filter(previous_plan=self.plan))
+        apply_async.assert_not_called()
+
+
 class DeletePlanAndRetryViewTest(TestCase):
     """Tests for the delete_plan_and_retry view, covering authorization,
     deletion, and redirection logic."""
@@ -340,3 +396,504 @@ class FitnessSocialTests(TestCase):
         )
         follow_request.refresh_from_db()
         self.assertTrue(follow_request.accepted)
+
+    def test_approve_follow_request_updates_counters(self):
+        """Tests approving a follow bumps both profiles' counters once."""
+        follow_request = FollowRequest.objects.create(
+            from_user=self.profile_author, to_user=self.profile_target
+        )
+        self.client.login(username="comment_target", password="test_password")
+        url = reverse(
+            "approve_follow_request", kwargs={"request_id": follow_request.pk}
+        )
+        self.client.post(url)
+        self.client.post(url)  # approving twice must not double count
+        self.profile_target.refresh_from_db()
+        self.profile_author.refresh_from_db()
+        self.assertEqual(self.profile_target.followers_count, 1)
+        self.assertEqual(self.profile_author.following_count, 1)
+        # Removing the follow decrements the counters again
+        follow_request.refresh_from_db()
+        follow_request.delete()
+        self.profile_target.refresh_from_db()
+        self.profile_author.refresh_from_db()
+        self.assertEqual(self.profile_target.followers_count, 0)
+        self.assertEqual(self.profile_author.following_count, 0)
+
+    def test_rebuild_follow_counts_command(self):
+        """Tests the management command rebuilds counters from follows."""
+        FollowRequest.objects.create(
+            from_user=self.profile_author, to_user=self.profile_target, accepted=True
+        )
+        call_command("rebuild_follow_counts", stdout=StringIO())
+        self.profile_target.refresh_from_db()
+        self.profile_author.refresh_from_db()
+        self.assertEqual(self.profile_target.public_profile()["followers_count"], 1)
+        self.assertEqual(self.profile_author.public_profile()["following_count"], 1)
+        self.assertEqual(self.profile_author.followers_count, 0)
+
+
+class FakePubSub:
+    """Async pubsub double that hands out queued messages; None means the
+    wait timed out with nothing published."""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.channels = []
+        self.timeouts = []
+        self.closed = False
+
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+
+    async def get_message(self, ignore_subscribe_messages, timeout):
+        self.timeouts.append(timeout)
+        message = self.messages.pop(0) if self.messages else None
+        if message is None:
+            await asyncio.sleep(timeout)
+        return message
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeAsyncRedis:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+        self.closed = False
+
+    def pubsub(self):
+        return self._pubsub
+
+    async def aclose(self):
+        self.closed = True
+
+
+class PlanEventsViewTest(TestCase):
+    """Tests for the Server-Sent Events plan readiness stream."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="plan_waiter", password="testpassword"
+        )
+        self.plan = TrainingPlan.objects.create(
+            user=self.user.userprofile,
+            plan_json={"plan_weeks": [{"week_number": 1, "days": []}]},
+        )
+        self.url = reverse("plan_events", kwargs={"pk": self.plan.pk})
+
+    async def test_finished_plan_sends_ready_immediately(self):
+        """Tests a finished plan gets a single 'ready' event."""
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(body, b"event: ready\ndata: \n\n")
+
+    async def stream(self, pubsub):
+        """The body plan_events streams for a pending plan over ``pubsub``."""
+        await TrainingPlan.objects.filter(pk=self.plan.pk).aupdate(
+            plan_json={}, status=STATUS_PENDING
+        )
+        await self.async_client.aforce_login(self.user)
+        client = FakeAsyncRedis(pubsub)
+        with mock.patch.object(events.aioredis.Redis, "from_url", return_value=client):
+            response = await self.async_client.get(self.url)
+            body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertTrue(pubsub.closed)
+        self.assertTrue(client.closed)
+        return body
+
+    async def test_published_event_is_streamed_then_closed(self):
+        """Tests a pending plan subscribes, relays one event and ends."""
+        pubsub = FakePubSub([{"data": b"week"}, {"data": b"ready"}])
+        body = await self.stream(pubsub)
+        self.assertEqual(pubsub.channels, [events.plan_channel(self.plan.pk)])
+        self.assertEqual(body, b"event: week\ndata: \n\n")
+        # The stream ended after the first event, leaving the second unread
+        self.assertEqual(len(pubsub.messages), 1)
+
+    @mock.patch.object(events, "HEARTBEAT_SECONDS", 0.01)
+    @mock.patch.object(events, "STREAM_TIMEOUT_SECONDS", 0.05)
+    async def test_quiet_stream_sends_keep_alives_then_times_out(self):
+        """Tests an idle wait sends heartbeats and ends with 'timeout'."""
+        pubsub = FakePubSub([])
+        body = (await self.stream(pubsub)).decode()
+        frames = body.split("\n\n")[:-1]
+        self.assertGreaterEqual(len(frames), 2)
+        self.assertEqual(set(frames[:-1]), {": keep-alive"})
+        self.assertEqual(frames[-1], "event: timeout\ndata: ")
+        self.assertEqual(set(pubsub.timeouts), {0.01})
+
+
+class PlanStatusViewTest(TestCase):
+    """Tests for the JSON plan status endpoint."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="status_user", password="testpassword"
+        )
+        self.plan = TrainingPlan.objects.create(
+            user=self.user.userprofile, plan_json={}
+        )
+        self.url = reverse("plan_status", kwargs={"pk": self.plan.pk})
+        self.client.login(username="status_user", password="testpassword")
+
+    def test_status_reports_state_from_plan_json(self):
+        """Tests the state follows the plan_json keys."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["state"], "pending")
+        self.plan.plan_json = {"plan_weeks": [{"week_number": 1, "days": []}]}
+        self.plan.save()
+        self.assertEqual(self.client.get(self.url).json()["state"], "ready")
+        self.plan.plan_json = {"error": "Generation failed"}
+        self.plan.save()
+        self.assertEqual(self.client.get(self.url).json()["state"], "error")
+
+    def test_partial_plan_is_generating(self):
+        """Tests a streamed plan with some weeks saved reports generating."""
+        self.plan.plan_json = {
+            "plan_weeks": [{"week_number": 1, "days": []}],
+            "partial": True,
+        }
+        self.plan.save()
+        self.assertEqual(self.client.get(self.url).json()["state"], "generating")
+        response = self.client.get(reverse("plan_detail", kwargs={"pk": self.plan.pk}))
+        self.assertFalse(response.context["is_complete"])
+        self.assertContains(response, "Week 1")
+        self.assertContains(response, "Generating the rest of your plan")
+
+    def test_status_supports_conditional_get(self):
+        """Tests a matching If-None-Match gets a 304 until the plan changes."""
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.plan.plan_json = {"plan_weeks": [{"week_number": 1, "days": []}]}
+        self.plan.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@mock.patch("fitness.tasks.ai_queue_depth", return_value=0)
+@mock.patch("fitness.views.generate_training_plan_task.apply_async")
+class CreateTrainingPlanQueueTest(TestCase):
+    """Tests plan generation is queued with the right priority."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="queue_user", password="testpassword"
+        )
+        self.client.login(username="queue_user", password="testpassword")
+        self.url = reverse("create_training_plan")
+
+    def test_first_plan_gets_top_priority(self, apply_async, depth):
+        """Tests a user's first plan is queued ahead of others."""
+        self.client.post(self.url, {"minor_injuries": ""})
+        depth.assert_called_once()
+        self.assertEqual(apply_async.call_args.kwargs["priority"], PRIORITY_FIRST_PLAN)
+
+    def test_retry_is_queued_behind_first_plans(self, apply_async, depth):
+        """Tests a plan requested after delete_plan_and_retry is lower priority."""
+        self.client.post(self.url, {"minor_injuries": ""})
+        plan = TrainingPlan.objects.get(user=self.user.userprofile)
+        self.client.post(reverse("delete_plan_and_retry", kwargs={"pk": plan.pk}))
+        self.client.post(self.url, {"minor_injuries": ""})
+        self.assertEqual(apply_async.call_args.kwargs["priority"], PRIORITY_RETRY)
+
+
+class PlanDetailFragmentCacheTest(TestCase):
+    """Tests the cached week grid on the plan detail page."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="cache_user", password="testpassword"
+        )
+        self.plan = TrainingPlan.objects.create(
+            user=self.user.userprofile,
+            plan_json={"plan_weeks": [self.week("Push Ups")]},
+        )
+        self.url = reverse("plan_detail", kwargs={"pk": self.plan.pk})
+        self.client.login(username="cache_user", password="testpassword")
+
+    def tearDown(self):
+        cache.clear()
+
+    @staticmethod
+    def week(exercise):
+        workout = [{"exercise": exercise, "type": "strength", "sets": 3}]
+        return {"week_number": 1, "days": [{"day": "Monday", "workout": workout}]}
+
+    def test_plan_version_only_changes_with_plan_json(self):
+        """Tests saving other fields keeps the cached grid's version."""
+        version = self.plan.plan_version
+        self.plan.plan_title = "Renamed"
+        self.plan.save()
+        self.assertEqual(self.plan.plan_version, version)
+        self.plan.plan_json = {"plan_weeks": [self.week("Squats")]}
+        self.plan.save()
+        self.assertEqual(self.plan.plan_version, version + 1)
+
+    def test_changed_plan_json_is_saved_with_other_update_fields(self):
+        """Tests update_fields without plan_json still writes the new plan."""
+        self.plan.plan_json = {"plan_weeks": [self.week("Squats")]}
+        self.plan.plan_title = "Renamed"
+        self.plan.save(update_fields=["plan_title"])
+        stored = TrainingPlan.objects.get(pk=self.plan.pk)
+        self.assertEqual(stored.plan_title, "Renamed")
+        self.assertEqual(stored.plan_json, self.plan.plan_json)
+        self.assertEqual(stored.plan_version, self.plan.plan_version)
+        self.assertEqual(stored.total_sets, 3)
+
+    def test_loading_plans_does_not_serialise_plan_json(self):
+        """Tests from_db doesn't re-encode each plan it loads."""
+        with mock.patch("json.dumps") as dumps:
+            plan = TrainingPlan.objects.get(pk=self.plan.pk)
+        dumps.assert_not_called()
+        plan.save()
+        self.assertEqual(plan.plan_version, self.plan.plan_version)
+
+    def test_grid_is_rendered_through_get_or_set(self):
+        """Tests a missing grid goes through the stampede-safe get_or_set."""
+        with mock.patch(
+            "fitness.views.cache.get_or_set", wraps=cache.get_or_set
+        ) as get_or_set:
+            self.assertContains(self.client.get(self.url), "Push Ups")
+        key = make_template_fragment_key(
+            TrainingPlan.WEEKS_FRAGMENT, [self.plan.pk, self.plan.plan_version]
+        )
+        self.assertEqual(get_or_set.call_args.args[0], key)
+        self.assertIn("Push Ups", cache.get(key))
+
+    def test_grid_is_served_from_cache_until_plan_json_changes(self):
+        """Tests the week grid is cached and refreshed on a plan_json save."""
+        self.assertContains(self.client.get(self.url), "Push Ups")
+        # Bypass save() so the cached grid is still considered current
+        TrainingPlan.objects.filter(pk=self.plan.pk).update(
+            plan_json={"plan_weeks": [self.week("Lunges")]}
+        )
+        self.assertContains(self.client.get(self.url), "Push Ups")
+        self.plan.plan_json = {"plan_weeks": [self.week("Squats")]}
+        self.plan.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, "Squats")
+        self.assertNotContains(response, "Push Ups")
+
+
+class ProfileDetailQueryCountTest(TestCase):
+    """Tests profile_detail loads comment threads in constant queries."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.viewer = User.objects.create_user(username="viewer", password="pw")
+        FollowRequest.objects.create(
+            from_user=self.viewer.userprofile,
+            to_user=self.owner.userprofile,
+            accepted=True,
+        )
+        self.url = reverse("profile_detail", kwargs={"username": "owner"})
+        self.client.login(username="viewer", password="pw")
+
+    def add_thread(self, replies):
+        comment = Comment.objects.create(
+            author=self.viewer.userprofile,
+            profile=self.owner.userprofile,
+            content="Comment",
+        )
+        for _ in range(replies):
+            Comment.objects.create(
+                author=self.owner.userprofile,
+                profile=self.owner.userprofile,
+                parent=comment,
+                content="Reply",
+            )
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_thread_size(self):
+        """Tests 1 comment and 20 comments with replies cost the same."""
+        self.add_thread(replies=1)
+        small = self.count_queries()
+        for _ in range(20):
+            self.add_thread(replies=3)
+        self.assertEqual(self.count_queries(), small)
+
+    def test_follow_checks_use_a_single_query(self):
+        """Tests the viewer sees the owner as followed and can comment."""
+        response = self.client.get(self.url)
+        self.assertTrue(response.context["is_following"])
+        self.assertTrue(response.context["can_comment"])
+
+
+class KeysetPaginationTest(TestCase):
+    """Tests keyset pagination of the profile search results."""
+
+    def setUp(self):
+        for i in range(15):
+            User.objects.create_user(username=f"runner{i:02d}")
+        self.url = reverse("search_profiles_by_username")
+
+    def test_pages_follow_tokens_without_overlap(self):
+        """Tests walking the page tokens visits every profile once."""
+        seen = []
+        params = {"q": "runner"}
+        while True:
+            response = self.client.get(self.url, params)
+            seen += [p.user.username for p in response.context["profiles"]]
+            if not response.context["next_page"]:
+                break
+            params["after"] = response.context["next_page"]
+        self.assertEqual(seen, [f"runner{i:02d}" for i in range(15)])
+
+    def test_invalid_token_returns_first_page(self):
+        """Tests a garbled page token falls back to the first page."""
+        response = self.client.get(self.url, {"q": "runner", "after": "!!bad"})
+        self.assertEqual(response.context["profiles"][0].user.username, "runner00")
+
+    def test_token_with_wrong_value_type_returns_first_page(self):
+        """Tests a decodable token holding a non-date value isn't a 500."""
+        user = User.objects.create_user(username="planner", password="pw")
+        plan = TrainingPlan.objects.create(user=user.userprofile, plan_json={})
+        self.client.login(username="planner", password="pw")
+        response = self.client.get(
+            reverse("previous_plans"), {"after": encode_token("notadate", 1)}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["plans"]), [plan])
+
+
+class UserProfileSignalWritesTest(TestCase):
+    """Tests User saves only write to the profile when they need to."""
+
+    def profile_writes(self, action):
+        with CaptureQueriesContext(connection) as queries:
+            action()
+        return [
+            q["sql"]
+            for q in queries.captured_queries
+            if q["sql"].startswith(("INSERT", "UPDATE"))
+            and "fitness_userprofile" in q["sql"]
+        ]
+
+    def test_signup_creates_profile_in_one_insert(self):
+        """Tests signup writes the finished profile in a single INSERT."""
+        writes = self.profile_writes(
+            lambda: self.client.post(
+                reverse("signup"),
+                {
+                    "username": "newrunner",
+                    "password1": "a-Strong-pass-123",
+                    "password2": "a-Strong-pass-123",
+                },
+            )
+        )
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith("INSERT"))
+        profile = UserProfile.objects.get(user__username="newrunner")
+        self.assertEqual(profile.display_name, "newrunner")
+        self.assertEqual(profile.bio, UserProfile.DEFAULT_BIO)
+
+    def test_login_does_not_write_profile(self):
+        """Tests the last_login update leaves the profile alone."""
+        User.objects.create_user(username="runner", password="a-Strong-pass-123")
+        writes = self.profile_writes(
+            lambda: self.client.login(username="runner", password="a-Strong-pass-123")
+        )
+        self.assertEqual(writes, [])
+
+    def test_username_change_updates_search_document_only(self):
+        """Tests a username change rewrites just the search document."""
+        user = User.objects.create_user(username="runner")
+        updated_at = user.userprofile.updated_at
+        user.username = "trail_runner"
+        writes = self.profile_writes(user.save)
+        self.assertEqual(len(writes), 1)
+        profile = UserProfile.objects.get(user=user)
+        self.assertTrue(profile.search_document.startswith("trail_runner"))
+        self.assertEqual(profile.updated_at, updated_at)
+        self.assertEqual(self.profile_writes(user.save), [])
+
+
+class PlanListDeferredJsonTest(TestCase):
+    """Tests plan list pages don't load the plan_json blob."""
+
+    def test_list_pages_skip_plan_json(self):
+        """Tests previous_plans and profile_detail never select plan_json."""
+        user = User.objects.create_user(username="runner")
+        for _ in range(4):
+            TrainingPlan.objects.create(
+                user=user.userprofile, plan_json={"plan_weeks": [{"days": []}]}
+            )
+        self.client.force_login(user)
+        for url in (
+            reverse("previous_plans"),
+            reverse("profile_detail", args=["runner"]),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, "Training Plan")
+            plan_selects = [
+                q["sql"]
+                for q in queries.captured_queries
+                if q["sql"].startswith("SELECT")
+                and 'FROM "fitness_trainingplan"' in q["sql"]
+            ]
+            self.assertTrue(plan_selects)
+            for sql in plan_selects:
+                self.assertNotIn('"fitness_trainingplan"."plan_json"', sql)
+        self.assertContains(response, "View All Plans (4)")
+
+
+class ExplainQueriesCommandTest(TestCase):
+    """Tests the hot view queries are served from indexes."""
+
+    def test_view_queries_use_indexes(self):
+        """Tests explain_queries finds no full table scans."""
+        runner = User.objects.create_user(username="runner")
+        friend = User.objects.create_user(username="friend")
+        FollowRequest.objects.create(
+            from_user=runner.userprofile, to_user=friend.userprofile, accepted=True
+        )
+        Comment.objects.create(
+            author=runner.userprofile, profile=friend.userprofile, content="Hi"
+        )
+        TrainingPlan.objects.create(
+            user=runner.userprofile, plan_json={"plan_weeks": []}
+        )
+        out = StringIO()
+        call_command("explain_queries", verbose_plans=True, stdout=out)
+        self.assertIn("0 scans", out.getvalue())
+        self.assertIn("comment_profile_thread_idx", out.getvalue())
+        self.assertIn("plan_user_start_idx", out.getvalue())
+
+
+class BenchmarkViewsCommandTest(TestCase):
+    """Tests the synthetic data generator and view benchmark run together."""
+
+    @mock.patch("fitness.tasks.ai_queue_depth", return_value=0)
+    def test_benchmark_leaves_no_rows_behind(self, depth):
+        """Tests fixture rows created for the benchmark are rolled back."""
+        call_command("seed_synthetic_data", users=10, stdout=StringIO())
+        Comment.objects.all().delete()
+        FollowRequest.objects.all().delete()
+        call_command("benchmark_views", repeat=1, warmup=0, stdout=StringIO())
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(FollowRequest.objects.exists())
+
+    @mock.patch("fitness.tasks.ai_queue_depth", return_value=0)
+    def test_seed_and_benchmark_every_url(self, depth):
+        """Tests every fitness URL is benchmarked against seeded data."""
+        out = StringIO()
+        call_command(
+            "benchmark_views", seed=30, repeat=1, warmup=0, stdout=out, stderr=out
+        )
+        self.assertEqual(UserProfile.objects.count(), 30)
+        self.assertTrue(FollowRequest.objects.exists())
+        self.assertTrue(Comment.objects.filter(parent__isnull=True).exists())
+        self.assertNotIn("No benchmark for", out.getvalue())
+        self.assertIn("profile_detail", out.getvalue())
@@ -52,6 +52,9 @@ urlpatterns = [
     path("plans/create/", views.create_training_plan, name="create_training_plan"),
     path("plans/", views.previous_plans, name="previous_plans"),
     path("plans/<int:pk>/", views.plan_detail, name="plan_detail"),
+    path("plans/<int:pk>/events/", views.plan_events, name="plan_events"),
+    path("plans/<int:pk>/status/", views.plan_status, name="plan_status"),
+    path("plans/<int:pk>/revise/", views.revise_plan, name="revise_plan"),
     path(
         "plans/<int:pk>/retry/",
         views.delete_plan_and_retry,
@@ -60,6 +63,7 @@ urlpatterns = [
     # Home page
     path("", views.home, name="home"),
     # Search
+    path("search/", views.search_profiles, name="search_profiles"),
     path(
         "search/username/",
         views.search_profiles_by_username,
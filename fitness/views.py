@@ -1,22 +1,59 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models import Prefetch, Q
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.contrib import messages
-from .forms import CommentForm, UserProfileForm, PlanGenerationForm
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from .forms import CommentForm, UserProfileForm, PlanGenerationForm, PlanRevisionForm
 from .models import UserProfile, TrainingPlan, Comment, FollowRequest
-from .tasks import generate_training_plan_task
+from .tasks import (
+    ai_queue_is_saturated,
+    draft_plan_data,
+    generate_training_plan_task,
+    plan_content,
+    revise_training_plan_task,
+    revision_changes,
+    save_local_plan,
+    PRIORITY_FIRST_PLAN,
+    PRIORITY_NEW_PLAN,
+    PRIORITY_RETRY,
+)
+from .events import plan_ready_stream
+from .pagination import keyset_paginate
+from .plan_summary import STATUS_ERROR, STATUS_READY
+from .search import search_page
 
 # Create your views here.
 
+PROFILES_PER_PAGE = 6
+SEARCH_RESULTS_PER_PAGE = 12
+PLANS_PER_PAGE = 12
+# How long a plan's rendered week grid is cached for
+WEEKS_CACHE_SECONDS = 86400
+
 
 # Public profile view
 def profile_list(request):
     """Displays a list of user profiles."""
-    profiles_queryset = UserProfile.objects.all()
-    profiles = profiles_queryset.order_by("display_name")
+    # Logged in users see their connections instead of the public list
+    profiles, next_page = [], None
+    if not request.user.is_authenticated:
+        profiles, next_page = keyset_paginate(
+            UserProfile.objects.select_related("user"),
+            "display_name",
+            request.GET.get("after"),
+            PROFILES_PER_PAGE,
+        )
     context = {
         "profiles": profiles,
+        "next_page": next_page,
     }
     return render(request, "profiles/profile_list.html", context)
 
@@ -25,37 +62,51 @@ def profile_list(request):
 @login_required
 def profile_detail(request, username):
     """Displays detailed profile information."""
-    profile = get_object_or_404(UserProfile, user__username=username)
-    plans = profile.plans.all().order_by("-start_date")
-    comments = profile.comments_received.filter(
-        approved=True, parent__isnull=True
-    ).order_by("-created_at")
-    comment_form = CommentForm()
+    profile = get_object_or_404(
+        UserProfile.objects.select_related("user"), user__username=username
+    )
+    # List pages never show plan_json, so leave the blob in the database
+    plans = profile.plans.defer("plan_json").order_by("-start_date")
     # Check if this is the user's own profile
     is_owner = request.user == profile.user
+    # Owners also see replies still waiting for their approval
+    replies = Comment.objects.select_related("author__user")
+    if not is_owner:
+        replies = replies.filter(approved=True)
+    comments = (
+        profile.comments_received.filter(approved=True, parent__isnull=True)
+        .select_related("author__user")
+        .prefetch_related(Prefetch("replies", queryset=replies))
+        .order_by("-created_at")
+    )
+    comment_form = CommentForm()
     # Follow requests section
     pending_follow_requests = []
     if is_owner:
         pending_follow_requests = FollowRequest.objects.filter(
             to_user=profile, accepted=False
-        ).select_related("from_user")
-    # Check if current user is following this profile
+        ).select_related("from_user__user")
+    # Accepted follows in either direction between the viewer and profile
     is_following = False
-    if request.user.is_authenticated and not is_owner:
-        is_following = FollowRequest.objects.filter(
-            from_user=request.user.userprofile, to_user=profile, accepted=True
-        ).exists()
-    # Check if profile owner is following current user back (mutual connection)
     profile_follows_user = False
     if request.user.is_authenticated and not is_owner:
-        profile_follows_user = FollowRequest.objects.filter(
-            from_user=profile, to_user=request.user.userprofile, accepted=True
-        ).exists()
+        followed_ids = set(
+            FollowRequest.objects.filter(
+                Q(from_user__user=request.user, to_user=profile)
+                | Q(from_user=profile, to_user__user=request.user),
+                accepted=True,
+            ).values_list("to_user_id", flat=True)
+        )
+        # Current user following this profile
+        is_following = profile.pk in followed_ids
+        # Profile owner following current user back (mutual connection)
+        profile_follows_user = bool(followed_ids - {profile.pk})
     # Can comment if: owner or connected to eaqch other
     can_comment = is_owner or is_following or profile_follows_user
     context = {
         "profile": profile,
-        "previous_plans": plans,
+        "previous_plans": plans[:3],
+        "plan_count": plans.count() if is_owner else None,
         "comments": comments,
         "comment_form": comment_form,
         "is_owner": is_owner,
@@ -97,9 +148,31 @@ def create_training_plan(request):
             # Link to previous plan if it exists
             if last_plan:
                 plan.previous_plan = last_plan
+            if ai_queue_is_saturated():
+                plan.save()
+                save_local_plan(plan, "The AI planner was busy")
+                messages.info(
+                    request,
+                    "The AI planner is busy, so your plan was built from your "
+                    "profile straight away.",
+                )
+                return redirect("plan_detail", pk=plan.pk)
+            if settings.PLAN_INSTANT_DRAFT:
+                plan.plan_json = draft_plan_data(plan)
             plan.save()
+            # First plans jump the ai queue, regenerations wait behind
+            if request.session.pop("plan_retry", False):
+                priority = PRIORITY_RETRY
+            elif last_plan is None:
+                priority = PRIORITY_FIRST_PLAN
+            else:
+                priority = PRIORITY_NEW_PLAN
             # Trigger async celery task
-            generate_training_plan_task.delay(plan.pk)
+            generate_training_plan_task.apply_async(
+                args=[plan.pk],
+                kwargs={"use_cache": not form.cleaned_data["fresh_plan"]},
+                priority=priority,
+            )
             messages.success(
                 request,
                 ("Training plan request submitted! " "AI generation is in progress."),
@@ -114,10 +187,14 @@ def create_training_plan(request):
 @login_required
 def previous_plans(request):
     """Displays a list of the user's previously generated training plans"""
-    plans = TrainingPlan.objects.filter(user=request.user.userprofile).order_by(
-        "-target_date"
+    plans, next_page = keyset_paginate(
+        TrainingPlan.objects.filter(user__user=request.user).defer("plan_json"),
+        "start_date",
+        request.GET.get("after"),
+        PLANS_PER_PAGE,
+        descending=True,
     )
-    context = {"plans": plans}
+    context = {"plans": plans, "next_page": next_page}
     return render(request, "plans/previous_plans.html", context)
 
 
@@ -126,18 +203,113 @@ def plan_detail(request, pk):
     """Displays the detail of a generated training plan."""
     plan = get_object_or_404(TrainingPlan, pk=pk)
     is_owner = request.user == plan.user.user
-    is_complete = bool(
-        plan.plan_json
-        and (plan.plan_json.get("plan_weeks") or plan.plan_json.get("error"))
-    )
+    # Streamed plans are "generating" until their last week is saved
+    is_complete = plan.status in (STATUS_READY, STATUS_ERROR)
     context = {
         "plan": plan,
         "is_owner": is_owner,
         "is_complete": is_complete,
+        "weeks_html": "",
     }
+    plan_json = plan.plan_json if isinstance(plan.plan_json, dict) else {}
+    if plan_json.get("plan_weeks") and not plan_json.get("error"):
+        # get_or_set so only one request renders a grid that isn't cached
+        context["weeks_html"] = cache.get_or_set(
+            make_template_fragment_key(
+                TrainingPlan.WEEKS_FRAGMENT, [plan.pk, plan.plan_version]
+            ),
+            lambda: render_to_string("plans/plan_weeks.html", {"plan": plan}),
+            WEEKS_CACHE_SECONDS,
+        )
     return render(request, "plans/plan_detail.html", context)
 
 
+def _plan_status_queryset(pk):
+    """Only the stored status columns, so the plan_json blob isn't loaded."""
+    return TrainingPlan.objects.filter(pk=pk).values("updated_at", "status")
+
+
+@login_required
+def plan_status(request, pk):
+    """Lightweight JSON readiness check for a plan, supporting ETags."""
+    status = _plan_status_queryset(pk).first()
+    if status is None:
+        raise Http404("No TrainingPlan matches the given query.")
+    state = status["status"]
+    updated_at = status["updated_at"]
+    etag = quote_etag(f"{state}-{updated_at.timestamp()}")
+    response = JsonResponse({"state": state, "updated_at": updated_at})
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+async def _plan_finished_state(pk):
+    """Return 'error'/'ready' once generation has finished, else None."""
+    status = await _plan_status_queryset(pk).afirst()
+    if status is None or status["status"] not in (STATUS_READY, STATUS_ERROR):
+        return None
+    return status["status"]
+
+
+@login_required
+async def plan_events(request, pk):
+    """Server-Sent Events stream that fires once when the plan is ready.
+    Served by the ASGI app so waiting browsers don't hold a worker."""
+    if not await TrainingPlan.objects.filter(pk=pk).aexists():
+        raise Http404("No TrainingPlan matches the given query.")
+    response = StreamingHttpResponse(
+        plan_ready_stream(pk, lambda: _plan_finished_state(pk)),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+def revise_plan(request, pk):
+    """Creates a revision of a finished plan for changed injuries or
+    preferences, rewriting only the days the changes affect."""
+    plan = get_object_or_404(TrainingPlan, pk=pk)
+    if plan.user.user != request.user:
+        messages.error(request, "You are not authorized to revise this plan.")
+        return redirect("plan_detail", pk=pk)
+    if plan.status != STATUS_READY:
+        messages.error(request, "Only a finished plan can be revised.")
+        return redirect("plan_detail", pk=pk)
+    if request.method == "POST":
+        form = PlanRevisionForm(request.POST)
+        if form.is_valid():
+            revision = form.save(commit=False)
+            revision.previous_plan = plan
+            if not revision_changes(revision):
+                messages.info(request, "Nothing changed, so the plan is the same.")
+                return redirect("plan_detail", pk=pk)
+            revision.user = plan.user
+            revision.goal_type = plan.goal_type
+            revision.target_event = plan.target_event
+            revision.target_date = plan.target_date
+            revision.plan_title = plan.plan_title
+            revision.plan_summary = plan.plan_summary
+            # Shown as a draft until the affected days are rewritten
+            revision.plan_json = dict(plan_content(plan.plan_json), draft=True)
+            revision.save()
+            revise_training_plan_task.apply_async(
+                args=[revision.pk], priority=PRIORITY_NEW_PLAN
+            )
+            messages.success(request, "Revising the days your changes affect.")
+            return redirect("plan_detail", pk=revision.pk)
+    else:
+        form = PlanRevisionForm(
+            initial={
+                "minor_injuries": plan.minor_injuries,
+                "plan_preferences": plan.plan_preferences,
+            }
+        )
+    return render(request, "plans/revise_plan.html", {"form": form, "plan": plan})
+
+
 @login_required
 def delete_plan_and_retry(request, pk):
     """Deletes the specific training plan and triggers a new one."""
@@ -147,6 +319,7 @@ def delete_plan_and_retry(request, pk):
         messages.error(request, "You are not authorized to delete this plan.")
         return redirect("plan_detail", pk=pk)
     plan.delete()
+    request.session["plan_retry"] = True
     messages.info(request, "Training plan deleted. Please create a new one.")
     return redirect("create_training_plan")
 
@@ -259,8 +432,7 @@ def approve_follow_request(request, request_id):
     if follow_request.to_user.user != request.user:
         messages.error(request, "You do not have permission to approve this request.")
         return redirect("profile_detail", username=request.user.username)
-    follow_request.accepted = True
-    follow_request.save()
+    follow_request.accept()
     messages.success(
         request,
         (f"Follow request from {follow_request.from_user.display_name} " "approved!"),
@@ -273,11 +445,8 @@ def signup(request):
     if request.method == "POST":
         form = UserCreationForm(request.POST)
         if form.is_valid():
-            user = form.save()  # Save user
-            profile = user.userprofile
-            profile.display_name = user.username
-            profile.bio = "This user hasn't added a bio yet."
-            profile.save()
+            # The post_save signal creates the profile with its defaults
+            user = form.save()
             login(request, user)  # Log them in
             messages.success(request, "Signup successful!")
             return redirect(
@@ -291,7 +460,7 @@ def signup(request):
 def home(request):
     """Home page view with some profiles and example plans."""
     profiles = UserProfile.objects.all()[:5]  # 5 profiles
-    example_plans = TrainingPlan.objects.all()[:3]  # 3 example plans
+    example_plans = TrainingPlan.objects.defer("plan_json")[:3]  # 3 example plans
     context = {
         "profiles": profiles,
         "example_plans": example_plans,
@@ -300,50 +469,44 @@ def home(request):
 
 
 # Search Views
-def search_profiles_by_username(request):
-    """Searches profiles by username."""
+def _search_profiles(request, field, search_type):
+    """Shared keyset-paginated, indexed profile search. ``field`` limits
+    matches to one field; without it every field is searched, best match
+    first."""
     query = request.GET.get("q", "").strip()
-    profiles = UserProfile.objects.none()
+    profiles, next_page = [], None
+    if query or field:
+        profiles, next_page = search_page(
+            query, request.GET.get("after"), SEARCH_RESULTS_PER_PAGE, field
+        )
     if query:
-        # search not case sensitive because of __icontains
-        profiles = UserProfile.objects.filter(
-            user__username__icontains=query, user__is_active=True
-        ).order_by("user__username")
+        more = "+" if next_page else ""
         messages.info(
-            request, (f"Found {profiles.count()} profiles " f"matching '{query}'.")
-        )
-    else:
-        profiles = UserProfile.objects.filter(user__is_active=True).order_by(
-            "user__username"
+            request, (f"Found {len(profiles)}{more} profiles " f"matching '{query}'.")
         )
-    if not query:
-        query = ""
     return render(
         request,
         "profiles/profile_search_results.html",
-        {"profiles": profiles, "query": query, "search_type": "Username"},
+        {
+            "profiles": profiles,
+            "query": query,
+            "search_type": search_type,
+            "next_page": next_page,
+        },
     )
 
 
+def search_profiles(request):
+    """Searches usernames, names, goal events and bios at once, best
+    match first."""
+    return _search_profiles(request, None, "Profiles")
+
+
+def search_profiles_by_username(request):
+    """Searches profiles by username."""
+    return _search_profiles(request, "user__username", "Username")
+
+
 def search_profiles_by_goal_event(request):
     """Searches profiles by their goal event."""
-    query = request.GET.get("q", "").strip()
-    profiles = UserProfile.objects.none()
-    if query:
-        profiles = UserProfile.objects.filter(
-            goal_event__icontains=query, user__is_active=True
-        ).order_by("user__username")
-        messages.info(
-            request, (f"Found {profiles.count()} profiles " f"matching '{query}'.")
-        )
-    else:
-        profiles = UserProfile.objects.filter(user__is_active=True).order_by(
-            "user__username"
-        )
-    if not query:
-        query = ""
-    return render(
-        request,
-        "profiles/profile_search_results.html",
-        {"profiles": profiles, "query": query, "search_type": "Goal Event"},
-    )
+    return _search_profiles(request, "goal_event", "Goal Event")
@@ -3,6 +3,10 @@ ASGI config for strideai project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The web dyno runs this app (see Procfile) so the async Server-Sent Events
+endpoint ``plans/<pk>/events/`` can hold connections open while a plan is
+generating without tying up a worker per waiting browser.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
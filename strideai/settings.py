@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "cloudinary_storage",
     "cloudinary",
     "django_celery_results",
@@ -59,6 +60,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "fitness.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -69,6 +71,29 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Per-request SQL/cache/template metrics as Server-Timing headers and log
+# lines, for the given fraction of requests. Works without DEBUG.
+REQUEST_METRICS_ENABLED = config("REQUEST_METRICS_ENABLED", default=False, cast=bool)
+REQUEST_METRICS_SAMPLE_RATE = config(
+    "REQUEST_METRICS_SAMPLE_RATE", default=0.1, cast=float
+)
+# A query fingerprint run this many times in one request is logged as N+1
+REQUEST_METRICS_DUPLICATE_THRESHOLD = config(
+    "REQUEST_METRICS_DUPLICATE_THRESHOLD", default=3, cast=int
+)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "fitness": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+# Keep test output to warnings
+if "test" in sys.argv:
+    LOGGING["loggers"]["fitness"]["level"] = "WARNING"
+
 ROOT_URLCONF = "strideai.urls"
 
 TEMPLATES = [
@@ -201,14 +226,6 @@ LOGOUT_REDIRECT_URL = "/accounts/login/"
 # DEFAULT PRIMARY KEY FIELD
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-# Necessary for CELERY_RESULT_BACKEND = 'django-db'
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
-        "LOCATION": "my_cache_table",
-    }
-}
-
 # Celery/Redie  Configuration
 REDIS_URL = config("REDIS_URL", default="redis://127.0.0.1:6379/0")
 
@@ -218,6 +235,23 @@ if REDIS_URL and REDIS_URL.startswith("rediss://"):
 else:
     CELERY_BROKER_URL = REDIS_URL
 
+# Redis cache with a short-lived per-process memory tier in front, so hot
+# keys don't even need a Redis round trip
+CACHES = {
+    "default": {
+        "BACKEND": "fitness.cache_backends.TwoTierRedisCache",
+        "LOCATION": CELERY_BROKER_URL,
+        "KEY_PREFIX": "stride",
+        "OPTIONS": {
+            "L1_MAX_ENTRIES": config("CACHE_L1_MAX_ENTRIES", default=1000, cast=int),
+            "L1_TIMEOUT": config("CACHE_L1_TIMEOUT", default=5, cast=int),
+        },
+    }
+}
+# Tests run without a Redis server, so they use local memory
+if "test" in sys.argv:
+    CACHES["default"] = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+
 CELERY_BROKER_TRANSPORT = "redis"
 
 CELERY_RESULT_BACKEND = "django-db"
@@ -225,5 +259,89 @@ CELERY_RESULT_BACKEND = "django-db"
 # Inform Celery to use the cache backend for the result storage connection
 CELERY_CACHE_BACKEND = "default"
 
+# Route AI generation to its own queue so a burst of plans can't starve
+# the other tasks. Redis only honours priorities with these transport
+# options (0 is the highest of the steps).
+CELERY_TASK_DEFAULT_QUEUE = "default"
+CELERY_TASK_ROUTES = {
+    "fitness.tasks.generate_training_plan_task": {"queue": "ai"},
+    "fitness.tasks.generate_training_plans_async_task": {"queue": "ai"},
+    "fitness.tasks.revise_training_plan_task": {"queue": "ai"},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "queue_order_strategy": "priority",
+    "priority_steps": [0, 3, 6, 9],
+    "sep": ":",
+}
+# Long AI tasks shouldn't be prefetched, or priorities stop applying
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Token-bucket limit (per worker) matching our Claude tier's request rate
+CLAUDE_RATE_LIMIT = config("CLAUDE_RATE_LIMIT", default="50/m")
+CELERY_TASK_ANNOTATIONS = {
+    "fitness.tasks.generate_training_plan_task": {"rate_limit": CLAUDE_RATE_LIMIT},
+    "fitness.tasks.generate_training_plans_async_task": {
+        "rate_limit": CLAUDE_RATE_LIMIT
+    },
+    "fitness.tasks.revise_training_plan_task": {"rate_limit": CLAUDE_RATE_LIMIT},
+}
+
+# Periodic bulk regeneration of ended plans via the Message Batches API
+CELERY_BEAT_SCHEDULE = {
+    "submit-plan-regeneration-batch": {
+        "task": "fitness.tasks.submit_plan_regeneration_batch",
+        "schedule": 60 * 60 * 24,
+    },
+    "poll-plan-batches": {
+        "task": "fitness.tasks.poll_plan_batches",
+        "schedule": 60 * 5,
+    },
+}
+
 # API KEY for Claude AI
 CLAUDE_API_KEY = config("CLAUDE_API_KEY", default="")
+
+# Connection pool for the per-worker-process Anthropic client
+ANTHROPIC_MAX_CONNECTIONS = config("ANTHROPIC_MAX_CONNECTIONS", default=20, cast=int)
+ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS = config(
+    "ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS", default=10, cast=int
+)
+ANTHROPIC_KEEPALIVE_EXPIRY = config(
+    "ANTHROPIC_KEEPALIVE_EXPIRY", default=60.0, cast=float
+)
+
+# Plan model routing (fitness/model_routing.py): requests score a point
+# each for 5+ training days, injuries and feedback (0-3), and those scoring
+# at least PLAN_COMPLEXITY_THRESHOLD (default 2) use the complex model.
+# Attempt deadlines come from each model's latency over the last
+# PLAN_LATENCY_WINDOW_HOURS, capped at PLAN_ATTEMPT_DEADLINE seconds;
+# PLAN_HEDGING sends a duplicate request once a call passes p95.
+PLAN_MODEL_FAST = config("PLAN_MODEL_FAST", default="claude-haiku-4-5-20251001")
+PLAN_MODEL_COMPLEX = config("PLAN_MODEL_COMPLEX", default="claude-sonnet-4-5-20250929")
+PLAN_COMPLEXITY_THRESHOLD = config("PLAN_COMPLEXITY_THRESHOLD", default=2, cast=int)
+PLAN_ATTEMPT_DEADLINE = config("PLAN_ATTEMPT_DEADLINE", default=120, cast=int)
+PLAN_HEDGING = config("PLAN_HEDGING", default=False, cast=bool)
+PLAN_LATENCY_WINDOW_HOURS = config("PLAN_LATENCY_WINDOW_HOURS", default=24, cast=int)
+PLAN_LATENCY_MIN_SAMPLES = config("PLAN_LATENCY_MIN_SAMPLES", default=20, cast=int)
+
+# Redis cache of generated plans, keyed by the normalised prompt
+PLAN_CACHE_TTL = config("PLAN_CACHE_TTL", default=60 * 60 * 24 * 7, cast=int)
+PLAN_CACHE_MAX_ENTRIES = config("PLAN_CACHE_MAX_ENTRIES", default=1000, cast=int)
+
+# Token budgets for the plan prompt: each free-text field, then the whole
+# user message (see fitness/prompt_builder.py)
+PLAN_PROMPT_FIELD_TOKENS = config("PLAN_PROMPT_FIELD_TOKENS", default=150, cast=int)
+PLAN_PROMPT_TOKEN_BUDGET = config("PLAN_PROMPT_TOKEN_BUDGET", default=600, cast=int)
+
+# Local rule-based plans (fitness/plan_engine.py): show one instantly
+# while Claude works, use one when Claude fails, and use one instead of
+# queueing when more than PLAN_QUEUE_SATURATION plans are waiting (0 = off)
+PLAN_INSTANT_DRAFT = config("PLAN_INSTANT_DRAFT", default=False, cast=bool)
+PLAN_LOCAL_FALLBACK = config("PLAN_LOCAL_FALLBACK", default=True, cast=bool)
+PLAN_QUEUE_SATURATION = config("PLAN_QUEUE_SATURATION", default=200, cast=int)
+
+# Stream plan generation and save each week as soon as it is complete
+PLAN_STREAMING = config("PLAN_STREAMING", default=False, cast=bool)
+# Lay the plan out first, then generate its weeks concurrently (takes
+# precedence over PLAN_STREAMING)
+PLAN_PARALLEL_WEEKS = config("PLAN_PARALLEL_WEEKS", default=False, cast=bool)